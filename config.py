@@ -6,4 +6,113 @@ load_dotenv()
 class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-key-please-change-in-production')
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
-    SQLALCHEMY_TRACK_MODIFICATIONS = False 
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Pagination
+    DREAMS_PAGE_SIZE = int(os.getenv('DREAMS_PAGE_SIZE', 20))
+
+    NOTIFICATION_PAGE_SIZE = int(os.getenv('NOTIFICATION_PAGE_SIZE', 20))
+
+    # Per-worker identity cache for the Flask-Login user loader
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 1024))
+    USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 60))
+
+    # Expose per-worker cache hit/miss counters at /api/cache_stats
+    CACHE_STATS_ENABLED = os.getenv('CACHE_STATS_ENABLED', 'false').lower() == 'true'
+
+    # Cache shared by all workers (redis://...); a per-process cache is used when unset
+    SHARED_CACHE_URL = os.getenv('SHARED_CACHE_URL')
+
+    # Per-worker cache of rendered markdown, bounded by entry count and by bytes
+    MARKDOWN_CACHE_SIZE = int(os.getenv('MARKDOWN_CACHE_SIZE', 2048))
+    MARKDOWN_CACHE_BYTES = int(os.getenv('MARKDOWN_CACHE_BYTES', 8 * 1024 * 1024))
+
+    # Rendered template fragments ({% cache %}): 'local' keeps them per worker,
+    # 'shared' uses SHARED_CACHE_URL. The TTL bounds how long another worker's
+    # local copy can lag behind an invalidation.
+    FRAGMENT_CACHE_BACKEND = os.getenv('FRAGMENT_CACHE_BACKEND', 'local')
+    FRAGMENT_CACHE_TTL = int(os.getenv('FRAGMENT_CACHE_TTL', 60))
+
+    # Password hashing is limited per worker process: WORKERS hashes run at
+    # once and QUEUE_DEPTH more requests wait, blocking their request threads.
+    # Logins beyond that get an immediate 503 instead of queueing. Stored hashes made
+    # with a different method are upgraded at the next successful login.
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+    PASSWORD_HASH_QUEUE_DEPTH = int(os.getenv('PASSWORD_HASH_QUEUE_DEPTH', 16))
+
+    # Notification retention: read notifications older than RETENTION_DAYS are
+    # moved to notification_archive ('archive') or dropped ('delete') by the
+    # archive_notifications job, in throttled batches. Archived rows are purged
+    # after NOTIFICATION_ARCHIVE_DAYS (0 keeps them forever).
+    NOTIFICATION_RETENTION_DAYS = int(os.getenv('NOTIFICATION_RETENTION_DAYS', 30))
+    NOTIFICATION_RETENTION_MODE = os.getenv('NOTIFICATION_RETENTION_MODE', 'archive')
+    NOTIFICATION_ARCHIVE_DAYS = int(os.getenv('NOTIFICATION_ARCHIVE_DAYS', 365))
+    NOTIFICATION_ARCHIVE_BATCH_SIZE = int(os.getenv('NOTIFICATION_ARCHIVE_BATCH_SIZE', 1000))
+    NOTIFICATION_ARCHIVE_PAUSE = float(os.getenv('NOTIFICATION_ARCHIVE_PAUSE', 0.1))
+
+    # Server-sent notification events (/notifications/stream). Events reach
+    # streams on every worker through SHARED_CACHE_URL's Redis; without it
+    # only streams held by the publishing worker are notified. A stream that
+    # falls SSE_QUEUE_SIZE events behind is resynchronised with one query.
+    # Every open stream holds a worker thread for up to SSE_MAX_STREAM_SECONDS.
+    # The defaults suit the threaded development server (`python3 app.py`);
+    # raise SSE_MAX_CONNECTIONS only behind an async worker (e.g. gunicorn
+    # -k gevent), or streams will starve ordinary requests.
+    SSE_HEARTBEAT_SECONDS = int(os.getenv('SSE_HEARTBEAT_SECONDS', 15))
+    SSE_QUEUE_SIZE = int(os.getenv('SSE_QUEUE_SIZE', 32))
+    SSE_MAX_CONNECTIONS = int(os.getenv('SSE_MAX_CONNECTIONS', 20))
+    SSE_MAX_STREAM_SECONDS = int(os.getenv('SSE_MAX_STREAM_SECONDS', 120))
+
+    # AI analysis. LLM_BACKEND 'stub' answers with canned text (optionally slow
+    # or failing) so the job queue can be exercised without a provider.
+    LLM_BACKEND = os.getenv('LLM_BACKEND', 'openai')
+    LLM_MODEL = os.getenv('LLM_MODEL', 'gpt-4')
+    OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')
+    STUB_LLM_DELAY = float(os.getenv('STUB_LLM_DELAY', 0))
+    STUB_LLM_ERROR_RATE = float(os.getenv('STUB_LLM_ERROR_RATE', 0))
+
+    # Model calls share one pooled client per worker process. Each call gets
+    # LLM_DEADLINE_SECONDS in total, including queueing for one of the
+    # LLM_MAX_CONCURRENCY slots and up to LLM_MAX_RETRIES jittered retries;
+    # single attempts time out after LLM_TIMEOUT_SECONDS. After
+    # LLM_BREAKER_THRESHOLD consecutive failures calls fail fast for
+    # LLM_BREAKER_RESET_SECONDS. `manage.py benchmark_llm_client` exercises
+    # these settings against a local stub provider.
+    LLM_TIMEOUT_SECONDS = float(os.getenv('LLM_TIMEOUT_SECONDS', 60))
+    LLM_DEADLINE_SECONDS = float(os.getenv('LLM_DEADLINE_SECONDS', 120))
+    LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 3))
+    LLM_RETRY_BASE_SECONDS = float(os.getenv('LLM_RETRY_BASE_SECONDS', 0.5))
+    LLM_RETRY_MAX_SECONDS = float(os.getenv('LLM_RETRY_MAX_SECONDS', 8))
+    LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 8))
+    LLM_BREAKER_THRESHOLD = int(os.getenv('LLM_BREAKER_THRESHOLD', 5))
+    LLM_BREAKER_RESET_SECONDS = float(os.getenv('LLM_BREAKER_RESET_SECONDS', 30))
+
+    # Analysis jobs run in `manage.py run_analysis_worker`. Failed attempts are
+    # retried with jittered exponential backoff; a running job whose worker
+    # has not finished within the lease is handed to another worker.
+    ANALYSIS_JOB_MAX_ATTEMPTS = int(os.getenv('ANALYSIS_JOB_MAX_ATTEMPTS', 3))
+    ANALYSIS_JOB_RETRY_BASE_SECONDS = int(os.getenv('ANALYSIS_JOB_RETRY_BASE_SECONDS', 30))
+    ANALYSIS_JOB_LEASE_SECONDS = int(os.getenv('ANALYSIS_JOB_LEASE_SECONDS', 300))
+    ANALYSIS_WORKER_POLL_SECONDS = float(os.getenv('ANALYSIS_WORKER_POLL_SECONDS', 2))
+
+    # Analyses are cached by a hash of (model, prompt, normalized dream text,
+    # temperature): a per-worker LRU in front of the analysis_cache_entry table.
+    # `manage.py prune_analysis_cache` trims the table to MAX_ROWS by last use.
+    ANALYSIS_CACHE_ENABLED = os.getenv('ANALYSIS_CACHE_ENABLED', 'true').lower() == 'true'
+    ANALYSIS_CACHE_SIZE = int(os.getenv('ANALYSIS_CACHE_SIZE', 512))
+    ANALYSIS_CACHE_TTL_DAYS = int(os.getenv('ANALYSIS_CACHE_TTL_DAYS', 90))
+    ANALYSIS_CACHE_MAX_ROWS = int(os.getenv('ANALYSIS_CACHE_MAX_ROWS', 100_000))
+
+    # Pattern analysis summarizes each dream once, then condenses the
+    # summaries until they fit in PATTERN_TOKEN_BUDGET prompt tokens
+    PATTERN_TOKEN_BUDGET = int(os.getenv('PATTERN_TOKEN_BUDGET', 6000))
+    DREAM_SUMMARY_MAX_TOKENS = int(os.getenv('DREAM_SUMMARY_MAX_TOKENS', 120))
+    PATTERN_DIGEST_MAX_TOKENS = int(os.getenv('PATTERN_DIGEST_MAX_TOKENS', 400))
+    # Summaries one web request may make; further unsummarized dreams go in
+    # as clipped excerpts until `manage.py summarize_dreams` catches up
+    PATTERN_MAX_NEW_SUMMARIES = int(os.getenv('PATTERN_MAX_NEW_SUMMARIES', 20))
+
+    # Dreams are scored for sentiment, emotions and lucidity with a local
+    # lexicon on every write; `manage.py score_dreams` backfills in batches
+    SENTIMENT_BATCH_SIZE = int(os.getenv('SENTIMENT_BATCH_SIZE', 2000))
@@ -20,31 +20,66 @@ def create_app():
     login_manager.login_view = 'main.login'
     
     # Import models here to avoid circular imports
-    from dreamloop.models import Users, Notification
+    from dreamloop.identity_cache import load_cached_user, user_cache
+    
+    user_cache.configure(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
     
     @login_manager.user_loader
     def load_user(user_id):
-        return Users.query.get(int(user_id))
+        return load_cached_user(user_id)
     
     # Add context processor for notifications
     @app.context_processor
     def utility_processor():
-        def get_unread_notifications_count():
-            if not hasattr(utility_processor, '_current_user'):
-                from flask_login import current_user
-                utility_processor._current_user = current_user
-            
-            if utility_processor._current_user.is_authenticated:
-                return Notification.query.filter_by(
-                    user_id=utility_processor._current_user.id,
-                    read=False
-                ).count()
+        from flask_login import current_user
+        from dreamloop.notification_counter import get_unread_count
+
+        # Called from inside the cached badge fragment, so the count is only
+        # read when the fragment has to be re-rendered
+        def unread_notifications_count():
+            if current_user.is_authenticated:
+                return get_unread_count(current_user.id)
             return 0
-            
+
         return {
-            'unread_notifications_count': get_unread_notifications_count()
+            'unread_notifications_count': unread_notifications_count
         }
     
+    # Add markdown filter; renders are cached per worker by content hash
+    from dreamloop.markdown_cache import markdown_cache, render_markdown
+    
+    markdown_cache.configure(
+        app.config['MARKDOWN_CACHE_SIZE'], None, maxweight=app.config['MARKDOWN_CACHE_BYTES']
+    )
+    app.jinja_env.filters['markdown'] = render_markdown
+    
+    # {% cache %} fragments, invalidated on dream, group and notification writes
+    from dreamloop.fragment_cache import FragmentCacheExtension, local_fragments
+    
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    local_fragments.configure(local_fragments.maxsize, app.config['FRAGMENT_CACHE_TTL'])
+    
+    # Password hashes are limited to a bounded number of concurrent callers
+    from dreamloop.passwords import password_hasher
+    
+    password_hasher.configure(
+        app.config['PASSWORD_HASH_METHOD'],
+        app.config['PASSWORD_HASH_WORKERS'],
+        app.config['PASSWORD_HASH_QUEUE_DEPTH']
+    )
+    
+    # Model analyses are reused for identical dreams
+    from dreamloop.analysis_cache import local_analyses
+    
+    local_analyses.configure(app.config['ANALYSIS_CACHE_SIZE'], local_analyses.ttl)
+    
+    # Sentiment, emotions and lucidity are scored locally whenever a dream is written
+    import dreamloop.sentiment  # noqa: F401
+    
+    # Tag lists are loaded for a whole page of dreams in one query
+    from dreamloop.tags import tags_for_dreams
+    app.jinja_env.globals['tags_for_dreams'] = tags_for_dreams
+    
     # Register blueprints
     from dreamloop.routes import bp as routes_bp
     app.register_blueprint(routes_bp)
@@ -1,30 +1,19 @@
-import os
-import openai
-from .models import Users, Dream
-from .extensions import db
+import random
+import time
+from contextlib import nullcontext
+from flask import current_app
+from .analysis_cache import analysis_key, get_cached_analysis, normalize_text, store_analysis
+from .llm_client import AnalysisError, AnalysisNotConfigured, get_llm_client
+from .ai_quota import QuotaExceeded, analysis_quota
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def analyze_dream(dream_text, user=None):
-    """Analyze a single dream using OpenAI's GPT model."""
-    try:
-        # Set OpenAI API key
-        openai.api_key = os.getenv('OPENAI_API_KEY')
-        
-        if not openai.api_key:
-            logger.error("OpenAI API key not found")
-            return "Error: OpenAI API key not configured"
-
-        # Check if user has exceeded their monthly limit
-        if user and not user.can_use_ai_analysis():
-            logger.warning(f"User {user.id} has exceeded monthly AI analysis limit")
-            return "Monthly AI analysis limit reached"
-
-        # Construct the prompt
-        prompt = f"""Analyze this dream and provide insights about its potential meaning, 
+DREAM_TEMPERATURE = 0.7
+DREAM_SYSTEM_PROMPT = "You are a knowledgeable dream analyst combining insights from psychology and dream interpretation."
+DREAM_PROMPT = """Analyze this dream and provide insights about its potential meaning,
         psychological significance, and any recurring symbols or themes:
 
         Dream: {dream_text}
@@ -36,52 +25,8 @@ def analyze_dream(dream_text, user=None):
         4. Psychological Significance
         5. Action Steps or Reflections"""
 
-        # Make API call to OpenAI
-        response = openai.ChatCompletion.create(
-            model="gpt-4",  # or "gpt-3.5-turbo" depending on your needs
-            messages=[
-                {"role": "system", "content": "You are a knowledgeable dream analyst combining insights from psychology and dream interpretation."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=1000,
-            temperature=0.7
-        )
-
-        # Extract the analysis from the response
-        analysis = response.choices[0].message.content
-
-        # Update user's AI analysis count if user is provided
-        if user:
-            user.increment_ai_analysis_count()
-            db.session.commit()
-
-        return analysis
-
-    except Exception as e:
-        logger.error(f"Error in dream analysis: {str(e)}")
-        return f"Error analyzing dream: {str(e)}"
-
-def analyze_dream_patterns(dreams, user=None):
-    """Analyze patterns across multiple dreams."""
-    try:
-        # Set OpenAI API key
-        openai.api_key = os.getenv('OPENAI_API_KEY')
-        
-        if not openai.api_key:
-            logger.error("OpenAI API key not found")
-            return "Error: OpenAI API key not configured"
-
-        # Check if user has exceeded their monthly limit
-        if user and not user.can_use_ai_analysis():
-            logger.warning(f"User {user.id} has exceeded monthly AI analysis limit")
-            return "Monthly AI analysis limit reached"
-
-        # Prepare dreams for analysis
-        dream_texts = [f"Dream {i+1}: {dream.content}" for i, dream in enumerate(dreams)]
-        dreams_combined = "\n\n".join(dream_texts)
-
-        # Construct the prompt
-        prompt = f"""Analyze these dreams and identify patterns, recurring themes, and psychological insights:
+PATTERN_SYSTEM_PROMPT = "You are a knowledgeable dream analyst specializing in pattern recognition and psychological interpretation."
+PATTERN_PROMPT = """Analyze these dreams and identify patterns, recurring themes, and psychological insights:
 
         {dreams_combined}
 
@@ -92,27 +37,182 @@ def analyze_dream_patterns(dreams, user=None):
         4. Personal Growth Indicators
         5. Recommendations for Further Reflection"""
 
-        # Make API call to OpenAI
-        response = openai.ChatCompletion.create(
-            model="gpt-4",  # or "gpt-3.5-turbo" depending on your needs
-            messages=[
-                {"role": "system", "content": "You are a knowledgeable dream analyst specializing in pattern recognition and psychological interpretation."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=1500,
-            temperature=0.7
-        )
-
-        # Extract the analysis from the response
-        analysis = response.choices[0].message.content
-
-        # Update user's AI analysis count if user is provided
-        if user:
-            user.increment_ai_analysis_count()
-            db.session.commit()
 
+def _stub_text(prompt):
+    excerpt = ' '.join(prompt.split()[-40:])[:200]
+    return (
+        "### Key Symbols and Their Meanings\n"
+        f"The dream centres on: *{excerpt}*\n\n"
+        "### Emotional Themes\nA mix of curiosity and unease.\n\n"
+        "### Possible Interpretations\nA period of change in waking life.\n\n"
+        "### Psychological Significance\nProcessing recent experiences.\n\n"
+        "### Action Steps or Reflections\nKeep journaling similar dreams."
+    )
+
+
+def _stub_completion(prompt, max_tokens):
+    """Canned reply used when LLM_BACKEND is 'stub', for tests and local runs."""
+    config = current_app.config
+    if config.get('STUB_LLM_DELAY'):
+        time.sleep(config['STUB_LLM_DELAY'])
+    if random.random() < config.get('STUB_LLM_ERROR_RATE', 0):
+        raise AnalysisError("Stub model failure")
+    return _stub_text(prompt)
+
+
+def _stub_stream(prompt, max_tokens):
+    """The stub reply word by word, with STUB_LLM_DELAY spread across the words."""
+    config = current_app.config
+    words = _stub_text(prompt).split(' ')
+    fail_at = len(words) // 2 if random.random() < config.get('STUB_LLM_ERROR_RATE', 0) else None
+    for index, word in enumerate(words):
+        if index == fail_at:
+            raise AnalysisError("Stub model failure")
+        if config.get('STUB_LLM_DELAY'):
+            time.sleep(config['STUB_LLM_DELAY'] / len(words))
+        yield word if index == 0 else ' ' + word
+
+
+def _messages(system_prompt, prompt):
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def _complete(system_prompt, prompt, max_tokens, temperature=0.7):
+    """Run one chat completion and return its text, raising AnalysisError on failure."""
+    config = current_app.config
+    if config.get('LLM_BACKEND') == 'stub':
+        return _stub_completion(prompt, max_tokens)
+    return get_llm_client().complete(
+        config.get('LLM_MODEL', 'gpt-4'), _messages(system_prompt, prompt), max_tokens, temperature
+    )
+
+
+def _stream_complete(system_prompt, prompt, max_tokens, temperature=0.7):
+    """Yield the completion's text as the model produces it, raising AnalysisError on failure."""
+    config = current_app.config
+    if config.get('LLM_BACKEND') == 'stub':
+        yield from _stub_stream(prompt, max_tokens)
+        return
+    yield from get_llm_client().stream(
+        config.get('LLM_MODEL', 'gpt-4'), _messages(system_prompt, prompt), max_tokens, temperature
+    )
+
+
+def generate_dream_analysis(dream_text, bypass_cache=False):
+    """Model analysis of one dream; raises AnalysisError instead of returning an error text.
+
+    Identical dreams analysed with the same model, prompt and temperature
+    are answered from the analysis cache. ``bypass_cache`` asks the model
+    again and replaces the cached answer.
+    """
+    model, key = _dream_cache_key(dream_text)
+    if not bypass_cache:
+        cached = get_cached_analysis(key)
+        if cached is not None:
+            return cached
+
+    analysis = _complete(
+        DREAM_SYSTEM_PROMPT, DREAM_PROMPT.format(dream_text=normalize_text(dream_text)),
+        max_tokens=1000, temperature=DREAM_TEMPERATURE
+    )
+    store_analysis(key, model, analysis)
+    return analysis
+
+
+def _dream_cache_key(dream_text):
+    model = current_app.config.get('LLM_MODEL', 'gpt-4')
+    return model, analysis_key(model, DREAM_SYSTEM_PROMPT + DREAM_PROMPT, dream_text, DREAM_TEMPERATURE)
+
+
+def stream_dream_analysis(dream_text, bypass_cache=False):
+    """Like generate_dream_analysis, but yields the text as it is generated.
+
+    A cached analysis is yielded in one piece. The finished text is cached
+    only if the stream is consumed to the end.
+    """
+    model, key = _dream_cache_key(dream_text)
+    if not bypass_cache:
+        cached = get_cached_analysis(key)
+        if cached is not None:
+            yield cached
+            return
+
+    parts = []
+    for delta in _stream_complete(
+        DREAM_SYSTEM_PROMPT, DREAM_PROMPT.format(dream_text=normalize_text(dream_text)),
+        max_tokens=1000, temperature=DREAM_TEMPERATURE
+    ):
+        parts.append(delta)
+        yield delta
+    store_analysis(key, model, ''.join(parts))
+
+
+def generate_pattern_analysis(dreams):
+    """Pattern analysis over per-dream summaries rather than the full journal text."""
+    from .pattern_analysis import build_pattern_prompt
+
+    return _complete(PATTERN_SYSTEM_PROMPT, build_pattern_prompt(dreams), max_tokens=1500)
+
+
+def stream_pattern_analysis(dreams):
+    """Yield the pattern analysis as it is generated; summaries are prepared first."""
+    from .pattern_analysis import build_pattern_prompt
+
+    yield from _stream_complete(PATTERN_SYSTEM_PROMPT, build_pattern_prompt(dreams), max_tokens=1500)
+
+
+def _consume(stream, on_token):
+    parts = []
+    for delta in stream:
+        on_token(delta)
+        parts.append(delta)
+    return ''.join(parts)
+
+
+def analyze_dream(dream_text, user=None, on_token=None):
+    """Analyze a single dream using OpenAI's GPT model.
+
+    Blocks for the whole completion; web requests enqueue an AnalysisJob
+    through dreamloop.analysis_jobs or stream it instead. With ``on_token``
+    the model's output is passed on piece by piece as it arrives.
+    """
+    try:
+        # The user's allowance is charged up front and refunded if the call fails
+        with analysis_quota(user.id) if user else nullcontext():
+            if on_token:
+                analysis = _consume(stream_dream_analysis(dream_text), on_token)
+            else:
+                analysis = generate_dream_analysis(dream_text)
+        return analysis
+
+    except QuotaExceeded:
+        logger.warning(f"User {user.id} has exceeded monthly AI analysis limit")
+        return "Monthly AI analysis limit reached"
+    except AnalysisNotConfigured as e:
+        return f"Error: {str(e)}"
+    except Exception as e:
+        logger.error(f"Error in dream analysis: {str(e)}")
+        return f"Error analyzing dream: {str(e)}"
+
+def analyze_dream_patterns(dreams, user=None, on_token=None):
+    """Analyze patterns across multiple dreams, streaming to ``on_token`` if given."""
+    try:
+        # The user's allowance is charged up front and refunded if the call fails
+        with analysis_quota(user.id) if user else nullcontext():
+            if on_token:
+                analysis = _consume(stream_pattern_analysis(dreams), on_token)
+            else:
+                analysis = generate_pattern_analysis(dreams)
         return analysis
 
+    except QuotaExceeded:
+        logger.warning(f"User {user.id} has exceeded monthly AI analysis limit")
+        return "Monthly AI analysis limit reached"
+    except AnalysisNotConfigured as e:
+        return f"Error: {str(e)}"
     except Exception as e:
         logger.error(f"Error in dream pattern analysis: {str(e)}")
         return f"Error analyzing dream patterns: {str(e)}"
@@ -0,0 +1,170 @@
+from contextlib import contextmanager
+from datetime import datetime
+import random
+import threading
+import time
+from flask import current_app
+from sqlalchemy import case, or_, update
+from .models import Users, FREE_MONTHLY_ANALYSES
+from .extensions import db
+from .fragment_cache import invalidate_fragments
+from .llm_client import AnalysisError
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaExceeded(AnalysisError):
+    retryable = False
+
+
+class Reservation:
+    """One analysis taken from a user's allowance for the month starting ``month``."""
+
+    def __init__(self, user_id, month, used):
+        self.user_id = user_id
+        self.month = month
+        self.used = used
+
+
+def _month_start(now):
+    return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def reserve_analysis(user_id):
+    """Take one analysis from the user's monthly allowance, or return None if it is used up.
+
+    The check, the lazy start of a new month and the increment are one
+    conditional UPDATE ... RETURNING on its own connection, so concurrent
+    requests cannot overshoot the limit and the row lock lasts only as
+    long as the statement.
+    """
+    now = datetime.utcnow()
+    month = _month_start(now)
+    new_month = or_(Users.last_analysis_reset.is_(None), Users.last_analysis_reset < month)
+    statement = (
+        update(Users)
+        .where(
+            Users.id == user_id,
+            or_(
+                Users.subscription_type == 'premium',
+                new_month,
+                Users.monthly_ai_analysis_count < FREE_MONTHLY_ANALYSES
+            )
+        )
+        .values(
+            monthly_ai_analysis_count=case((new_month, 1), else_=Users.monthly_ai_analysis_count + 1),
+            last_analysis_reset=case((new_month, now), else_=Users.last_analysis_reset)
+        )
+        .returning(Users.monthly_ai_analysis_count)
+        .execution_options(synchronize_session=False)
+    )
+    with db.engine.begin() as connection:
+        used = connection.execute(statement).scalar()
+    if used is None:
+        return None
+    # Committed already, outside the session, so mark_stale would never fire
+    invalidate_fragments(f'quota:{user_id}')
+    return Reservation(user_id, month, used)
+
+
+def refund_analysis(reservation):
+    """Give back a reserved analysis that produced nothing.
+
+    A refund after the month has rolled over is dropped: the new month's
+    count started from zero without it.
+    """
+    with db.engine.begin() as connection:
+        connection.execute(
+            update(Users)
+            .where(
+                Users.id == reservation.user_id,
+                Users.monthly_ai_analysis_count > 0,
+                Users.last_analysis_reset >= reservation.month
+            )
+            .values(monthly_ai_analysis_count=Users.monthly_ai_analysis_count - 1)
+            .execution_options(synchronize_session=False)
+        )
+    invalidate_fragments(f'quota:{reservation.user_id}')
+
+
+@contextmanager
+def analysis_quota(user_id):
+    """Reserve an analysis for the block, refunding it if the block does not complete.
+
+    Raises QuotaExceeded when the allowance is used up. A generator closed
+    early (a streaming client that disconnected) counts as not completing.
+    """
+    reservation = reserve_analysis(user_id)
+    if reservation is None:
+        raise QuotaExceeded("Monthly AI analysis limit reached")
+    try:
+        yield reservation
+    except BaseException:
+        try:
+            refund_analysis(reservation)
+        except Exception as e:
+            logger.error(f"Error refunding analysis for user {user_id}: {str(e)}")
+        raise
+
+
+def stress_ai_quota(threads=32, attempts=8, fail_rate=0.0):
+    """Hammer one fresh free user's allowance from many threads at once.
+
+    Every thread tries ``attempts`` reservations and refunds ``fail_rate``
+    of those it gets, as if the analysis had failed. Afterwards the stored
+    count must equal the reservations kept and never exceed the free
+    limit. The user is deleted at the end.
+    """
+    stamp = time.time_ns()
+    user = Users(email=f'quota-stress-{stamp}@example.invalid',
+                 username=f'quota-stress-{stamp}', password_hash='!')
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.id
+    db.session.remove()
+
+    app = current_app._get_current_object()
+    counts = {'kept': 0, 'refunded': 0, 'refused': 0, 'errors': 0}
+    lock = threading.Lock()
+    start = threading.Barrier(threads)
+
+    def hammer():
+        with app.app_context():
+            start.wait()
+            for _ in range(attempts):
+                try:
+                    with analysis_quota(user_id):
+                        if random.random() < fail_rate:
+                            raise AnalysisError("Simulated model failure")
+                    outcome = 'kept'
+                except QuotaExceeded:
+                    outcome = 'refused'
+                except AnalysisError:
+                    outcome = 'refunded'
+                except Exception as e:
+                    logger.error(f"Quota stress reservation failed: {str(e)}")
+                    outcome = 'errors'
+                with lock:
+                    counts[outcome] += 1
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=hammer) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    user = db.session.get(Users, user_id)
+    stored = user.monthly_ai_analysis_count
+    db.session.delete(user)
+    db.session.commit()
+    return {
+        **counts,
+        'attempts': threads * attempts,
+        'stored_count': stored,
+        'limit': FREE_MONTHLY_ANALYSES,
+        'consistent': stored == counts['kept'] <= FREE_MONTHLY_ANALYSES,
+        'seconds': round(elapsed, 3)
+    }
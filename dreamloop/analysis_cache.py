@@ -0,0 +1,152 @@
+from datetime import datetime, timedelta
+import hashlib
+import json
+import threading
+import unicodedata
+from flask import current_app
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from .models import AnalysisCacheEntry
+from .extensions import db
+from .cache import TTLCache, register_cache
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Entries are keyed by content hash, so the local TTL only bounds how long
+# a pruned table row can still be served by a worker.
+local_analyses = register_cache('analysis', TTLCache(maxsize=512, ttl=3600))
+
+# last_used_at drives LRU pruning; refreshing it at most daily keeps hits
+# from turning into a write each.
+TOUCH_INTERVAL = timedelta(days=1)
+
+
+class _StoreCounters:
+    """Hit/miss counters of the table tier, reported alongside the local caches."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': 'table',
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None
+        }
+
+
+store_counters = register_cache('analysis_store', _StoreCounters())
+
+
+def normalize_text(text):
+    """Canonical form of a dream for hashing: NFC, single spaces, no outer whitespace."""
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def analysis_key(model, template, text, temperature):
+    """Hash of everything that determines a completion.
+
+    The prompt template itself is part of the key, so editing the prompt
+    starts a fresh set of entries rather than serving analyses of the old one.
+    """
+    payload = json.dumps([model, template, normalize_text(text), temperature], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _enabled():
+    return current_app.config['ANALYSIS_CACHE_ENABLED']
+
+
+def get_cached_analysis(key):
+    """Return the stored analysis for ``key``, or None.
+
+    Checks the worker's LRU first, then the table. The table is read and
+    touched on its own connection, outside the caller's transaction.
+    """
+    if not _enabled():
+        return None
+    analysis = local_analyses.get(key)
+    if analysis is not None:
+        return analysis
+
+    cutoff = datetime.utcnow() - timedelta(days=current_app.config['ANALYSIS_CACHE_TTL_DAYS'])
+    with db.engine.begin() as connection:
+        row = connection.execute(
+            select(AnalysisCacheEntry.analysis, AnalysisCacheEntry.last_used_at)
+            .where(AnalysisCacheEntry.key == key, AnalysisCacheEntry.created_at >= cutoff)
+        ).first()
+        if row is not None and row.last_used_at < datetime.utcnow() - TOUCH_INTERVAL:
+            connection.execute(
+                update(AnalysisCacheEntry)
+                .where(AnalysisCacheEntry.key == key)
+                .values(last_used_at=datetime.utcnow())
+            )
+    store_counters.record(row is not None)
+    if row is None:
+        return None
+    local_analyses.set(key, row.analysis)
+    return row.analysis
+
+
+def store_analysis(key, model, analysis):
+    """Save ``analysis`` under ``key``, replacing any earlier entry."""
+    if not _enabled():
+        return
+    local_analyses.set(key, analysis)
+    now = datetime.utcnow()
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    statement = dialect.insert(AnalysisCacheEntry).values(
+        key=key, model=model, analysis=analysis, created_at=now, last_used_at=now
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[AnalysisCacheEntry.key],
+        set_={'analysis': analysis, 'model': model, 'created_at': now, 'last_used_at': now}
+    )
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(statement)
+    except Exception as e:
+        # The analysis itself succeeded; failing to cache it must not lose it
+        logger.error(f"Error storing cached analysis: {str(e)}")
+
+
+def prune_analysis_cache(max_rows=None, ttl_days=None, batch_size=1000):
+    """Delete expired entries, then the least recently used beyond ``max_rows``.
+
+    Returns the number of rows deleted.
+    """
+    config = current_app.config
+    max_rows = max_rows if max_rows is not None else config['ANALYSIS_CACHE_MAX_ROWS']
+    ttl_days = ttl_days if ttl_days is not None else config['ANALYSIS_CACHE_TTL_DAYS']
+
+    deleted = db.session.execute(delete(AnalysisCacheEntry).where(
+        AnalysisCacheEntry.created_at < datetime.utcnow() - timedelta(days=ttl_days)
+    )).rowcount
+    db.session.commit()
+
+    while True:
+        excess = db.session.query(AnalysisCacheEntry).count() - max_rows
+        if excess <= 0:
+            break
+        oldest = select(AnalysisCacheEntry.key).order_by(
+            AnalysisCacheEntry.last_used_at, AnalysisCacheEntry.key
+        ).limit(min(excess, batch_size)).scalar_subquery()
+        deleted += db.session.execute(
+            delete(AnalysisCacheEntry).where(AnalysisCacheEntry.key.in_(oldest))
+        ).rowcount
+        db.session.commit()
+
+    logger.info(f"Pruned {deleted} analysis cache entries")
+    return deleted
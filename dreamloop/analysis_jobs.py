@@ -0,0 +1,226 @@
+from datetime import datetime, timedelta
+import multiprocessing
+import os
+import random
+import socket
+import threading
+import time
+from flask import current_app
+from sqlalchemy import select, update
+from .models import AnalysisJob, Dream
+from .extensions import db
+import logging
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+def active_job(dream_id):
+    """The dream's queued or running analysis job, if any."""
+    return AnalysisJob.query.filter(
+        AnalysisJob.dream_id == dream_id,
+        AnalysisJob.status.in_(ACTIVE_STATUSES)
+    ).order_by(AnalysisJob.created_at.desc()).first()
+
+
+def enqueue_analysis(dream, user_id=None, bypass_cache=False):
+    """Queue an analysis of ``dream`` in the caller's transaction.
+
+    The job becomes visible to workers when the caller commits, together
+    with the dream itself. A dream that already has a job waiting or
+    running gets that job back instead of a second one. ``bypass_cache``
+    makes the worker ask the model even if the text was analysed before.
+    """
+    if dream.id is not None:
+        existing = active_job(dream.id)
+        if existing is not None:
+            if bypass_cache and existing.status == 'queued':
+                existing.bypass_cache = True
+            return existing
+    job = AnalysisJob(
+        dream=dream,
+        user_id=user_id or dream.user_id,
+        bypass_cache=bypass_cache,
+        max_attempts=current_app.config['ANALYSIS_JOB_MAX_ATTEMPTS']
+    )
+    db.session.add(job)
+    return job
+
+
+def serialize_job(job):
+    return {
+        'id': job.id,
+        'dream_id': job.dream_id,
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'error': job.last_error if job.status == 'failed' else None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+def requeue_expired_jobs():
+    """Put back running jobs whose lease ran out because their worker crashed or was killed."""
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['ANALYSIS_JOB_LEASE_SECONDS'])
+    requeued = db.session.execute(
+        update(AnalysisJob)
+        .where(AnalysisJob.status == 'running', AnalysisJob.locked_at < cutoff)
+        .values(status='queued', locked_by=None, locked_at=None, run_after=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    if requeued:
+        logger.warning(f"Requeued {requeued} analysis jobs with expired leases")
+    return requeued
+
+
+def claim_job(worker_id):
+    """Atomically take the next runnable job, or return None.
+
+    The candidate is selected with FOR UPDATE SKIP LOCKED on Postgres, so
+    concurrent workers each get a different row without waiting on each
+    other.
+    """
+    now = datetime.utcnow()
+    candidate = (
+        select(AnalysisJob.id)
+        .where(AnalysisJob.status == 'queued', AnalysisJob.run_after <= now)
+        .order_by(AnalysisJob.run_after, AnalysisJob.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    job_id = db.session.execute(
+        update(AnalysisJob)
+        .where(AnalysisJob.id == candidate, AnalysisJob.status == 'queued')
+        .values(
+            status='running',
+            locked_by=worker_id,
+            locked_at=now,
+            attempts=AnalysisJob.attempts + 1
+        )
+        .returning(AnalysisJob.id)
+    ).scalar()
+    db.session.commit()
+    return db.session.get(AnalysisJob, job_id) if job_id else None
+
+
+def _retry_delay(attempts):
+    base = current_app.config['ANALYSIS_JOB_RETRY_BASE_SECONDS']
+    return base * 2 ** (attempts - 1) * random.uniform(0.5, 1.5)
+
+
+def run_job(job):
+    """Run one claimed job and record its outcome."""
+    from .ai_helper import AnalysisError, generate_dream_analysis
+    from .ai_quota import analysis_quota
+
+    try:
+        dream = db.session.get(Dream, job.dream_id)
+        if dream is None:
+            raise AnalysisError("Dream no longer exists")
+        dream_text = dream.content
+        bypass_cache = job.bypass_cache
+        db.session.commit()  # don't hold a transaction open across the model call
+
+        # Raises QuotaExceeded, which fails the job; refunded unless the result is saved
+        with analysis_quota(job.user_id):
+            analysis = generate_dream_analysis(dream_text, bypass_cache=bypass_cache)
+
+            dream = db.session.get(Dream, job.dream_id)
+            if dream is None:
+                raise AnalysisError("Dream no longer exists")
+            dream.ai_analysis = analysis
+            job.status = 'succeeded'
+            job.last_error = None
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+        logger.info(f"Analysis job {job.id} for dream {job.dream_id} succeeded")
+    except Exception as e:
+        db.session.rollback()
+        retryable = getattr(e, 'retryable', True)
+        job = db.session.get(AnalysisJob, job.id)
+        job.last_error = str(e)[:2000]
+        job.locked_by = None
+        job.locked_at = None
+        if retryable and job.attempts < job.max_attempts:
+            job.status = 'queued'
+            job.run_after = datetime.utcnow() + timedelta(seconds=_retry_delay(job.attempts))
+            logger.warning(f"Analysis job {job.id} failed (attempt {job.attempts}), retrying: {str(e)}")
+        else:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+            logger.error(f"Analysis job {job.id} failed permanently: {str(e)}")
+        db.session.commit()
+    return job.status
+
+
+def work(worker_id, poll_interval=None, burst=False, stop=None):
+    """Claim and run jobs until ``stop`` is set, or the queue is empty with ``burst``.
+
+    Must run inside an app context. Returns the number of jobs processed.
+    """
+    poll_interval = poll_interval or current_app.config['ANALYSIS_WORKER_POLL_SECONDS']
+    lease = current_app.config['ANALYSIS_JOB_LEASE_SECONDS']
+    processed = 0
+    last_requeue = time.monotonic()
+    while stop is None or not stop.is_set():
+        job = claim_job(worker_id)
+        if job is None:
+            if time.monotonic() - last_requeue > lease:
+                requeue_expired_jobs()
+                last_requeue = time.monotonic()
+            db.session.remove()
+            if burst:
+                break
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        processed += 1
+        db.session.remove()
+    return processed
+
+
+def _worker_process(threads, poll_interval, burst):
+    """Entry point of one worker process: a fresh app and ``threads`` job loops."""
+    from . import create_app
+
+    app = create_app()
+    prefix = f'{socket.gethostname()}:{os.getpid()}'
+    with app.app_context():
+        requeue_expired_jobs()
+
+    def loop(index):
+        with app.app_context():
+            work(f'{prefix}:{index}', poll_interval, burst)
+
+    workers = [threading.Thread(target=loop, args=(index,)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def run_worker_pool(processes, threads, poll_interval=None, burst=False):
+    """Run ``processes`` worker processes of ``threads`` job loops each.
+
+    Model calls spend their time waiting on the network, so every process
+    runs several loops in threads; processes add CPU parallelism for the
+    markdown rendering and database work around them.
+    """
+    context = multiprocessing.get_context('spawn')
+    pool = [
+        context.Process(target=_worker_process, args=(threads, poll_interval, burst))
+        for _ in range(processes)
+    ]
+    for process in pool:
+        process.start()
+    try:
+        for process in pool:
+            process.join()
+    except KeyboardInterrupt:
+        for process in pool:
+            process.terminate()
+        for process in pool:
+            process.join()
@@ -1,13 +1,11 @@
 from flask_login import LoginManager
-from .models import Users
 from .extensions import login_manager
+from .identity_cache import load_cached_user
 
 @login_manager.user_loader
 def load_user(user_id):
     """Load user by ID."""
-    if user_id is not None:
-        return Users.query.get(int(user_id))
-    return None
+    return load_cached_user(user_id)
 
 def init_login_manager(app):
     """Initialize the login manager."""
@@ -0,0 +1,189 @@
+from collections import OrderedDict
+from flask import current_app
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+# Every in-process cache registers itself here so its counters can be
+# reported per worker.
+_registry = {}
+
+
+class TTLCache:
+    """Thread-safe in-process LRU cache with an optional per-entry TTL.
+
+    With ``maxweight`` set, entries are also evicted once the summed
+    ``weigher(value)`` of everything cached exceeds it, so a cache of
+    variable-sized values can be bounded in bytes rather than entries.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, maxweight=None, weigher=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxweight = maxweight
+        self.weigher = weigher
+        self.weight = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, maxsize, ttl, maxweight=None):
+        """Resize the cache, dropping least recently used entries if needed."""
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            if maxweight is not None:
+                self.maxweight = maxweight
+            self._evict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value, weight = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.weight -= weight
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl or self.ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        weight = self.weigher(value) if self.weigher else 0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.weight -= old[2]
+            self._data[key] = (expires_at, value, weight)
+            self.weight += weight
+            self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.weight -= old[2]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def _evict(self):
+        while self._data and (
+            len(self._data) > self.maxsize
+            or (self.maxweight is not None and self.weight > self.maxweight)
+        ):
+            _, (_, _, weight) = self._data.popitem(last=False)
+            self.weight -= weight
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'weight': self.weight,
+            'maxweight': self.maxweight,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None
+        }
+
+
+def register_cache(name, cache):
+    """Register ``cache`` under ``name`` for stats reporting and return it."""
+    _registry[name] = cache
+    return cache
+
+
+def cache_stats():
+    """Return the stats of every registered cache in this worker."""
+    return {name: cache.stats() for name, cache in _registry.items()}
+
+
+class LocalBackend:
+    """In-process stand-in for the shared cache, used when no Redis is configured."""
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self._cache = TTLCache(maxsize, ttl)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value, ttl=None):
+        self._cache.set(key, value, ttl)
+
+    def delete(self, key):
+        self._cache.delete(key)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class RedisBackend:
+    """Cache shared by every worker, storing values as JSON in Redis."""
+
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        raw = self._client.get(key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self._client.set(key, json.dumps(value), ex=ttl)
+
+    def delete(self, key):
+        self._client.delete(key)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': 'redis',
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None
+        }
+
+
+_shared_cache = None
+
+
+def get_shared_cache():
+    """Return the cache shared across workers.
+
+    Uses Redis when SHARED_CACHE_URL is configured and the redis package is
+    installed, and a per-process LocalBackend otherwise.
+    """
+    global _shared_cache
+    if _shared_cache is None:
+        url = current_app.config.get('SHARED_CACHE_URL')
+        backend = None
+        if url:
+            try:
+                backend = RedisBackend(url)
+            except ImportError:
+                logger.warning("SHARED_CACHE_URL is set but redis is not installed; using local cache")
+        _shared_cache = register_cache('shared', backend or LocalBackend())
+    return _shared_cache
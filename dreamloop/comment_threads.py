@@ -0,0 +1,204 @@
+from collections import Counter
+from sqlalchemy import and_, event, func, literal, or_, select
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm.attributes import set_committed_value
+from .models import Comment, Users
+from .extensions import db
+from .pagination import KeysetPage, encode_cursor, decode_cursor
+import logging
+
+logger = logging.getLogger(__name__)
+
+THREAD_PAGE_SIZE = 20
+REPLY_PAGE_SIZE = 20
+# Deeper replies, replies past the first INLINE_REPLIES of a comment and
+# anything past the per-page budget are fetched on demand through the
+# "load more replies" cursor of their parent. A full page of roots with
+# their inline replies fits in the budget, so every root shows its first
+# replies however busy its siblings are.
+MAX_REPLY_DEPTH = 6
+INLINE_REPLIES = 10
+MAX_THREAD_COMMENTS = 300
+
+
+def _load_threads(page, page_size, newest_first):
+    """Fetch the roots selected by ``page`` and their descendants in one query.
+
+    ``page`` is a CTE of candidate root ids with their position ``rn``; it
+    holds one row more than ``page_size`` so the same statement also tells
+    whether another page follows. Each step of the recursion only follows
+    the first INLINE_REPLIES children of a comment, read from
+    ix_comment_parent_created, so a huge thread costs no more than a small
+    one. Descendants come back ordered by depth, so every parent is seen
+    before its children and the tree is assembled in a single pass over
+    the rows.
+    """
+    thread = select(
+        Comment.id, Comment.parent_id, literal(0).label('depth')
+    ).where(
+        Comment.id.in_(select(page.c.id).where(page.c.rn <= page_size))
+    ).cte('thread', recursive=True)
+    child = aliased(Comment)
+    sibling = aliased(Comment)
+    # A window function would be the obvious per-parent cap, but SQLite
+    # allows none in the recursive step; a correlated LIMIT works on both
+    first_replies = (
+        select(sibling.id)
+        .where(sibling.parent_id == thread.c.id)
+        .order_by(sibling.created_at, sibling.id)
+        .limit(INLINE_REPLIES)
+        .correlate(thread)
+    )
+    thread = thread.union_all(
+        select(child.id, child.parent_id, thread.c.depth + 1)
+        .select_from(thread)
+        .join(child, child.id.in_(first_replies))
+        .where(thread.c.depth < MAX_REPLY_DEPTH)
+    )
+    page_rows = select(func.count()).select_from(page).scalar_subquery()
+
+    rows = db.session.execute(
+        select(Comment, thread.c.depth, page_rows)
+        .join(thread, thread.c.id == Comment.id)
+        .order_by(thread.c.depth, Comment.created_at, Comment.id)
+        .limit(MAX_THREAD_COMMENTS)
+    ).all()
+
+    nodes = {}
+    roots = []
+    for comment, depth, _ in rows:
+        node = {'comment': comment, 'replies': [], 'has_more_replies': False, 'more_cursor': None}
+        nodes[comment.id] = node
+        if depth == 0:
+            roots.append(node)
+        else:
+            nodes[comment.parent_id]['replies'].append(node)
+
+    for node in nodes.values():
+        if len(node['replies']) < node['comment'].reply_count:
+            node['has_more_replies'] = True
+            if node['replies']:
+                last = node['replies'][-1]['comment']
+                node['more_cursor'] = encode_cursor(last.created_at, last.id)
+
+    _attach_authors([node['comment'] for node in nodes.values()])
+
+    roots.sort(key=lambda node: (node['comment'].created_at, node['comment'].id), reverse=newest_first)
+    next_cursor = None
+    if rows and rows[0][2] > page_size and roots:
+        last = roots[-1]['comment']
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return KeysetPage(roots, next_cursor)
+
+
+def _attach_authors(comments):
+    """Populate ``comment.user`` for every comment from one batched lookup."""
+    user_ids = {comment.user_id for comment in comments}
+    if not user_ids:
+        return
+    users = {user.id: user for user in Users.query.filter(Users.id.in_(user_ids)).all()}
+    for comment in comments:
+        set_committed_value(comment, 'user', users.get(comment.user_id))
+
+
+def comment_threads(dream_id, cursor=None, page_size=THREAD_PAGE_SIZE):
+    """A page of a dream's top-level comments, newest first, with their replies.
+
+    Each item is a ``{'comment', 'replies', 'has_more_replies', 'more_cursor'}``
+    node; replies are nodes of the same shape in chronological order.
+    """
+    conditions = [Comment.dream_id == dream_id, Comment.parent_id.is_(None)]
+    if cursor:
+        created_at, comment_id = decode_cursor(cursor)
+        conditions.append(or_(
+            Comment.created_at < created_at,
+            and_(Comment.created_at == created_at, Comment.id < comment_id)
+        ))
+    order = (Comment.created_at.desc(), Comment.id.desc())
+    page = select(
+        Comment.id, func.row_number().over(order_by=order).label('rn')
+    ).where(*conditions).order_by(*order).limit(page_size + 1).cte('page')
+    return _load_threads(page, page_size, newest_first=True)
+
+
+def reply_threads(comment_id, cursor=None, page_size=REPLY_PAGE_SIZE):
+    """The next page of replies to ``comment_id``, oldest first, with their own replies."""
+    conditions = [Comment.parent_id == comment_id]
+    if cursor:
+        created_at, reply_id = decode_cursor(cursor)
+        conditions.append(or_(
+            Comment.created_at > created_at,
+            and_(Comment.created_at == created_at, Comment.id > reply_id)
+        ))
+    order = (Comment.created_at, Comment.id)
+    page = select(
+        Comment.id, func.row_number().over(order_by=order).label('rn')
+    ).where(*conditions).order_by(*order).limit(page_size + 1).cte('page')
+    return _load_threads(page, page_size, newest_first=False)
+
+
+def comment_counts(dream_ids):
+    """Return {dream_id: comment count} for a page of dreams in one GROUP BY."""
+    if not dream_ids:
+        return {}
+    return dict(db.session.execute(
+        select(Comment.dream_id, func.count(Comment.id))
+        .where(Comment.dream_id.in_(list(dream_ids)))
+        .group_by(Comment.dream_id)
+    ).all())
+
+
+def serialize_thread(node):
+    comment = node['comment']
+    return {
+        'id': comment.id,
+        'parent_id': comment.parent_id,
+        'content': comment.content,
+        'author': comment.user.username if comment.user else None,
+        'created_at': comment.created_at.isoformat(),
+        'edited': comment.edited_at is not None,
+        'is_hidden': bool(comment.is_hidden),
+        'replies': [serialize_thread(reply) for reply in node['replies']],
+        'has_more_replies': node['has_more_replies'],
+        'more_cursor': node['more_cursor']
+    }
+
+
+def delete_comment_thread(comment):
+    """Delete a comment together with all of its replies."""
+    subtree = select(Comment.id).where(Comment.id == comment.id).cte('subtree', recursive=True)
+    child = aliased(Comment)
+    subtree = subtree.union_all(
+        select(child.id).join(subtree, child.parent_id == subtree.c.id)
+    )
+    deleted = db.session.execute(
+        Comment.__table__.delete().where(Comment.id.in_(select(subtree.c.id)))
+    ).rowcount
+    if comment.parent_id is not None:
+        _adjust_reply_counts(db.session.connection(), {comment.parent_id: -1})
+    db.session.expunge(comment)
+    return deleted
+
+
+def _adjust_reply_counts(connection, deltas):
+    for parent_id, delta in deltas.items():
+        if delta:
+            connection.execute(
+                Comment.__table__.update()
+                .where(Comment.id == parent_id)
+                .values(reply_count=Comment.__table__.c.reply_count + delta)
+            )
+
+
+@event.listens_for(db.session, 'after_flush')
+def _update_reply_counts(session, flush_context):
+    """Keep Comment.reply_count in step with replies added or removed through the ORM."""
+    deltas = Counter()
+    for comment in session.new:
+        if isinstance(comment, Comment) and comment.parent_id is not None:
+            deltas[comment.parent_id] += 1
+    for comment in session.deleted:
+        if isinstance(comment, Comment) and comment.parent_id is not None:
+            deltas[comment.parent_id] -= 1
+    if deltas:
+        _adjust_reply_counts(session.connection(), deltas)
@@ -0,0 +1,145 @@
+from bisect import bisect_right
+from datetime import datetime
+from sqlalchemy import event, inspect
+from .models import Dream, Users
+from .extensions import db
+from .cache import get_shared_cache
+from .tags import tags_for_dreams
+from .pagination import keyset_paginate, encode_cursor, decode_cursor
+import logging
+
+logger = logging.getLogger(__name__)
+
+FEED_CACHE_KEY = 'community_feed:window'
+FEED_WINDOW_SIZE = 500
+FEED_PAGE_SIZE = 20
+FEED_CACHE_TTL = 300
+CONTENT_PREVIEW_LENGTH = 500
+
+# Dream columns that _serialize renders, plus the ones that decide whether
+# and where a dream appears
+FEED_COLUMNS = ('title', 'content', 'mood', 'tags', 'is_private', 'created_at', 'user_id')
+
+
+def _public_dreams():
+    return Dream.query.filter(Dream.is_private == False)
+
+
+def _serialize(dreams):
+    """Turn dreams into cacheable dicts, loading authors and tags in one query each."""
+    author_ids = {dream.user_id for dream in dreams}
+    authors = dict(
+        db.session.query(Users.id, Users.username).filter(Users.id.in_(author_ids)).all()
+    ) if author_ids else {}
+    tags = tags_for_dreams([dream.id for dream in dreams])
+
+    return [{
+        'id': dream.id,
+        'title': dream.title,
+        'content': dream.content[:CONTENT_PREVIEW_LENGTH],
+        'mood': dream.mood,
+        'tags': tags[dream.id],
+        'author': authors.get(dream.user_id),
+        'created_at': dream.created_at.isoformat()
+    } for dream in dreams]
+
+
+def window_query():
+    """The newest public dreams, one more than fit in the cached window."""
+    return _public_dreams().order_by(Dream.created_at.desc(), Dream.id.desc()).limit(FEED_WINDOW_SIZE + 1)
+
+
+def _load_window():
+    cache = get_shared_cache()
+    window = cache.get(FEED_CACHE_KEY)
+    if window is None:
+        dreams = window_query().all()
+        window = {
+            'items': _serialize(dreams[:FEED_WINDOW_SIZE]),
+            'complete': len(dreams) <= FEED_WINDOW_SIZE
+        }
+        cache.set(FEED_CACHE_KEY, window, ttl=FEED_CACHE_TTL)
+    return window
+
+
+def _with_dates(items):
+    return [dict(item, date=datetime.fromisoformat(item['created_at'])) for item in items]
+
+
+def feed_page(cursor=None, page_size=FEED_PAGE_SIZE):
+    """Return ``(items, next_cursor)`` for the community feed.
+
+    Pages inside the cached window of the newest public dreams are served
+    from the cache alone. Only clients paging past the window fall through
+    to a keyset query on the dream table.
+    """
+    window = _load_window()
+    items = window['items']
+
+    start = 0
+    if cursor:
+        created_at, dream_id = decode_cursor(cursor)
+        # The window is sorted newest first; find the first item older than the cursor
+        keys = [(-datetime.fromisoformat(item['created_at']).timestamp(), -item['id']) for item in items]
+        start = bisect_right(keys, (-created_at.timestamp(), -dream_id))
+
+    page = items[start:start + page_size]
+    if len(page) == page_size and (start + page_size < len(items) or not window['complete']):
+        last = page[-1]
+        return _with_dates(page), encode_cursor(datetime.fromisoformat(last['created_at']), last['id'])
+    if len(page) == page_size or window['complete']:
+        return _with_dates(page), None
+
+    # The cursor points beyond the cached window
+    if page:
+        last = page[-1]
+        cursor = encode_cursor(datetime.fromisoformat(last['created_at']), last['id'])
+    rest = keyset_paginate(_public_dreams(), Dream.created_at, Dream.id, cursor, page_size - len(page))
+    return _with_dates(page + _serialize(rest.items)), rest.next_cursor
+
+
+def invalidate_feed():
+    get_shared_cache().delete(FEED_CACHE_KEY)
+
+
+def _was_public(state):
+    history = state.attrs.is_private.history
+    old = history.deleted or history.unchanged
+    # An expired attribute has no recorded old value; assume the dream was shown
+    return not old or not old[0]
+
+
+@event.listens_for(db.session, 'after_flush')
+def _note_public_dream_changes(session, flush_context):
+    """Flag the cached window for clearing when a change can show in the feed.
+
+    Edits to columns the feed does not render (the AI analysis, the
+    sentiment scores) leave it alone.
+    """
+    changed = any(
+        isinstance(dream, Dream) and not dream.is_private for dream in session.new
+    ) or any(
+        isinstance(dream, Dream) and _was_public(inspect(dream)) for dream in session.deleted
+    )
+    for dream in session.dirty:
+        if changed:
+            break
+        if not isinstance(dream, Dream):
+            continue
+        state = inspect(dream)
+        if not any(state.attrs[key].history.has_changes() for key in FEED_COLUMNS):
+            continue
+        changed = not dream.is_private or _was_public(state)
+    if changed:
+        session.info['community_feed_changed'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('community_feed_changed', False):
+        invalidate_feed()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_after_rollback(session):
+    session.info.pop('community_feed_changed', None)
@@ -0,0 +1,124 @@
+import hashlib
+import json
+from collections import Counter
+from sqlalchemy import func, select
+from .models import Dream
+from .extensions import db
+from .tags import tags_for_dreams
+from .comment_threads import comment_counts
+from .dream_patterns import dashboard_version, dream_count
+from .memberships import joined_group_count
+
+SERIES_BATCH_SIZE = 500
+RECENT_DREAMS = 5
+CONTENT_PREVIEW_LENGTH = 100
+
+
+def dashboard_etag(user_id, kind):
+    """Fingerprint of a user's dreams, read from one counter row.
+
+    The dashboard version is bumped in the same transaction as every
+    insert, edit or delete of the user's dreams (see dream_patterns), so an
+    unchanged version means the dashboard data is unchanged and the client
+    can be answered with a 304 without touching the dream rows.
+    """
+    raw = f'{kind}:{user_id}:{dashboard_version(user_id)}'
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _emotion_counts(user_id):
+    if db.engine.dialect.name == 'postgresql':
+        emotion = func.trim(func.unnest(func.string_to_array(Dream.dominant_emotions, ','))).label('emotion')
+        inner = select(emotion).where(
+            Dream.user_id == user_id,
+            Dream.dominant_emotions.isnot(None)
+        ).subquery()
+        rows = db.session.execute(
+            select(inner.c.emotion, func.count()).where(inner.c.emotion != '').group_by(inner.c.emotion)
+        )
+        return dict(rows.all())
+
+    # No portable string splitting in SQL; stream just the one column.
+    counts = Counter()
+    rows = db.session.execute(
+        select(Dream.dominant_emotions)
+        .where(Dream.user_id == user_id, Dream.dominant_emotions.isnot(None))
+        .execution_options(yield_per=SERIES_BATCH_SIZE)
+    )
+    for (emotions,) in rows:
+        counts.update(e.strip() for e in emotions.split(',') if e.strip())
+    return dict(counts)
+
+
+def summary_for_user(user_id):
+    """Aggregates behind the dashboard summary cards and doughnut charts."""
+    total, avg_sentiment, avg_lucidity = db.session.query(
+        func.count(Dream.id), func.avg(Dream.sentiment_score), func.avg(Dream.lucidity_level)
+    ).filter(Dream.user_id == user_id).one()
+
+    position = func.coalesce(Dream.sleep_position, 'unknown')
+    position_counts = dict(
+        db.session.query(position, func.count(Dream.id))
+        .filter(Dream.user_id == user_id)
+        .group_by(position)
+        .all()
+    )
+
+    return {
+        'total_dreams': total,
+        'avg_sentiment': float(avg_sentiment or 0),
+        'avg_lucidity': float(avg_lucidity or 0),
+        'position_counts': position_counts,
+        'emotion_counts': _emotion_counts(user_id)
+    }
+
+
+def iter_dream_series_json(user_id):
+    """Yield the per-dream chart series as a JSON array, a row batch at a time."""
+    rows = db.session.execute(
+        select(
+            Dream.id, Dream.created_at, Dream.title,
+            func.substr(Dream.content, 1, CONTENT_PREVIEW_LENGTH),
+            Dream.mood, Dream.sentiment_score, Dream.sentiment_magnitude, Dream.lucidity_level
+        )
+        .where(Dream.user_id == user_id)
+        .order_by(Dream.created_at, Dream.id)
+        .execution_options(yield_per=SERIES_BATCH_SIZE)
+    )
+
+    yield '['
+    batch = []
+    separator = ''
+    for dream_id, created_at, title, content, mood, score, magnitude, lucidity in rows:
+        batch.append(json.dumps({
+            'id': dream_id,
+            'date': created_at.strftime('%Y-%m-%d'),
+            'title': title,
+            'content': content,
+            'mood': mood,
+            'sentiment_score': score or 0,
+            'sentiment_magnitude': magnitude or 0,
+            'lucidity_level': lucidity or 0
+        }))
+        if len(batch) == SERIES_BATCH_SIZE:
+            yield separator + ','.join(batch)
+            batch = []
+            separator = ','
+    if batch:
+        yield separator + ','.join(batch)
+    yield ']'
+
+
+def home_summary(user_id):
+    """Everything the signed-in home page shows, for its cached fragment."""
+    recent = Dream.query.filter(Dream.user_id == user_id).order_by(
+        Dream.created_at.desc(), Dream.id.desc()
+    ).limit(RECENT_DREAMS).all()
+    dream_ids = [dream.id for dream in recent]
+    return {
+        'dream_count': dream_count(user_id),
+        'groups_joined': joined_group_count(user_id),
+        'recent_dreams': recent,
+        'dream_tags': tags_for_dreams(dream_ids),
+        'comment_counts': comment_counts(dream_ids)
+    }
@@ -0,0 +1,185 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import event, inspect, select
+from sqlalchemy.dialects import postgresql, sqlite
+from .models import Dream, DreamPatternStat
+from .extensions import db
+from .tags import parse_tags
+import logging
+
+logger = logging.getLogger(__name__)
+
+DATE_WINDOW_DAYS = 90
+TOP_THEMES = 10
+
+# Columns whose change moves a dream between counters
+TRACKED_COLUMNS = ('user_id', 'mood', 'tags', 'created_at')
+
+# Counter bumped by every change to any of a user's dreams; the dashboard
+# builds its ETag from it. rebuild_dream_patterns only ever raises it.
+VERSION = ('version', 'dashboard')
+
+
+def _facets(user_id, mood, tags, created_at):
+    """The (user_id, kind, key) counters a dream with these values contributes to."""
+    facets = [(user_id, 'total', 'all'), (user_id, 'day', created_at.date().isoformat())]
+    if mood:
+        facets.append((user_id, 'mood', mood))
+    facets.extend((user_id, 'tag', tag) for tag in parse_tags(tags))
+    return facets
+
+
+def bump_dashboard_version(connection, user_ids):
+    """Raise the dashboard version of each user, as part of the caller's transaction."""
+    _upsert(connection, Counter({(user_id, *VERSION): 1 for user_id in set(user_ids)}))
+
+
+def _stored_facets(connection, dream_ids):
+    """Facets of dreams as the database still has them, before this flush writes them.
+
+    Attribute history cannot be trusted for this: a dream edited after a
+    commit expired it has no record of its previous values.
+    """
+    if not dream_ids:
+        return []
+    rows = connection.execute(
+        select(Dream.user_id, Dream.mood, Dream.tags, Dream.created_at)
+        .where(Dream.id.in_(dream_ids), Dream.created_at.isnot(None))
+    )
+    facets = []
+    for row in rows:
+        facets.extend(_facets(*row))
+    return facets
+
+
+def _upsert(connection, deltas):
+    rows = [
+        {'user_id': user_id, 'kind': kind, 'key': key[:100], 'count': delta}
+        for (user_id, kind, key), delta in deltas.items() if delta
+    ]
+    if not rows:
+        return
+
+    dialect = postgresql if connection.dialect.name == 'postgresql' else sqlite
+    stmt = dialect.insert(DreamPatternStat.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'kind', 'key'],
+        set_={'count': DreamPatternStat.__table__.c.count + stmt.excluded.count}
+    )
+    connection.execute(stmt, rows)
+
+    if any(row['count'] < 0 for row in rows):
+        user_ids = {row['user_id'] for row in rows}
+        connection.execute(
+            DreamPatternStat.__table__.delete().where(
+                DreamPatternStat.user_id.in_(user_ids),
+                DreamPatternStat.count <= 0
+            )
+        )
+
+
+@event.listens_for(db.session, 'before_flush')
+def _track_dream_changes(session, flush_context, instances):
+    """Apply counter deltas for new, edited and deleted dreams.
+
+    Runs inside the flush, so the counters commit or roll back together with
+    the dream rows themselves.
+    """
+    deltas = Counter()
+    touched = set()
+
+    for dream in session.new:
+        if isinstance(dream, Dream):
+            if dream.created_at is None:
+                dream.created_at = datetime.utcnow()
+            deltas.update(_facets(dream.user_id, dream.mood, dream.tags, dream.created_at))
+            touched.add(dream.user_id)
+
+    changed = []
+    for dream in session.dirty:
+        if not isinstance(dream, Dream) or not session.is_modified(dream):
+            continue
+        touched.add(dream.user_id)
+        state = inspect(dream)
+        if any(state.attrs[key].history.has_changes() for key in TRACKED_COLUMNS):
+            changed.append(dream)
+    stored = [inspect(dream).identity[0] for dream in changed]
+    stored.extend(inspect(dream).identity[0] for dream in session.deleted if isinstance(dream, Dream))
+
+    if stored:
+        old = _stored_facets(session.connection(), stored)
+        deltas.subtract(old)
+        # Covers deleted dreams and the previous owner of a moved one
+        touched.update(user_id for user_id, kind, _ in old if kind == 'total')
+    for dream in changed:
+        deltas.update(_facets(dream.user_id, dream.mood, dream.tags, dream.created_at))
+
+    deltas.update((user_id, *VERSION) for user_id in touched)
+
+    if deltas:
+        _upsert(session.connection(), deltas)
+
+
+def patterns_for_user(user_id):
+    """Chart data for dream_patterns.html, read from the counter rows only."""
+    since = (datetime.utcnow() - timedelta(days=DATE_WINDOW_DAYS)).date().isoformat()
+    stats = DreamPatternStat.query.filter(
+        DreamPatternStat.user_id == user_id,
+        db.or_(
+            DreamPatternStat.kind.in_(('total', 'mood', 'tag')),
+            db.and_(DreamPatternStat.kind == 'day', DreamPatternStat.key >= since)
+        )
+    ).all()
+
+    by_kind = {'total': {}, 'mood': {}, 'day': {}, 'tag': {}}
+    for stat in stats:
+        by_kind[stat.kind][stat.key] = stat.count
+
+    themes = sorted(by_kind['tag'].items(), key=lambda item: item[1], reverse=True)[:TOP_THEMES]
+    return {
+        'dream_count': by_kind['total'].get('all', 0),
+        'mood_patterns': by_kind['mood'],
+        'dream_dates': dict(sorted(by_kind['day'].items())),
+        'common_themes': dict(themes),
+        'ai_analysis': None
+    }
+
+
+def dashboard_version(user_id):
+    return db.session.query(DreamPatternStat.count).filter_by(
+        user_id=user_id, kind=VERSION[0], key=VERSION[1]
+    ).scalar() or 0
+
+
+def dream_count(user_id):
+    """The user's number of dreams, read from the 'total' counter row."""
+    return db.session.query(DreamPatternStat.count).filter_by(
+        user_id=user_id, kind='total', key='all'
+    ).scalar() or 0
+
+
+def rebuild_dream_patterns(user_id=None, batch_size=1000):
+    """Recompute the counters from the dream table, for one user or everyone."""
+    delete = DreamPatternStat.query.filter(DreamPatternStat.kind != VERSION[0])
+    dreams = select(Dream.user_id, Dream.mood, Dream.tags, Dream.created_at)
+    if user_id is not None:
+        delete = delete.filter_by(user_id=user_id)
+        dreams = dreams.where(Dream.user_id == user_id)
+    delete.delete(synchronize_session=False)
+
+    counts = Counter()
+    rows = db.session.execute(
+        dreams.where(Dream.created_at.isnot(None)).execution_options(yield_per=batch_size)
+    )
+    for row in rows:
+        counts.update(_facets(*row))
+
+    db.session.bulk_insert_mappings(DreamPatternStat, [
+        {'user_id': uid, 'kind': kind, 'key': key[:100], 'count': count}
+        for (uid, kind, key), count in counts.items()
+    ])
+    # Rows written outside the ORM may be why this rebuild runs
+    bump_dashboard_version(db.session.connection(), [uid for uid, kind, _ in counts if kind == 'total'])
+    db.session.commit()
+    logger.info(f"Rebuilt {len(counts)} dream pattern counters")
+    return len(counts)
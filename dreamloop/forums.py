@@ -0,0 +1,91 @@
+from collections import Counter
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import joinedload
+from .models import DreamGroup, ForumPost, ForumReply
+from .extensions import db
+from .pagination import keyset_paginate
+import logging
+
+logger = logging.getLogger(__name__)
+
+DISCUSSION_PAGE_SIZE = 20
+REPLY_PAGE_SIZE = 50
+
+
+def discussions_page(group_id, cursor=None, page_size=DISCUSSION_PAGE_SIZE):
+    """Newest discussions of a group, one keyset page at a time, authors joined in."""
+    query = ForumPost.query.options(joinedload(ForumPost.user)).filter(ForumPost.group_id == group_id)
+    return keyset_paginate(query, ForumPost.created_at, ForumPost.id, cursor, page_size)
+
+
+def replies_page(post_id, cursor=None, page_size=REPLY_PAGE_SIZE):
+    """Replies to a discussion in the order they were written, one keyset page at a time."""
+    query = ForumReply.query.options(joinedload(ForumReply.user)).filter(ForumReply.post_id == post_id)
+    return keyset_paginate(
+        query, ForumReply.created_at, ForumReply.id, cursor, page_size, newest_first=False
+    )
+
+
+def delete_discussion_thread(post):
+    """Delete a discussion and its replies without loading them."""
+    db.session.execute(ForumReply.__table__.delete().where(ForumReply.post_id == post.id))
+    db.session.delete(post)
+
+
+def _apply_deltas(connection, table, column, deltas):
+    for row_id, delta in deltas.items():
+        if delta:
+            connection.execute(
+                table.update().where(table.c.id == row_id).values({column: table.c[column] + delta})
+            )
+
+
+@event.listens_for(db.session, 'after_flush')
+def _update_forum_counts(session, flush_context):
+    """Keep ForumPost.reply_count and DreamGroup.post_count in step within the flush."""
+    replies = Counter()
+    posts = Counter()
+    for obj in session.new:
+        if isinstance(obj, ForumReply):
+            replies[obj.post_id] += 1
+        elif isinstance(obj, ForumPost):
+            posts[obj.group_id] += 1
+    for obj in session.deleted:
+        if isinstance(obj, ForumReply):
+            replies[obj.post_id] -= 1
+        elif isinstance(obj, ForumPost):
+            posts[obj.group_id] -= 1
+
+    if replies or posts:
+        connection = session.connection()
+        _apply_deltas(connection, ForumPost.__table__, 'reply_count', replies)
+        _apply_deltas(connection, DreamGroup.__table__, 'post_count', posts)
+
+
+def reconcile_forum_counts():
+    """Recompute reply and discussion counters from the forum tables.
+
+    Only rows whose stored value has drifted are written. Returns the number
+    of posts and groups that were repaired.
+    """
+    actual_replies = (
+        select(func.count(ForumReply.id))
+        .where(ForumReply.post_id == ForumPost.id)
+        .scalar_subquery()
+    )
+    actual_posts = (
+        select(func.count(ForumPost.id))
+        .where(ForumPost.group_id == DreamGroup.id)
+        .scalar_subquery()
+    )
+    repaired = db.session.query(ForumPost).filter(ForumPost.reply_count != actual_replies).update(
+        {ForumPost.reply_count: actual_replies},
+        synchronize_session=False
+    )
+    repaired += db.session.query(DreamGroup).filter(DreamGroup.post_count != actual_posts).update(
+        {DreamGroup.post_count: actual_posts},
+        synchronize_session=False
+    )
+    db.session.commit()
+    logger.info(f"Reconciled forum counts for {repaired} rows")
+    return repaired
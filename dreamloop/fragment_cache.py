@@ -0,0 +1,125 @@
+import hashlib
+import uuid
+from flask import current_app
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from sqlalchemy import event, select
+from .models import Dream, Comment, DreamGroup, GroupMembership, ForumPost
+from .extensions import db
+from .cache import TTLCache, register_cache, get_shared_cache
+import logging
+
+logger = logging.getLogger(__name__)
+
+local_fragments = register_cache(
+    'fragments', TTLCache(maxsize=1024, ttl=60, maxweight=16 * 1024 * 1024, weigher=len)
+)
+
+
+def _backend():
+    if current_app.config.get('FRAGMENT_CACHE_BACKEND') == 'shared':
+        return get_shared_cache()
+    return local_fragments
+
+
+def _version_key(scope):
+    return f'fragment_version:{scope}'
+
+
+def _versions(backend, scopes):
+    """Current version token of every scope, minting tokens for unseen scopes."""
+    tokens = []
+    for scope in scopes:
+        token = backend.get(_version_key(scope))
+        if token is None:
+            token = uuid.uuid4().hex
+            backend.set(_version_key(scope), token)
+        tokens.append(token)
+    return tokens
+
+
+def invalidate_fragments(*scopes):
+    """Give each scope a new version, orphaning every fragment rendered under the old one."""
+    backend = _backend()
+    for scope in scopes:
+        backend.set(_version_key(scope), uuid.uuid4().hex)
+
+
+def mark_stale(*scopes, session=None):
+    """Invalidate ``scopes`` once the current transaction commits."""
+    session = session or db.session
+    session.info.setdefault('stale_fragment_scopes', set()).update(scopes)
+
+
+class FragmentCacheExtension(Extension):
+    """``{% cache name, key... , versions=[scope, ...] %}...{% endcache %}``
+
+    The body is rendered once and reused until the TTL runs out or any of
+    the version scopes is invalidated. Key parts distinguish variants of
+    the same fragment (user, page cursor); scopes name the data it was
+    rendered from, e.g. ``'dreams:' ~ current_user.id``.
+    """
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        versions = nodes.List([])
+        while parser.stream.skip_if('comma'):
+            if parser.stream.current.test('name:versions') and parser.stream.look().test('assign'):
+                next(parser.stream)
+                next(parser.stream)
+                versions = parser.parse_expression()
+            else:
+                parts.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render', [nodes.List(parts), versions]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render(self, parts, scopes, caller):
+        backend = _backend()
+        raw = ':'.join(str(part) for part in parts + _versions(backend, scopes))
+        key = 'fragment:' + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+        html = backend.get(key)
+        if html is None:
+            html = str(caller())
+            backend.set(key, html, ttl=current_app.config.get('FRAGMENT_CACHE_TTL'))
+        return Markup(html)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _note_stale_fragments(session, flush_context):
+    scopes = set()
+    commented_dreams = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Dream):
+            scopes.add(f'dreams:{obj.user_id}')
+        elif isinstance(obj, Comment) and obj not in session.dirty:
+            commented_dreams.add(obj.dream_id)
+        elif isinstance(obj, GroupMembership):
+            scopes.update(('groups', f'groups:{obj.user_id}'))
+        elif isinstance(obj, (DreamGroup, ForumPost)):
+            scopes.add('groups')
+
+    if commented_dreams:
+        owners = session.connection().execute(
+            select(Dream.user_id).where(Dream.id.in_(commented_dreams))
+        ).scalars()
+        scopes.update(f'dreams:{owner}' for owner in owners)
+    if scopes:
+        mark_stale(*scopes, session=session)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_after_commit(session):
+    scopes = session.info.pop('stale_fragment_scopes', None)
+    if scopes:
+        invalidate_fragments(*scopes)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_after_rollback(session):
+    session.info.pop('stale_fragment_scopes', None)
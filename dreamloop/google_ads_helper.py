@@ -149,7 +149,7 @@ def show_premium_ads(user):
             return False
             
         # Show ads more frequently as users approach their limits
-        if user.monthly_ai_analysis_count >= 2:  # User has used 2 or more of their 3 free analyses
+        if user.analyses_used_this_month() >= 2:  # User has used 2 or more of their 3 free analyses
             logger.debug(f"User {user.id} approaching analysis limit, showing ads")
             return True
             
@@ -0,0 +1,66 @@
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached, object_session
+from .models import Users
+from .extensions import db
+from .cache import TTLCache, register_cache
+
+# Columns that change outside the ORM (arithmetic UPDATEs) or outside this
+# process (the analysis workers) are never cached; they are loaded on first
+# access instead.
+VOLATILE_COLUMNS = {'unread_count', 'monthly_ai_analysis_count', 'last_analysis_reset'}
+
+user_cache = register_cache('users', TTLCache())
+
+
+def _snapshot(user):
+    return {
+        attr.key: getattr(user, attr.key)
+        for attr in inspect(Users).column_attrs
+        if attr.key not in VOLATILE_COLUMNS
+    }
+
+
+def load_cached_user(user_id):
+    """Flask-Login user loader backed by the per-worker identity cache.
+
+    On a hit the user is rebuilt from the cached column values and attached
+    to the session without a query.
+    """
+    if user_id is None:
+        return None
+    user_id = int(user_id)
+
+    columns = user_cache.get(user_id)
+    if columns is None:
+        user = db.session.get(Users, user_id)
+        if user is not None:
+            user_cache.set(user_id, _snapshot(user))
+        return user
+
+    user = Users(**columns)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def invalidate_user(user_id):
+    user_cache.delete(user_id)
+
+
+@event.listens_for(Users, 'after_update')
+@event.listens_for(Users, 'after_delete')
+def _remember_changed_user(mapper, connection, target):
+    # Drop the entry now and again once the transaction commits, so a
+    # concurrent request cannot re-cache the pre-commit row in between.
+    invalidate_user(target.id)
+    object_session(target).info.setdefault('changed_user_ids', set()).add(target.id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_committed_users(session):
+    for user_id in session.info.pop('changed_user_ids', ()):
+        invalidate_user(user_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_rolled_back_users(session):
+    session.info.pop('changed_user_ids', None)
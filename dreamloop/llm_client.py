@@ -0,0 +1,352 @@
+from contextlib import contextmanager
+import os
+import random
+import threading
+import time
+import openai
+from flask import current_app
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisError(Exception):
+    """A model call that failed; ``retryable`` tells job workers whether to try again."""
+    retryable = True
+
+
+class AnalysisNotConfigured(AnalysisError):
+    retryable = False
+
+
+class RequestRejected(AnalysisError):
+    """The provider refused the request itself; sending it again will not help."""
+    retryable = False
+
+
+class CircuitOpen(AnalysisError):
+    """The provider has been failing, so calls fail fast instead of waiting on it."""
+
+
+class ClientBusy(AnalysisError):
+    """Every model call slot of this worker stayed taken until the deadline."""
+
+
+# Errors worth another attempt: the request never got an answer, the
+# provider is overloaded, or it failed on its side.
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+
+class CircuitBreaker:
+    """Opens after ``threshold`` consecutive failures and fails calls fast for ``reset_after`` seconds.
+
+    After that one trial call is let through: its success closes the
+    breaker, its failure opens it again.
+    """
+
+    def __init__(self, threshold, reset_after):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.trips = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_after:
+            return 'half_open'
+        return 'open'
+
+    def before_call(self):
+        """Let a call through or raise CircuitOpen; returns True if the call is the trial call."""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return False
+            if state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+        raise CircuitOpen("The model provider is unavailable; try again shortly")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or (self._opened_at is None and self.failures >= self.threshold):
+                self._opened_at = time.monotonic()
+                self.trips += 1
+                logger.warning(f"Model circuit breaker opened after {self.failures} consecutive failures")
+            self._probing = False
+
+    def cancel_probe(self):
+        """Give up a trial call that never reached the provider."""
+        with self._lock:
+            self._probing = False
+
+
+class LLMClient:
+    """The worker's one OpenAI client, shared by every thread.
+
+    Reusing the client keeps its HTTP connections alive between calls.
+    Each call has a deadline covering queueing, every attempt and the
+    backoff between them; at most ``max_concurrency`` calls are in flight,
+    and the circuit breaker fails calls fast while the provider is down.
+    """
+
+    def __init__(self, api_key, base_url=None, timeout=60, deadline=120, max_retries=3,
+                 retry_base=0.5, retry_max=8, max_concurrency=8,
+                 breaker_threshold=5, breaker_reset=30):
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.max_concurrency = max_concurrency
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        # The SDK's own retries would ignore the deadline and the breaker
+        self._client = openai.OpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._counters_lock = threading.Lock()
+        self.counters = {'calls': 0, 'retries': 0, 'failed': 0, 'fast_failed': 0, 'busy': 0}
+
+    def _count(self, name):
+        with self._counters_lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        with self._counters_lock:
+            counters = dict(self.counters)
+        return {
+            **counters,
+            'breaker': self.breaker.state,
+            'breaker_trips': self.breaker.trips,
+            'max_concurrency': self.max_concurrency
+        }
+
+    @contextmanager
+    def _slot(self, deadline):
+        if not self._slots.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            self._count('busy')
+            raise ClientBusy("Too many model calls in progress")
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def _backoff(self, attempt, error):
+        """Full-jitter exponential delay, stretched to any Retry-After the provider sent.
+
+        Only the jitter is capped at ``retry_max``; a longer Retry-After is
+        honoured, and the caller fails fast if it runs past the deadline.
+        """
+        delay = random.uniform(0, min(self.retry_max, self.retry_base * 2 ** (attempt - 1)))
+        response = getattr(error, 'response', None)
+        try:
+            retry_after = float(response.headers.get('retry-after')) if response is not None else 0
+        except (TypeError, ValueError):
+            retry_after = 0
+        return max(delay, retry_after)
+
+    def _send(self, deadline, **params):
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._count('failed')
+                raise AnalysisError("Model call deadline exceeded")
+            try:
+                probe = self.breaker.before_call()
+            except CircuitOpen:
+                self._count('fast_failed')
+                raise
+            self._count('calls')
+            try:
+                response = self._client.chat.completions.create(
+                    timeout=min(self.timeout, remaining), **params
+                )
+            except RETRYABLE_ERRORS as e:
+                if isinstance(e, openai.RateLimitError):
+                    self.breaker.record_success()  # throttled, but answering
+                else:
+                    self.breaker.record_failure()
+                attempt += 1
+                delay = self._backoff(attempt, e)
+                if attempt > self.max_retries or time.monotonic() + delay >= deadline:
+                    self._count('failed')
+                    raise AnalysisError(f"Model call failed after {attempt} attempts: {str(e)}") from e
+                self._count('retries')
+                logger.warning(f"Model call failed (attempt {attempt}), retrying in {delay:.2f}s: {str(e)}")
+                time.sleep(delay)
+                continue
+            except openai.AuthenticationError as e:
+                self.breaker.record_success()
+                self._count('failed')
+                raise AnalysisNotConfigured(str(e)) from e
+            except openai.APIStatusError as e:
+                self.breaker.record_success()
+                self._count('failed')
+                raise RequestRejected(str(e)) from e
+            except openai.OpenAIError as e:
+                self.breaker.record_failure()
+                self._count('failed')
+                raise AnalysisError(str(e)) from e
+            except BaseException:
+                # A bug or an interrupt says nothing about the provider; without
+                # this a trial call ending here would keep the breaker open for good
+                if probe:
+                    self.breaker.cancel_probe()
+                raise
+            self.breaker.record_success()
+            return response
+
+    def complete(self, model, messages, max_tokens, temperature):
+        """Run one chat completion and return its text."""
+        deadline = time.monotonic() + self.deadline
+        with self._slot(deadline):
+            response = self._send(
+                deadline, model=model, messages=messages, max_tokens=max_tokens, temperature=temperature
+            )
+        return response.choices[0].message.content
+
+    def stream(self, model, messages, max_tokens, temperature):
+        """Yield a chat completion's text as it arrives.
+
+        Only opening the stream is retried; once text has been handed out a
+        failure ends the stream with AnalysisError. The call keeps its slot
+        until the stream is finished or closed.
+        """
+        deadline = time.monotonic() + self.deadline
+        with self._slot(deadline):
+            response = self._send(
+                deadline, model=model, messages=messages, max_tokens=max_tokens,
+                temperature=temperature, stream=True
+            )
+            try:
+                for chunk in response:
+                    if time.monotonic() > deadline:
+                        raise AnalysisError("Model call deadline exceeded")
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            except AnalysisError:
+                self._count('failed')
+                raise
+            except Exception as e:
+                # Read timeouts and dropped connections surface from the HTTP layer
+                self.breaker.record_failure()
+                self._count('failed')
+                raise AnalysisError(f"Model stream failed: {str(e)}") from e
+            finally:
+                response.close()
+
+
+_client = None
+_client_settings = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    """Return the worker's shared client, built from the app config on first use."""
+    global _client, _client_settings
+    config = current_app.config
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        logger.error("OpenAI API key not found")
+        raise AnalysisNotConfigured("OpenAI API key not configured")
+    settings = (
+        api_key, config.get('OPENAI_BASE_URL'), config['LLM_TIMEOUT_SECONDS'],
+        config['LLM_DEADLINE_SECONDS'], config['LLM_MAX_RETRIES'], config['LLM_RETRY_BASE_SECONDS'],
+        config['LLM_RETRY_MAX_SECONDS'], config['LLM_MAX_CONCURRENCY'],
+        config['LLM_BREAKER_THRESHOLD'], config['LLM_BREAKER_RESET_SECONDS']
+    )
+    with _client_lock:
+        if _client is None or _client_settings != settings:
+            _client = LLMClient(*settings)
+            _client_settings = settings
+        return _client
+
+
+def benchmark_llm_client(requests=200, concurrency=16, delay=0.05, error_rate=0.0,
+                         hang_rate=0.0, stream=False):
+    """Drive a client built from the app config against a local stub provider.
+
+    The stub (dreamloop.llm_stub) answers after ``delay`` seconds, fails
+    ``error_rate`` of requests with a 503 and never answers ``hang_rate``
+    of them, so retries, deadlines and the breaker can be watched under
+    load. Returns outcome counts, latency percentiles, client counters
+    and how many connections the stub accepted.
+    """
+    from .llm_stub import start_stub_server
+
+    config = current_app.config
+    server = start_stub_server(delay=delay, error_rate=error_rate, hang_rate=hang_rate)
+    client = LLMClient(
+        'stub-key', base_url=f'http://127.0.0.1:{server.server_port}/v1',
+        timeout=config['LLM_TIMEOUT_SECONDS'], deadline=config['LLM_DEADLINE_SECONDS'],
+        max_retries=config['LLM_MAX_RETRIES'], retry_base=config['LLM_RETRY_BASE_SECONDS'],
+        retry_max=config['LLM_RETRY_MAX_SECONDS'], max_concurrency=config['LLM_MAX_CONCURRENCY'],
+        breaker_threshold=config['LLM_BREAKER_THRESHOLD'],
+        breaker_reset=config['LLM_BREAKER_RESET_SECONDS']
+    )
+    messages = [{'role': 'user', 'content': 'Dream: I was flying over a quiet sea.'}]
+    client.complete('stub', messages, 200, 0.7)  # warm up the SDK outside the timings
+    outcomes = {}
+    latencies = []
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def caller():
+        while True:
+            with lock:
+                if not remaining[0]:
+                    return
+                remaining[0] -= 1
+            started = time.perf_counter()
+            try:
+                if stream:
+                    ''.join(client.stream('stub', messages, 200, 0.7))
+                else:
+                    client.complete('stub', messages, 200, 0.7)
+                outcome = 'ok'
+            except AnalysisError as e:
+                outcome = type(e).__name__
+            elapsed = time.perf_counter() - started
+            with lock:
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+                latencies.append(elapsed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=caller) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+    server.server_close()
+
+    latencies.sort()
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1) if latencies else None
+
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 2),
+        'per_sec': round(requests / elapsed, 1) if elapsed else None,
+        'outcomes': outcomes,
+        'p50_ms': percentile(0.5),
+        'p95_ms': percentile(0.95),
+        'max_ms': round(latencies[-1] * 1000, 1) if latencies else None,
+        'connections': server.connections,
+        'client': client.stats()
+    }
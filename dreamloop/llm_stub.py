@@ -0,0 +1,123 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+STUB_REPLY = (
+    "### Key Symbols and Their Meanings\nWater and flight: freedom and feeling.\n\n"
+    "### Emotional Themes\nA mix of curiosity and unease.\n\n"
+    "### Possible Interpretations\nA period of change in waking life.\n\n"
+    "### Psychological Significance\nProcessing recent experiences.\n\n"
+    "### Action Steps or Reflections\nKeep journaling similar dreams."
+)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers POST .../chat/completions like the OpenAI API, plain or streamed."""
+
+    protocol_version = 'HTTP/1.1'  # keep connections alive between requests
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.path.endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'Not found', 'type': 'invalid_request_error'}})
+            return
+
+        server = self.server
+        roll = random.random()
+        if roll < server.hang_rate:
+            time.sleep(server.hang_seconds)
+            self.close_connection = True
+            return
+        time.sleep(server.delay)
+        if roll < server.hang_rate + server.error_rate:
+            self._send_json(503, {'error': {'message': 'Stub provider overloaded', 'type': 'server_error'}})
+            return
+
+        model = request.get('model', 'stub')
+        if request.get('stream'):
+            self._stream(model)
+            return
+        self._send_json(200, {
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': STUB_REPLY},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+        })
+
+    def _write_chunk(self, data):
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def _stream(self, model):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        words = STUB_REPLY.split(' ')
+        for index, word in enumerate(words):
+            chunk = {
+                'id': 'chatcmpl-stub',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'delta': {'content': word if index == 0 else ' ' + word},
+                    'finish_reason': 'stop' if index == len(words) - 1 else None
+                }]
+            }
+            self._write_chunk(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+        self._write_chunk(b'data: [DONE]\n\n')
+        self._write_chunk(b'')
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, delay=0.0, error_rate=0.0, hang_rate=0.0, hang_seconds=300):
+        super().__init__(address, StubHandler)
+        self.delay = delay
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # Clients that time out hang up mid-answer; that is expected here
+        logger.debug(f"Stub client {client_address} disconnected", exc_info=True)
+
+
+def start_stub_server(host='127.0.0.1', port=0, **options):
+    """Serve the stub provider from a background thread; port 0 picks a free port."""
+    server = StubServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, name='llm-stub', daemon=True).start()
+    return server
@@ -0,0 +1,71 @@
+import hashlib
+import markdown
+from sqlalchemy import bindparam, event, inspect, select
+from .models import Dream
+from .extensions import db
+from .cache import TTLCache, register_cache
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Keyed by content hash, so entries never go stale and need no TTL
+markdown_cache = register_cache('markdown', TTLCache(maxweight=8 * 1024 * 1024, weigher=len))
+
+
+def _cache_key(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def render_markdown(text):
+    """Render ``text`` to HTML, reusing earlier renders of identical text."""
+    if not text:
+        return ''
+    key = _cache_key(text)
+    html = markdown_cache.get(key)
+    if html is None:
+        html = markdown.markdown(text)
+        markdown_cache.set(key, html)
+    return html
+
+
+@event.listens_for(db.session, 'before_flush')
+def _render_changed_analyses(session, flush_context, instances):
+    """Store the rendered HTML whenever a dream's analysis is written."""
+    for dream in list(session.new) + list(session.dirty):
+        if isinstance(dream, Dream) and inspect(dream).attrs.ai_analysis.history.has_changes():
+            dream.ai_analysis_html = render_markdown(dream.ai_analysis) or None
+
+
+def backfill_analysis_html(batch_size=500):
+    """Render ai_analysis_html for dreams analysed before the column existed.
+
+    Walks the dream table in id order, committing each batch, so it can run
+    against a live database and be resumed. ``updated_at`` is left alone:
+    the HTML is derived data, not an edit of the dream.
+    """
+    table = Dream.__table__
+    stmt = table.update().where(table.c.id == bindparam('dream_id')).values(
+        ai_analysis_html=bindparam('html'),
+        updated_at=table.c.updated_at
+    )
+    last_id = 0
+    total = 0
+    while True:
+        rows = db.session.execute(
+            select(Dream.id, Dream.ai_analysis)
+            .where(Dream.id > last_id, Dream.ai_analysis.isnot(None), Dream.ai_analysis_html.is_(None))
+            .order_by(Dream.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        db.session.execute(stmt, [
+            {'dream_id': dream_id, 'html': render_markdown(text)} for dream_id, text in rows
+        ])
+        db.session.commit()
+
+        last_id = rows[-1][0]
+        total += len(rows)
+        logger.info(f"Rendered analysis HTML for {total} dreams (last id {last_id})")
+    return total
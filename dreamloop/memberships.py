@@ -0,0 +1,138 @@
+from collections import Counter
+from sqlalchemy import event, exists, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from .models import DreamGroup, GroupMembership
+from .extensions import db
+from .pagination import keyset_paginate, DEFAULT_PAGE_SIZE
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def membership_exists(user_id, group_id):
+    return select(exists().where(
+        GroupMembership.user_id == user_id,
+        GroupMembership.group_id == group_id
+    ))
+
+
+def is_member(user_id, group_id):
+    """Whether the user belongs to the group, answered from the (user_id, group_id) index."""
+    return db.session.execute(membership_exists(user_id, group_id)).scalar()
+
+
+def membership_role(user_id, group_id):
+    """The user's role in the group, or None if they are not a member."""
+    return db.session.query(GroupMembership.role).filter_by(
+        user_id=user_id, group_id=group_id
+    ).limit(1).scalar()
+
+
+def member_group_ids(user_id, group_ids):
+    """The subset of ``group_ids`` the user belongs to, in one query."""
+    if not group_ids:
+        return set()
+    return set(db.session.execute(
+        select(GroupMembership.group_id).where(
+            GroupMembership.user_id == user_id,
+            GroupMembership.group_id.in_(list(group_ids))
+        )
+    ).scalars())
+
+
+def member_ids(group_id, exclude=None):
+    """Ids of every member of the group, for notification fan-out."""
+    query = select(GroupMembership.user_id).where(GroupMembership.group_id == group_id)
+    if exclude is not None:
+        query = query.where(GroupMembership.user_id != exclude)
+    return db.session.execute(query).scalars().all()
+
+
+def joined_group_count(user_id):
+    return db.session.query(func.count(GroupMembership.id)).filter_by(user_id=user_id).scalar()
+
+
+def members_query(group_id):
+    return GroupMembership.query.options(joinedload(GroupMembership.user)).filter(
+        GroupMembership.group_id == group_id
+    )
+
+
+def members_page(group_id, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """Newest members first, one keyset page at a time, with their users joined in."""
+    return keyset_paginate(
+        members_query(group_id), GroupMembership.joined_at, GroupMembership.id, cursor, page_size
+    )
+
+
+def add_member(user_id, group_id, role='member'):
+    """Add the user to the group; returns False if they already belong to it.
+
+    The row is flushed in a savepoint, so a concurrent join that wins the
+    race on the (user_id, group_id) unique constraint only rolls back this
+    insert and its member_count change.
+    """
+    if is_member(user_id, group_id):
+        return False
+    try:
+        with db.session.begin_nested():
+            db.session.add(GroupMembership(user_id=user_id, group_id=group_id, role=role))
+    except IntegrityError:
+        return False
+    return True
+
+
+def remove_member(user_id, group_id):
+    """Remove the user from the group; returns False if they were not a member."""
+    membership = GroupMembership.query.filter_by(user_id=user_id, group_id=group_id).first()
+    if membership is None:
+        return False
+    db.session.delete(membership)
+    return True
+
+
+@event.listens_for(db.session, 'after_flush')
+def _update_member_counts(session, flush_context):
+    """Keep DreamGroup.member_count in step with the membership rows.
+
+    Runs inside the flush as one arithmetic UPDATE per group, so concurrent
+    joins never overwrite each other and the count commits or rolls back
+    together with the membership itself.
+    """
+    deltas = Counter()
+    for membership in session.new:
+        if isinstance(membership, GroupMembership):
+            deltas[membership.group_id] += 1
+    for membership in session.deleted:
+        if isinstance(membership, GroupMembership):
+            deltas[membership.group_id] -= 1
+
+    connection = session.connection() if deltas else None
+    for group_id, delta in deltas.items():
+        if delta:
+            connection.execute(
+                DreamGroup.__table__.update()
+                .where(DreamGroup.id == group_id)
+                .values(member_count=DreamGroup.__table__.c.member_count + delta)
+            )
+
+
+def reconcile_member_counts():
+    """Recompute every group's member_count from group_membership.
+
+    Only rows whose stored value has drifted are written. Returns the number
+    of groups that were repaired.
+    """
+    actual = (
+        select(func.count(GroupMembership.id))
+        .where(GroupMembership.group_id == DreamGroup.id)
+        .scalar_subquery()
+    )
+    repaired = db.session.query(DreamGroup).filter(DreamGroup.member_count != actual).update(
+        {DreamGroup.member_count: actual},
+        synchronize_session=False
+    )
+    db.session.commit()
+    logger.info(f"Reconciled member counts for {repaired} groups")
+    return repaired
@@ -1,16 +1,36 @@
 from .extensions import db
 from flask_login import UserMixin
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+
+FREE_MONTHLY_ANALYSES = 3
 
 class Users(UserMixin, db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index(
+            'ix_users_stripe_customer_id', 'stripe_customer_id',
+            postgresql_where=db.text('stripe_customer_id IS NOT NULL'),
+            sqlite_where=db.text('stripe_customer_id IS NOT NULL')
+        ),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
     username = db.Column(db.String(80), unique=True, nullable=False)
     password_hash = db.Column(db.String(200), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Denormalized; maintained by notification_counter
+    unread_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    # Subscription, written by the Stripe webhook handler
+    subscription_type = db.Column(db.String(20), default='free')
+    stripe_customer_id = db.Column(db.String(100))
+    subscription_start_date = db.Column(db.DateTime)
+    subscription_end_date = db.Column(db.DateTime)
+    
+    # AI analyses used this month; free accounts get FREE_MONTHLY_ANALYSES
+    monthly_ai_analysis_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_analysis_reset = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
     dreams = db.relationship('Dream', backref='author', lazy=True)
@@ -33,32 +53,120 @@ class Users(UserMixin, db.Model):
         lazy=True
     )
     
+    @classmethod
+    def by_stripe_customer(cls, customer_id):
+        return cls.query.filter_by(stripe_customer_id=customer_id)
+
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        from .passwords import hash_password
+        self.password_hash = hash_password(password)
         
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        """Verify the password, upgrading a hash made with outdated cost settings."""
+        from .passwords import verify_password
+        return verify_password(self, password)
+
+    def analyses_used_this_month(self):
+        """The monthly count, read as zero once the month it was counted in is over.
+
+        The stored count is reset lazily by the next reservation in
+        dreamloop.ai_quota, not by a batch job.
+        """
+        now = datetime.utcnow()
+        last = self.last_analysis_reset
+        if last is None or (last.year, last.month) != (now.year, now.month):
+            return 0
+        return self.monthly_ai_analysis_count or 0
+
+    def ai_analyses_remaining(self):
+        return max(FREE_MONTHLY_ANALYSES - self.analyses_used_this_month(), 0)
+
+    def can_use_ai_analysis(self):
+        """Whether an analysis would currently be granted.
+
+        Only a hint for the UI and for queueing; dreamloop.ai_quota.reserve_analysis
+        is what actually takes an analysis from the allowance.
+        """
+        return self.subscription_type == 'premium' or self.ai_analyses_remaining() > 0
 
 class Notification(db.Model):
     __tablename__ = 'notification'
+    __table_args__ = (
+        db.Index('ix_notification_user_read_created', 'user_id', 'read', 'created_at'),
+        # Badge counts and the inbox only ever look at unread rows
+        db.Index(
+            'ix_notification_unread', 'user_id', 'created_at',
+            postgresql_where=db.text('read = false'),
+            sqlite_where=db.text('read = 0')
+        ),
+        # The full inbox, newest first
+        db.Index('ix_notification_user_created', 'user_id', 'created_at', 'id'),
+        # The archival job walks old read rows oldest first
+        db.Index(
+            'ix_notification_read_created', 'created_at', 'id',
+            postgresql_where=db.text('read = true'),
+            sqlite_where=db.text('read = 1')
+        ),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     message = db.Column(db.String(500), nullable=False)
     read = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     notification_type = db.Column(db.String(50))
     related_id = db.Column(db.Integer)
 
+class NotificationArchive(db.Model):
+    """Read notifications moved out of the live table by the retention job.
+
+    The primary key includes created_at so the table can be range
+    partitioned by month on Postgres.
+    """
+    __tablename__ = 'notification_archive'
+    __table_args__ = (
+        db.Index('ix_notification_archive_user_created', 'user_id', 'created_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    created_at = db.Column(db.DateTime, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    message = db.Column(db.String(500), nullable=False)
+    notification_type = db.Column(db.String(50))
+    related_id = db.Column(db.Integer)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
 class Dream(db.Model):
     __tablename__ = 'dream'
+    __table_args__ = (
+        db.Index('ix_dream_user_created', 'user_id', 'created_at', 'id'),
+        # Community listings only ever look at shared dreams
+        db.Index(
+            'ix_dream_public_created', 'created_at', 'id',
+            postgresql_where=db.text('is_private = false'),
+            sqlite_where=db.text('is_private = 0')
+        ),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     content = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     is_private = db.Column(db.Boolean, default=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    mood = db.Column(db.String(50))
+    tags = db.Column(db.String(200))
+    ai_analysis = db.Column(db.Text)
+    # Rendered from ai_analysis by markdown_cache whenever the analysis is written
+    ai_analysis_html = db.Column(db.Text)
+    
+    # Dashboard metrics
+    sentiment_score = db.Column(db.Float)
+    sentiment_magnitude = db.Column(db.Float)
+    dominant_emotions = db.Column(db.String(200))
+    lucidity_level = db.Column(db.Float)
+    sleep_position = db.Column(db.String(50))
 
 class DreamGroup(db.Model):
     __tablename__ = 'dream_group'
@@ -68,7 +176,12 @@ class DreamGroup(db.Model):
     description = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     creator_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # Maintained by dreamloop.memberships on every membership insert/delete
+    member_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Maintained by dreamloop.forums on every discussion insert/delete
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
+    creator = db.relationship('Users', foreign_keys=[creator_id])
     memberships = db.relationship(
         'GroupMembership',
         back_populates='group',
@@ -83,12 +196,17 @@ class DreamGroup(db.Model):
 
 class GroupMembership(db.Model):
     __tablename__ = 'group_membership'
+    __table_args__ = (
+        # One row per user and group; its index also serves membership lookups
+        db.UniqueConstraint('user_id', 'group_id', name='uq_group_membership_user_group'),
+        db.Index('ix_group_membership_group_joined', 'group_id', 'joined_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     group_id = db.Column(db.Integer, db.ForeignKey('dream_group.id'), nullable=False)
     role = db.Column(db.String(20), default='member')
-    joined_at = db.Column(db.DateTime, default=datetime.utcnow)
+    joined_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
     user = db.relationship(
         'Users',
@@ -101,4 +219,138 @@ class GroupMembership(db.Model):
         overlaps="members"
     )
 
+class DreamPatternStat(db.Model):
+    """Per-user dream counters, maintained by dream_patterns on every flush."""
+    __tablename__ = 'dream_pattern_stat'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    kind = db.Column(db.String(10), primary_key=True)  # total, mood, day or tag
+    key = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class Tag(db.Model):
+    __tablename__ = 'tag'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+
+class DreamTag(db.Model):
+    """Inverted index from tags to dreams, derived from Dream.tags by tags.py."""
+    __tablename__ = 'dream_tag'
+    __table_args__ = (
+        db.Index('ix_dream_tag_tag_dream', 'tag_id', 'dream_id'),
+    )
+    
+    dream_id = db.Column(db.Integer, db.ForeignKey('dream.id', ondelete='CASCADE'), primary_key=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey('tag.id', ondelete='CASCADE'), primary_key=True)
+
+class Comment(db.Model):
+    __tablename__ = 'comment'
+    __table_args__ = (
+        # Top-level comments of a dream, newest first
+        db.Index('ix_comment_dream_parent_created', 'dream_id', 'parent_id', 'created_at', 'id'),
+        # Children of a comment, walked by the recursive thread query
+        db.Index('ix_comment_parent_created', 'parent_id', 'created_at', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    dream_id = db.Column(db.Integer, db.ForeignKey('dream.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    parent_id = db.Column(db.Integer, db.ForeignKey('comment.id', ondelete='CASCADE'))
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    edited_at = db.Column(db.DateTime)
+    is_hidden = db.Column(db.Boolean, default=False)
+    moderation_reason = db.Column(db.String(200))
+    # Direct replies; maintained by comment_threads on every flush
+    reply_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    user = db.relationship('Users')
+    dream = db.relationship('Dream')
+
+class ForumPost(db.Model):
+    __tablename__ = 'forum_post'
+    __table_args__ = (
+        db.Index('ix_forum_post_group_created', 'group_id', 'created_at', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(200), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    group_id = db.Column(db.Integer, db.ForeignKey('dream_group.id', ondelete='CASCADE'), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Maintained by dreamloop.forums on every reply insert/delete
+    reply_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    user = db.relationship('Users')
+    group = db.relationship('DreamGroup')
 
+class ForumReply(db.Model):
+    __tablename__ = 'forum_reply'
+    __table_args__ = (
+        db.Index('ix_forum_reply_post_created', 'post_id', 'created_at', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    content = db.Column(db.Text, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    post_id = db.Column(db.Integer, db.ForeignKey('forum_post.id', ondelete='CASCADE'), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    user = db.relationship('Users')
+
+class AnalysisJob(db.Model):
+    """A queued AI analysis of one dream, run by ``manage.py run_analysis_worker``."""
+    __tablename__ = 'analysis_job'
+    __table_args__ = (
+        # Workers only ever scan jobs that are waiting to run
+        db.Index(
+            'ix_analysis_job_queued', 'run_after', 'id',
+            postgresql_where=db.text("status = 'queued'"),
+            sqlite_where=db.text("status = 'queued'")
+        ),
+        db.Index('ix_analysis_job_dream_created', 'dream_id', 'created_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    dream_id = db.Column(db.Integer, db.ForeignKey('dream.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # queued -> running -> succeeded | failed; failed attempts re-queue until max_attempts
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Set by "Re-analyze": skip the analysis cache and ask the model again
+    bypass_cache = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    dream = db.relationship('Dream')
+
+class AnalysisCacheEntry(db.Model):
+    """A model analysis stored under the hash of everything that produced it."""
+    __tablename__ = 'analysis_cache_entry'
+    __table_args__ = (
+        db.Index('ix_analysis_cache_entry_last_used', 'last_used_at'),
+    )
+    
+    key = db.Column(db.String(64), primary_key=True)
+    model = db.Column(db.String(100), nullable=False)
+    analysis = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class DreamSummary(db.Model):
+    """Compact model summary of one dream, the map step of pattern analysis."""
+    __tablename__ = 'dream_summary'
+    
+    dream_id = db.Column(db.Integer, db.ForeignKey('dream.id', ondelete='CASCADE'), primary_key=True)
+    # Hash of the text and prompt the summary was made from; a mismatch means the dream was edited
+    source_hash = db.Column(db.String(64), nullable=False)
+    summary = db.Column(db.Text, nullable=False)
+    token_estimate = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
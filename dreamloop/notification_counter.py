@@ -0,0 +1,71 @@
+from flask import g, has_request_context
+from sqlalchemy import case, func, select
+from .models import Users, Notification
+from .extensions import db
+from .fragment_cache import mark_stale
+from .notification_events import note_unread_changed
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def get_unread_count(user_id):
+    """Return the user's unread notification count.
+
+    Reads the denormalized ``Users.unread_count`` column and memoizes it on
+    ``flask.g``, so a request that renders the badge and also uses the count
+    in its view only touches the database once.
+    """
+    memo = g.setdefault('_unread_counts', {}) if has_request_context() else {}
+    if user_id not in memo:
+        memo[user_id] = db.session.query(Users.unread_count).filter_by(id=user_id).scalar() or 0
+    return memo[user_id]
+
+
+def _forget(user_ids):
+    if has_request_context() and '_unread_counts' in g:
+        for user_id in user_ids:
+            g._unread_counts.pop(user_id, None)
+
+
+def adjust_unread_count(user_ids, delta):
+    """Add ``delta`` to the counter of each user in ``user_ids``.
+
+    The update is a single arithmetic UPDATE in the caller's transaction, so
+    concurrent writers never overwrite each other's changes. The counter is
+    clamped at zero.
+    """
+    if isinstance(user_ids, int):
+        user_ids = [user_ids]
+    user_ids = list(user_ids)
+    if not user_ids or not delta:
+        return
+
+    new_value = Users.unread_count + delta
+    db.session.query(Users).filter(Users.id.in_(user_ids)).update(
+        {Users.unread_count: case((new_value < 0, 0), else_=new_value)},
+        synchronize_session=False
+    )
+    _forget(user_ids)
+    mark_stale(*(f'notifications:{user_id}' for user_id in user_ids))
+    note_unread_changed(user_ids)
+
+
+def reconcile_unread_counts():
+    """Recompute every counter from the notification table.
+
+    Only rows whose stored value has drifted are written. Returns the number
+    of users that were repaired.
+    """
+    actual = (
+        select(func.count(Notification.id))
+        .where(Notification.user_id == Users.id, Notification.read == False)
+        .scalar_subquery()
+    )
+    repaired = db.session.query(Users).filter(Users.unread_count != actual).update(
+        {Users.unread_count: actual},
+        synchronize_session=False
+    )
+    db.session.commit()
+    logger.info(f"Reconciled unread notification counts for {repaired} users")
+    return repaired
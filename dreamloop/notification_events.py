@@ -0,0 +1,195 @@
+from collections import defaultdict
+import json
+import queue
+import threading
+from flask import current_app, has_app_context
+from sqlalchemy import event, select
+from .models import Users
+from .extensions import db
+import logging
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'notification_events:'
+
+
+class Subscription:
+    """One open event stream's mailbox.
+
+    Publishers never block on a slow reader: once ``maxsize`` events are
+    waiting, further events are dropped and the subscription is flagged as
+    overflowed, telling the stream to resynchronise from the database.
+    """
+
+    def __init__(self, user_id, maxsize):
+        self.user_id = user_id
+        self.overflowed = False
+        self._queue = queue.Queue(maxsize)
+
+    def offer(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        """Next event, or None if nothing arrived within ``timeout`` seconds."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def drain(self):
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                self.overflowed = False
+                return
+
+
+class LocalBroker:
+    """In-process pub/sub; events only reach streams held by this worker."""
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id, maxsize):
+        subscription = Subscription(user_id, maxsize)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscriptions.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[subscription.user_id]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscriptions.values())
+
+    def publish(self, user_id, event):
+        self.deliver(user_id, event)
+
+    def deliver(self, user_id, event):
+        with self._lock:
+            subscribers = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscribers:
+            subscription.offer(event)
+
+
+class RedisBroker(LocalBroker):
+    """Broadcasts events to every worker through Redis pub/sub.
+
+    Each worker runs one listener thread on a pattern subscription and fans
+    incoming events out to its own local streams.
+    """
+
+    def __init__(self, url):
+        import redis
+        super().__init__()
+        self._client = redis.Redis.from_url(url)
+        self._listener = None
+
+    def subscribe(self, user_id, maxsize):
+        self._start_listener()
+        return super().subscribe(user_id, maxsize)
+
+    def publish(self, user_id, event):
+        self._client.publish(f'{CHANNEL_PREFIX}{user_id}', json.dumps(event))
+
+    def _start_listener(self):
+        with self._lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(
+                target=self._listen, name='notification-events', daemon=True
+            )
+            self._listener.start()
+
+    def _listen(self):
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(f'{CHANNEL_PREFIX}*')
+        for message in pubsub.listen():
+            try:
+                channel = message['channel'].decode('utf-8')
+                user_id = int(channel[len(CHANNEL_PREFIX):])
+                self.deliver(user_id, json.loads(message['data']))
+            except (ValueError, KeyError) as e:
+                logger.error(f"Ignoring malformed notification event: {str(e)}")
+
+
+_broker = None
+
+
+def get_broker():
+    """Return the worker's broker: Redis when SHARED_CACHE_URL is set, local otherwise."""
+    global _broker
+    if _broker is None:
+        url = current_app.config.get('SHARED_CACHE_URL')
+        broker = None
+        if url:
+            try:
+                broker = RedisBroker(url)
+            except ImportError:
+                logger.warning("SHARED_CACHE_URL is set but redis is not installed; "
+                               "notification events stay within each worker")
+        _broker = broker or LocalBroker()
+    return _broker
+
+
+def note_unread_changed(user_ids, session=None):
+    """Publish fresh unread counts for ``user_ids`` once the transaction commits."""
+    session = session or db.session
+    session.info.setdefault('unread_changed', set()).update(user_ids)
+
+
+def note_new_notification(user_ids, payload, session=None):
+    """Publish a ``notification`` event to each user once the transaction commits."""
+    session = session or db.session
+    pending = session.info.setdefault('new_notification_events', [])
+    pending.extend((user_id, payload) for user_id in user_ids)
+
+
+@event.listens_for(db.session, 'before_commit')
+def _read_changed_counts(session):
+    # The counter rows are locked by this transaction's own UPDATEs, so the
+    # values read here are exactly what the commit will publish.
+    user_ids = session.info.pop('unread_changed', None)
+    if user_ids:
+        counts = session.execute(
+            select(Users.id, Users.unread_count).where(Users.id.in_(list(user_ids)))
+        ).all()
+        session.info['unread_events'] = dict(counts)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_after_commit(session):
+    counts = session.info.pop('unread_events', None) or {}
+    notifications = session.info.pop('new_notification_events', None) or []
+    if not (counts or notifications) or not has_app_context():
+        return
+    broker = get_broker()
+    try:
+        for user_id, payload in notifications:
+            broker.publish(user_id, {'event': 'notification', 'data': payload})
+        for user_id, count in counts.items():
+            broker.publish(user_id, {'event': 'unread', 'data': {'count': count}})
+    except Exception as e:
+        # Streams resynchronise on reconnect; a lost event must not fail the request
+        logger.error(f"Error publishing notification events: {str(e)}")
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_after_rollback(session):
+    for key in ('unread_changed', 'unread_events', 'new_notification_events'):
+        session.info.pop(key, None)
+
+
+def format_event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data)}\n\n'
@@ -0,0 +1,234 @@
+from datetime import datetime, timedelta
+import time
+from flask import current_app
+from sqlalchemy import delete, func, insert, literal, select, text
+from .models import Notification, NotificationArchive
+from .extensions import db
+from .pagination import keyset_paginate
+import logging
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_TABLE = NotificationArchive.__tablename__
+ARCHIVE_PARTITIONS_AHEAD = 2
+
+
+def inbox_query(user_id, unread_only=True):
+    """The user's notifications, unread only unless ``unread_only`` is False."""
+    query = Notification.query.filter(Notification.user_id == user_id)
+    if unread_only:
+        query = query.filter(Notification.read == False)
+    return query
+
+
+def inbox_page(user_id, cursor=None, unread_only=True, page_size=None):
+    """One keyset page of the user's notifications, newest first.
+
+    The unread view is served from ix_notification_unread and the full view
+    from ix_notification_user_created, so a page costs the same however much
+    history the user has.
+    """
+    page_size = page_size or current_app.config['NOTIFICATION_PAGE_SIZE']
+    return keyset_paginate(
+        inbox_query(user_id, unread_only), Notification.created_at, Notification.id, cursor, page_size
+    )
+
+
+def _is_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def archive_notifications(older_than_days=None, mode=None, batch_size=None, pause=None,
+                          max_batches=None):
+    """Move (or delete) read notifications older than ``older_than_days``.
+
+    Works oldest first in batches of ``batch_size`` rows, committing each
+    batch and sleeping ``pause`` seconds in between so the job never holds
+    long locks or saturates I/O next to live traffic. Only read rows are
+    touched, so the unread counters are unaffected. Returns the number of
+    rows removed from the live table.
+    """
+    config = current_app.config
+    older_than_days = older_than_days if older_than_days is not None else config['NOTIFICATION_RETENTION_DAYS']
+    mode = mode or config['NOTIFICATION_RETENTION_MODE']
+    batch_size = batch_size or config['NOTIFICATION_ARCHIVE_BATCH_SIZE']
+    pause = pause if pause is not None else config['NOTIFICATION_ARCHIVE_PAUSE']
+    if mode not in ('archive', 'delete'):
+        raise ValueError(f"Unknown notification retention mode {mode!r}")
+
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    candidates = select(Notification.id).where(
+        Notification.read == True,
+        Notification.created_at < cutoff
+    ).order_by(Notification.created_at, Notification.id).limit(batch_size)
+    if _is_postgres():
+        # Concurrent runs split the work instead of queueing on each other
+        candidates = candidates.with_for_update(skip_locked=True)
+
+    if mode == 'archive' and _archive_is_partitioned():
+        oldest = db.session.query(func.min(Notification.created_at)).filter(
+            Notification.read == True, Notification.created_at < cutoff
+        ).scalar()
+        if oldest is not None:
+            ensure_archive_partitions(oldest)
+            db.session.commit()
+
+    moved = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        try:
+            ids = db.session.execute(candidates).scalars().all()
+            if not ids:
+                db.session.rollback()
+                break
+            if mode == 'archive':
+                db.session.execute(insert(NotificationArchive).from_select(
+                    ['id', 'created_at', 'user_id', 'message', 'notification_type', 'related_id',
+                     'archived_at'],
+                    select(
+                        Notification.id, Notification.created_at, Notification.user_id,
+                        Notification.message, Notification.notification_type,
+                        Notification.related_id, literal(datetime.utcnow())
+                    ).where(Notification.id.in_(ids))
+                ))
+            db.session.execute(delete(Notification).where(Notification.id.in_(ids)))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error archiving notifications: {str(e)}")
+            raise
+
+        moved += len(ids)
+        batches += 1
+        logger.info(f"Retention job removed {moved} read notifications so far ({mode})")
+        if len(ids) < batch_size:
+            break
+        time.sleep(pause)
+    return moved
+
+
+def purge_notification_archive(older_than_days=None, batch_size=None, pause=None):
+    """Drop archived notifications older than ``older_than_days``.
+
+    A partitioned archive loses whole months with DROP TABLE; otherwise rows
+    are deleted in throttled batches. Returns the number of rows purged, or
+    of partitions dropped on a partitioned archive.
+    """
+    config = current_app.config
+    older_than_days = older_than_days if older_than_days is not None else config['NOTIFICATION_ARCHIVE_DAYS']
+    if not older_than_days:
+        return 0
+    batch_size = batch_size or config['NOTIFICATION_ARCHIVE_BATCH_SIZE']
+    pause = pause if pause is not None else config['NOTIFICATION_ARCHIVE_PAUSE']
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+
+    if _archive_is_partitioned():
+        return drop_expired_archive_partitions(cutoff)
+
+    purged = 0
+    while True:
+        batch = select(NotificationArchive.id, NotificationArchive.created_at).where(
+            NotificationArchive.created_at < cutoff
+        ).limit(batch_size).subquery()
+        deleted = db.session.execute(delete(NotificationArchive).where(
+            NotificationArchive.id.in_(select(batch.c.id)),
+            NotificationArchive.created_at < cutoff
+        )).rowcount
+        db.session.commit()
+        purged += deleted
+        if deleted < batch_size:
+            return purged
+        time.sleep(pause)
+
+
+def _month_start(moment):
+    return datetime(moment.year, moment.month, 1)
+
+
+def _next_month(month):
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _partition_name(month):
+    return f'{ARCHIVE_TABLE}_p{month:%Y%m}'
+
+
+def _archive_is_partitioned():
+    if not _is_postgres():
+        return False
+    return db.session.execute(text(
+        'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table '
+        'WHERE partrelid = to_regclass(:table))'
+    ), {'table': ARCHIVE_TABLE}).scalar()
+
+
+def ensure_archive_partitions(start, months_ahead=ARCHIVE_PARTITIONS_AHEAD):
+    """Create the monthly archive partitions from ``start`` to ``months_ahead`` past now."""
+    month = _month_start(start)
+    last = _month_start(datetime.utcnow())
+    for _ in range(months_ahead):
+        last = _next_month(last)
+    while month <= last:
+        db.session.execute(text(
+            f'CREATE TABLE IF NOT EXISTS {_partition_name(month)} PARTITION OF {ARCHIVE_TABLE} '
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{_next_month(month):%Y-%m-%d}')"
+        ))
+        month = _next_month(month)
+
+
+def drop_expired_archive_partitions(cutoff):
+    """Drop every monthly archive partition that ends before ``cutoff``."""
+    names = db.session.execute(text(
+        'SELECT child.relname FROM pg_inherits '
+        'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+        'WHERE pg_inherits.inhparent = to_regclass(:table)'
+    ), {'table': ARCHIVE_TABLE}).scalars().all()
+
+    dropped = 0
+    for name in names:
+        try:
+            month = datetime.strptime(name.rsplit('_p', 1)[1], '%Y%m')
+        except (IndexError, ValueError):
+            continue  # the default partition
+        if _next_month(month) <= cutoff:
+            db.session.execute(text(f'DROP TABLE IF EXISTS {name}'))
+            dropped += 1
+    db.session.commit()
+    logger.info(f"Dropped {dropped} expired notification archive partitions")
+    return dropped
+
+
+def partition_notification_archive():
+    """Convert notification_archive into a table range partitioned by month.
+
+    Postgres only. Existing archived rows are copied into their partitions
+    and a default partition catches anything outside the prepared range.
+    Returns False if there was nothing to do.
+    """
+    if not _is_postgres():
+        raise RuntimeError("Archive partitioning requires Postgres")
+    if _archive_is_partitioned():
+        return False
+
+    legacy = f'{ARCHIVE_TABLE}_unpartitioned'
+    try:
+        db.session.execute(text(f'ALTER TABLE {ARCHIVE_TABLE} RENAME TO {legacy}'))
+        db.session.execute(text(
+            f'CREATE TABLE {ARCHIVE_TABLE} (LIKE {legacy} INCLUDING DEFAULTS) '
+            'PARTITION BY RANGE (created_at)'
+        ))
+        oldest = db.session.execute(text(f'SELECT min(created_at) FROM {legacy}')).scalar()
+        ensure_archive_partitions(oldest or datetime.utcnow())
+        db.session.execute(text(f'CREATE TABLE {ARCHIVE_TABLE}_default PARTITION OF {ARCHIVE_TABLE} DEFAULT'))
+        db.session.execute(text(f'INSERT INTO {ARCHIVE_TABLE} SELECT * FROM {legacy}'))
+        db.session.execute(text(f'DROP TABLE {legacy}'))
+        db.session.execute(text(f'ALTER TABLE {ARCHIVE_TABLE} ADD PRIMARY KEY (id, created_at)'))
+        db.session.execute(text(
+            f'CREATE INDEX ix_notification_archive_user_created ON {ARCHIVE_TABLE} (user_id, created_at)'
+        ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error partitioning the notification archive: {str(e)}")
+        raise
+    return True
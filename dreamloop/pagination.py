@@ -0,0 +1,85 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 20
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor we did not issue."""
+
+
+def encode_cursor(created_at, row_id):
+    """Encode a (created_at, id) position as an opaque URL-safe token."""
+    payload = json.dumps([created_at.isoformat(), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a token produced by encode_cursor back into (created_at, id)."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError, UnicodeError):
+        raise InvalidCursor(cursor)
+
+
+class KeysetPage:
+    """One page of rows in (created_at, id) order."""
+
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def keyset_query(query, created_col, id_col, cursor=None, page_size=DEFAULT_PAGE_SIZE,
+                 newest_first=True):
+    """``query`` narrowed to the ``page_size + 1`` rows that follow ``cursor``.
+
+    Rows are ordered by ``(created_col, id_col)``, descending unless
+    ``newest_first`` is False, and the seek condition is expressed on those
+    same columns, so every page is an index range scan no matter how deep
+    the client is. ``created_col`` must be NOT NULL: the seek condition
+    never matches a NULL timestamp.
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        if newest_first:
+            query = query.filter(or_(
+                created_col < created_at,
+                and_(created_col == created_at, id_col < row_id)
+            ))
+        else:
+            query = query.filter(or_(
+                created_col > created_at,
+                and_(created_col == created_at, id_col > row_id)
+            ))
+
+    if newest_first:
+        query = query.order_by(created_col.desc(), id_col.desc())
+    else:
+        query = query.order_by(created_col, id_col)
+    return query.limit(page_size + 1)
+
+
+def keyset_paginate(query, created_col, id_col, cursor=None, page_size=DEFAULT_PAGE_SIZE,
+                    newest_first=True):
+    """Return the page of ``query`` that follows ``cursor``, as built by keyset_query."""
+    rows = keyset_query(query, created_col, id_col, cursor, page_size, newest_first).all()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(
+            getattr(last, created_col.key),
+            getattr(last, id_col.key)
+        )
+
+    return KeysetPage(rows, next_cursor)
@@ -0,0 +1,163 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import generate_password_hash, check_password_hash
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+
+
+class PasswordHasherBusy(ServiceUnavailable):
+    """Raised when every hashing slot is taken; Flask answers it with a 503."""
+    description = 'Too many sign-ins are being processed right now. Please try again shortly.'
+
+    def __init__(self):
+        super().__init__(retry_after=1)
+
+
+class PasswordHasher:
+    """Limits how many password hashes a worker process runs at once.
+
+    This is concurrency limiting, not off-thread work: the calling request
+    thread still waits for its hash. scrypt and PBKDF2 release the GIL, so
+    ``workers`` hashes run in parallel on the pool and at most
+    ``queue_depth`` more callers wait for a pool thread. Anything beyond
+    that is refused at once with PasswordHasherBusy, so a login burst costs
+    at most ``workers + queue_depth`` blocked request threads.
+    """
+
+    def __init__(self, method=DEFAULT_METHOD, workers=None, queue_depth=16):
+        self._executor = None
+        self._lock = threading.Lock()
+        self.configure(method, workers or os.cpu_count() or 2, queue_depth)
+
+    def configure(self, method, workers, queue_depth):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+            self.method = method
+            self.workers = workers
+            self.queue_depth = queue_depth
+            self._slots = threading.BoundedSemaphore(workers + queue_depth)
+            self._prefix = None
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix='password-hash'
+                )
+            return self._executor
+
+    def _run(self, fn, *args):
+        # The slot is held, and this thread blocked, until the hash finishes
+        if not self._slots.acquire(blocking=False):
+            logger.warning("Password hashing pool is saturated; refusing request")
+            raise PasswordHasherBusy()
+        try:
+            return self._pool().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    @property
+    def prefix(self):
+        """The ``method$`` prefix hashes made with the current settings start with.
+
+        Werkzeug expands short method names ('scrypt', 'pbkdf2') with its own
+        defaults, so the prefix is taken from a real hash rather than the
+        configured string.
+        """
+        if self._prefix is None:
+            self._prefix = generate_password_hash('', self.method).split('$', 1)[0] + '$'
+        return self._prefix
+
+    def needs_rehash(self, pwhash):
+        return not pwhash.startswith(self.prefix)
+
+
+password_hasher = PasswordHasher()
+
+
+def hash_password(password):
+    return password_hasher.hash(password)
+
+
+def verify_password(user, password):
+    """Check ``password`` against the user's hash, upgrading the hash if its
+    cost parameters are out of date.
+
+    The upgraded hash is only added to the session; it is written with
+    whatever the caller commits next.
+    """
+    if not password_hasher.verify(user.password_hash, password):
+        return False
+    if password_hasher.needs_rehash(user.password_hash):
+        user.password_hash = password_hasher.hash(password)
+        logger.info(f"Upgraded password hash for user {user.id} to {password_hasher.prefix[:-1]}")
+    return True
+
+
+def benchmark_password_hashing(method=None, seconds=5.0, clients=None):
+    """Measure password verifications per second with the configured cost.
+
+    Runs once on a single thread (the per-core rate) and once through the
+    pool with ``clients`` concurrent callers. Refused calls are counted, not
+    retried, so the pool figure shows what a burst of that size would see.
+    """
+    hasher = PasswordHasher(
+        method or password_hasher.method, password_hasher.workers, password_hasher.queue_depth
+    )
+    clients = clients or hasher.workers * 2
+    pwhash = generate_password_hash('benchmark-password', hasher.method)
+
+    started = time.perf_counter()
+    single = 0
+    while time.perf_counter() - started < seconds:
+        check_password_hash(pwhash, 'benchmark-password')
+        single += 1
+    single_rate = single / (time.perf_counter() - started)
+
+    counts = {'ok': 0, 'refused': 0}
+    counts_lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        while time.perf_counter() < deadline:
+            try:
+                hasher.verify(pwhash, 'benchmark-password')
+                outcome = 'ok'
+            except PasswordHasherBusy:
+                outcome = 'refused'
+                time.sleep(0.001)
+            with counts_lock:
+                counts[outcome] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pool_rate = counts['ok'] / (time.perf_counter() - started)
+
+    return {
+        'method': hasher.prefix[:-1],
+        'single_thread_per_sec': round(single_rate, 1),
+        'hash_ms': round(1000 / single_rate, 1) if single_rate else None,
+        'workers': hasher.workers,
+        'clients': clients,
+        'pool_per_sec': round(pool_rate, 1),
+        'per_core_per_sec': round(pool_rate / min(hasher.workers, os.cpu_count() or 1), 1),
+        'refused': counts['refused']
+    }
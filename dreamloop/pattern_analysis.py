@@ -0,0 +1,193 @@
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from .models import Dream, DreamSummary
+from .extensions import db
+from .analysis_cache import analysis_key, get_cached_analysis, normalize_text, store_analysis
+from .ai_helper import _complete, PATTERN_PROMPT
+import logging
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_SYSTEM_PROMPT = "You summarize dream journal entries for later pattern analysis."
+SUMMARY_PROMPT = """Summarize this dream in at most three sentences. Keep the key symbols,
+        people, places, emotions and any recurring motifs; drop everything else.
+
+        Dream: {dream_text}"""
+DIGEST_PROMPT = """These are summaries of consecutive dreams from one journal, oldest first.
+        Condense them into one summary that keeps every recurring symbol, theme and
+        emotion, notes how they change over time, and mentions one-off events only if striking.
+
+        {summaries}"""
+SUMMARY_TEMPERATURE = 0.2
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token) used for budgeting."""
+    return len(text) // 4 + 1
+
+
+def _source_hash(dream):
+    model = current_app.config.get('LLM_MODEL', 'gpt-4')
+    return analysis_key(model, SUMMARY_SYSTEM_PROMPT + SUMMARY_PROMPT, dream.content, SUMMARY_TEMPERATURE)
+
+
+def _store_summaries(rows):
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    statement = dialect.insert(DreamSummary)
+    statement = statement.on_conflict_do_update(
+        index_elements=[DreamSummary.dream_id],
+        set_={
+            'source_hash': statement.excluded.source_hash,
+            'summary': statement.excluded.summary,
+            'token_estimate': statement.excluded.token_estimate,
+            'created_at': statement.excluded.created_at
+        }
+    )
+    with db.engine.begin() as connection:
+        connection.execute(statement, rows)
+
+
+def summarize_dreams(dreams, max_new=None):
+    """Return a summary for each dream, in order, calling the model only for new or edited ones.
+
+    ``dreams`` only need ``id`` and ``content``, so plain rows will do.
+    Summaries are stored in dream_summary as they are made, so an
+    interrupted run keeps the work it has done. Past ``max_new`` model
+    calls, remaining dreams without a current summary get a clipped
+    excerpt of their text instead, which is not stored.
+    """
+    config = current_app.config
+    hashes = {dream.id: _source_hash(dream) for dream in dreams}
+    stored = {}
+    if hashes:
+        # A short-lived connection, so no transaction stays open through the model calls
+        with db.engine.connect() as connection:
+            stored = {
+                row.dream_id: row
+                for row in connection.execute(
+                    select(DreamSummary.dream_id, DreamSummary.source_hash, DreamSummary.summary)
+                    .where(DreamSummary.dream_id.in_(list(hashes)))
+                )
+            }
+
+    summaries = []
+    fresh = []
+    made = 0
+    clipped = 0
+    for dream in dreams:
+        row = stored.get(dream.id)
+        if row is not None and row.source_hash == hashes[dream.id]:
+            summaries.append(row.summary)
+            continue
+        if max_new is not None and made >= max_new:
+            summaries.append(normalize_text(dream.content)[:config['DREAM_SUMMARY_MAX_TOKENS'] * 4])
+            clipped += 1
+            continue
+        summary = _complete(
+            SUMMARY_SYSTEM_PROMPT, SUMMARY_PROMPT.format(dream_text=normalize_text(dream.content)),
+            max_tokens=config['DREAM_SUMMARY_MAX_TOKENS'], temperature=SUMMARY_TEMPERATURE
+        )
+        summaries.append(summary)
+        made += 1
+        fresh.append({
+            'dream_id': dream.id,
+            'source_hash': hashes[dream.id],
+            'summary': summary,
+            'token_estimate': estimate_tokens(summary),
+            'created_at': datetime.utcnow()
+        })
+        if len(fresh) >= 50:
+            _store_summaries(fresh)
+            fresh = []
+    if fresh:
+        _store_summaries(fresh)
+    if made:
+        logger.info(f"Summarized {made} new or edited dreams of {len(dreams)}")
+    if clipped:
+        logger.warning(f"{clipped} dreams left unsummarized; run `manage.py summarize_dreams` to catch up")
+    return summaries
+
+
+def _pack(texts, budget):
+    """Split ``texts`` into consecutive chunks of at most ``budget`` estimated tokens.
+
+    Packing runs oldest first, so dreams added to a journal only change
+    the last chunk and every earlier chunk keeps its cached digest.
+    """
+    chunks = [[]]
+    used = 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if chunks[-1] and used + tokens > budget:
+            chunks.append([])
+            used = 0
+        chunks[-1].append(text)
+        used += tokens
+    return chunks
+
+
+def _digest(chunk):
+    config = current_app.config
+    model = config.get('LLM_MODEL', 'gpt-4')
+    joined = "\n\n".join(chunk)
+    key = analysis_key(model, DIGEST_PROMPT, joined, SUMMARY_TEMPERATURE)
+    digest = get_cached_analysis(key)
+    if digest is None:
+        digest = _complete(
+            SUMMARY_SYSTEM_PROMPT, DIGEST_PROMPT.format(summaries=joined),
+            max_tokens=config['PATTERN_DIGEST_MAX_TOKENS'], temperature=SUMMARY_TEMPERATURE
+        )
+        store_analysis(key, model, digest)
+    return digest
+
+
+def reduce_summaries(summaries, budget):
+    """Combine summaries level by level until they fit in ``budget`` tokens together."""
+    level = list(summaries)
+    while sum(estimate_tokens(text) for text in level) > budget:
+        chunks = _pack(level, budget)
+        if len(chunks) == len(level):
+            # Every item fills a chunk on its own; digesting cannot shrink it further
+            logger.warning("Pattern summaries exceed the token budget; keeping the newest that fit")
+            while len(level) > 1 and sum(estimate_tokens(text) for text in level) > budget:
+                level.pop(0)
+            break
+        level = [_digest(chunk) if len(chunk) > 1 else chunk[0] for chunk in chunks]
+    return level
+
+
+def build_pattern_prompt(dreams):
+    """The final pattern prompt over ``dreams``, however long the journal.
+
+    Each dream is summarized once (map), and the summaries are condensed
+    hierarchically within PATTERN_TOKEN_BUDGET (reduce). Both steps are
+    cached, so a run after new entries only pays for those entries and the
+    digests they fall into. Summaries are made inside the request, so at
+    most PATTERN_MAX_NEW_SUMMARIES are; a large journal imported at once
+    needs `manage.py summarize_dreams` first for a full-quality analysis.
+    """
+    config = current_app.config
+    summaries = summarize_dreams(dreams, max_new=config['PATTERN_MAX_NEW_SUMMARIES'])
+    reduced = reduce_summaries(summaries, config['PATTERN_TOKEN_BUDGET'])
+    label = "Dream" if len(reduced) == len(summaries) else "Dreams, part"
+    combined = "\n\n".join(f"{label} {i+1}: {text}" for i, text in enumerate(reduced))
+    return PATTERN_PROMPT.format(dreams_combined=combined)
+
+
+def summarize_journal_backlog(user_id=None, batch_size=200):
+    """Summarize every dream that has no current summary, for the backfill command."""
+    query = Dream.query.order_by(Dream.id)
+    if user_id is not None:
+        query = query.filter(Dream.user_id == user_id)
+    last_id = 0
+    total = 0
+    while True:
+        batch = query.filter(Dream.id > last_id).limit(batch_size).all()
+        if not batch:
+            return total
+        summarize_dreams(batch)
+        total += len(batch)
+        last_id = batch[-1].id
+        db.session.expunge_all()
@@ -0,0 +1,178 @@
+import json
+import random
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import insert, text
+from sqlalchemy.orm import Query
+from .models import Users, Notification, Dream, DreamGroup, GroupMembership
+from .extensions import db
+from .pagination import encode_cursor, keyset_query
+from .notifications import inbox_query
+from .memberships import membership_exists, members_query
+from .community_feed import FEED_PAGE_SIZE, _public_dreams, window_query
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _dream_journal(params):
+    from .routes import journal_query
+    return keyset_query(
+        journal_query(params['user_id']), Dream.created_at, Dream.id, params['cursor'],
+        current_app.config['DREAMS_PAGE_SIZE']
+    )
+
+
+def _inbox(unread_only):
+    def build(params):
+        return keyset_query(
+            inbox_query(params['user_id'], unread_only), Notification.created_at, Notification.id,
+            params['cursor'], current_app.config['NOTIFICATION_PAGE_SIZE']
+        )
+    return build
+
+
+# The queries behind the busiest pages and the Stripe webhook, as
+# (table that must not be scanned, builder). Each builder returns the
+# statement the app itself runs, built by the same code, so a change to a
+# query changes what is checked here.
+HOT_QUERIES = {
+    'notification_inbox': ('notification', _inbox(unread_only=True)),
+    'notification_history': ('notification', _inbox(unread_only=False)),
+    'dream_journal': ('dream', _dream_journal),
+    'public_dreams': ('dream', lambda params: window_query()),
+    'public_dreams_page': ('dream', lambda params: keyset_query(
+        _public_dreams(), Dream.created_at, Dream.id, params['cursor'], FEED_PAGE_SIZE
+    )),
+    'group_membership': ('group_membership', lambda params: membership_exists(
+        params['user_id'], params['group_id']
+    )),
+    'group_members': ('group_membership', lambda params: keyset_query(
+        members_query(params['group_id']), GroupMembership.joined_at, GroupMembership.id,
+        params['cursor']
+    )),
+    'stripe_customer': ('users', lambda params: Users.by_stripe_customer(params['customer_id']).limit(1)),
+}
+
+
+def generate_dataset(num_users=200, dreams_per_user=50, notifications_per_user=100, num_groups=20):
+    """Insert a synthetic dataset into the current transaction.
+
+    Returns sample parameters for the HOT_QUERIES builders. Nothing is committed.
+    """
+    now = datetime.utcnow()
+    tag = random.randrange(10 ** 9)
+
+    user_ids = db.session.execute(insert(Users).returning(Users.id), [{
+        'email': f'plan-{tag}-{i}@example.com',
+        'username': f'plan-{tag}-{i}',
+        'password_hash': 'x',
+        'unread_count': 0,
+        'stripe_customer_id': f'cus_{tag}_{i}' if i % 10 == 0 else None,
+        'created_at': now
+    } for i in range(num_users)]).scalars().all()
+
+    group_ids = db.session.execute(insert(DreamGroup).returning(DreamGroup.id), [{
+        'name': f'Plan group {i}',
+        'creator_id': random.choice(user_ids),
+        'created_at': now
+    } for i in range(num_groups)]).scalars().all()
+
+    dreams, notifications, memberships = [], [], []
+    for user_id in user_ids:
+        for i in range(dreams_per_user):
+            dreams.append({
+                'user_id': user_id,
+                'title': f'Dream {i}',
+                'content': 'A generated dream.',
+                'is_private': random.random() < 0.5,
+                'created_at': now - timedelta(minutes=random.randrange(525600))
+            })
+        for i in range(notifications_per_user):
+            notifications.append({
+                'user_id': user_id,
+                'message': 'Generated notification',
+                'read': random.random() < 0.9,
+                'created_at': now - timedelta(minutes=random.randrange(525600))
+            })
+        for group_id in random.sample(group_ids, min(3, len(group_ids))):
+            memberships.append({'user_id': user_id, 'group_id': group_id, 'joined_at': now})
+
+    db.session.execute(insert(Dream), dreams)
+    db.session.execute(insert(Notification), notifications)
+    db.session.execute(insert(GroupMembership), memberships)
+
+    return {
+        'user_id': user_ids[0],
+        'group_id': memberships[0]['group_id'],
+        'customer_id': f'cus_{tag}_0',
+        # A cursor in the past, so paged queries carry their seek condition
+        'cursor': encode_cursor(now - timedelta(days=30), 2 ** 31 - 1)
+    }
+
+
+def compile_hot_query(name, params):
+    """Compile a hot query for the database in use, returning (sql, driver parameters)."""
+    _, build = HOT_QUERIES[name]
+    statement = build(params)
+    if isinstance(statement, Query):
+        statement = statement.statement
+    compiled = statement.compile(dialect=db.engine.dialect)
+    bound = compiled.params
+    if compiled.positional:
+        bound = tuple(bound[key] for key in compiled.positiontup)
+    return str(compiled), bound
+
+
+def explain(name, params):
+    """Return the plan of a hot query as a list of text lines."""
+    sql, bound = compile_hot_query(name, params)
+    connection = db.session.connection()
+
+    if db.engine.dialect.name == 'postgresql':
+        plan = connection.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {sql}', bound).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        lines = []
+        nodes = [plan[0]['Plan']]
+        while nodes:
+            node = nodes.pop()
+            lines.append(f"{node['Node Type']} {node.get('Relation Name', '')} {node.get('Index Name', '')}".strip())
+            nodes.extend(node.get('Plans', []))
+        return lines
+
+    rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}', bound).all()
+    return [row[-1] for row in rows]
+
+
+def is_sequential_scan(line, table):
+    """Whether a plan line reads ``table`` without an index."""
+    if line.startswith('Seq Scan'):
+        return line.split()[2:3] == [table]
+    # SQLite: "SCAN dream" is a full scan, "SCAN dream USING INDEX ..." is not
+    return line.startswith(f'SCAN {table}') and 'USING' not in line
+
+
+def check_query_plans(**dataset_options):
+    """EXPLAIN every hot query against a generated dataset.
+
+    The dataset and the planner statistics gathered for it are rolled back
+    afterwards. Returns a dict mapping the name of every query that fell
+    back to a sequential scan to its plan.
+    """
+    failures = {}
+    try:
+        params = generate_dataset(**dataset_options)
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(text('ANALYZE users, dream, notification, group_membership'))
+        else:
+            db.session.execute(text('ANALYZE'))
+
+        for name, (table, _) in HOT_QUERIES.items():
+            plan = explain(name, params)
+            logger.info(f"{name}: {' / '.join(plan)}")
+            if any(is_sequential_scan(line, table) for line in plan):
+                failures[name] = plan
+    finally:
+        db.session.rollback()
+
+    return failures
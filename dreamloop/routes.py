@@ -1,45 +1,393 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, abort, current_app, Response, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
-from .models import Users, Dream, DreamGroup, GroupMembership, Notification
+from .models import Users, Dream, DreamGroup, GroupMembership, Notification, Comment, ForumPost, ForumReply, AnalysisJob
 from .extensions import db
+from .pagination import keyset_paginate, decode_cursor, InvalidCursor
+from .cache import cache_stats
+from .dream_patterns import patterns_for_user
+from .community_feed import feed_page
+from .search import search_dreams
+from .dashboard import dashboard_etag, summary_for_user, iter_dream_series_json, home_summary
+from .notification_counter import get_unread_count, adjust_unread_count
+from .notifications import inbox_page
+from .notification_events import get_broker, note_new_notification, format_event
+from .comment_threads import comment_threads, reply_threads, serialize_thread, delete_comment_thread
+from .memberships import (
+    membership_role, member_ids, member_group_ids, joined_group_count, members_page, add_member, remove_member
+)
+from .forums import discussions_page, replies_page, delete_discussion_thread
+from .fragment_cache import mark_stale
+from .analysis_jobs import active_job, enqueue_analysis, serialize_job
+from .ai_helper import AnalysisError, stream_dream_analysis, stream_pattern_analysis
+from .ai_quota import QuotaExceeded, analysis_quota
+from .markdown_cache import render_markdown
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import joinedload
+from datetime import datetime
 import logging
+import time
 
 bp = Blueprint('main', __name__)
 logger = logging.getLogger('dreamloop')
 
+QUOTA_USED_UP = 'You have used all of your AI analyses for this month.'
+
 @bp.route('/')
 def index():
     if current_user.is_authenticated:
-        unread_count = Notification.query.filter_by(
-            user_id=current_user.id, 
-            read=False
-        ).count()
-        logger.info(f"Unread notifications count for user {current_user.id}: {unread_count}")
-    return render_template('index.html', Dream=Dream)
+        # Only called when the cached home fragment has to be re-rendered
+        user_id = current_user.id
+        return render_template('index.html', load_summary=lambda: home_summary(user_id))
+    return render_template('index.html')
 
 @bp.route('/dashboard')
 @login_required
 def dashboard():
     return render_template('dashboard.html')
 
+def _not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+@bp.route('/api/dreams')
+@login_required
+def api_dreams():
+    """Per-dream chart series for the dashboard, streamed as a JSON array."""
+    etag = dashboard_etag(current_user.id, 'dreams')
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
+
+    response = Response(
+        stream_with_context(iter_dream_series_json(current_user.id)),
+        mimetype='application/json'
+    )
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+@bp.route('/api/summary')
+@login_required
+def api_summary():
+    """Aggregated dashboard cards, computed with GROUP BY in the database."""
+    etag = dashboard_etag(current_user.id, 'summary')
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
+
+    response = jsonify(summary_for_user(current_user.id))
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
 @bp.route('/profile')
 @login_required
 def profile():
     return render_template('profile.html')
 
+def journal_query(user_id):
+    return Dream.query.filter_by(user_id=user_id)
+
+def _dream_journal_page():
+    """Fetch the current user's journal page selected by the ``cursor`` arg."""
+    try:
+        return keyset_paginate(
+            journal_query(current_user.id),
+            Dream.created_at,
+            Dream.id,
+            cursor=request.args.get('cursor'),
+            page_size=current_app.config['DREAMS_PAGE_SIZE']
+        )
+    except InvalidCursor:
+        abort(400)
+
 @bp.route('/dreams')
 @login_required
 def dreams():
-    user_dreams = Dream.query.filter_by(user_id=current_user.id).all()
-    return render_template('dreams.html', dreams=user_dreams)
+    page = _dream_journal_page()
+    return render_template('dreams.html', dreams=page.items, next_cursor=page.next_cursor)
+
+@bp.route('/dreams.json')
+@login_required
+def dreams_json():
+    """JSON variant of the dream journal for infinite scrolling."""
+    page = _dream_journal_page()
+    return jsonify({
+        'dreams': [{
+            'id': dream.id,
+            'title': dream.title,
+            'content': dream.content,
+            'created_at': dream.created_at.isoformat(),
+            'is_private': dream.is_private
+        } for dream in page.items],
+        'next_cursor': page.next_cursor
+    })
+
+@bp.route('/api/cache_stats')
+@login_required
+def api_cache_stats():
+    """Hit/miss counters of this worker's in-process caches."""
+    if not current_app.config['CACHE_STATS_ENABLED']:
+        abort(404)
+    return jsonify(cache_stats())
+
+@bp.route('/dream_patterns')
+@login_required
+def dream_patterns():
+    """Mood, frequency and theme charts built from pre-aggregated counters."""
+    return render_template('dream_patterns.html', patterns=patterns_for_user(current_user.id))
+
+@bp.route('/community')
+def community_dreams():
+    """Latest public dreams, served from the cached community feed."""
+    try:
+        dreams, next_cursor = feed_page(request.args.get('cursor'))
+    except InvalidCursor:
+        abort(400)
+    return render_template('community_dreams.html', dreams=dreams, next_cursor=next_cursor)
+
+@bp.route('/search')
+def search():
+    """Ranked full-text search over dreams visible to the current user."""
+    query = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    viewer_id = current_user.id if current_user.is_authenticated else None
+    results, has_next = search_dreams(query, viewer_id=viewer_id, page=page)
+    return render_template('search.html', query=query, results=results, page=page, has_next=has_next)
+
+def _group_list(user_id, cursor):
+    page = keyset_paginate(
+        DreamGroup.query.options(joinedload(DreamGroup.creator)),
+        DreamGroup.created_at, DreamGroup.id,
+        cursor=cursor
+    )
+    return {
+        'groups': page.items,
+        'next_cursor': page.next_cursor,
+        'member_of': member_group_ids(user_id, [group.id for group in page.items]),
+        'joined_count': joined_group_count(user_id)
+    }
 
 @bp.route('/groups')
 @login_required
-def groups():
-    # Get groups where the user is a member
-    user_groups = current_user.groups
-    return render_template('groups.html', groups=user_groups)
+def dream_groups():
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except InvalidCursor:
+            abort(400)
+    # The listing is only loaded when the cached fragment has to be re-rendered
+    user_id = current_user.id
+    return render_template(
+        'dream_groups.html',
+        cursor=cursor or '',
+        load_group_list=lambda: _group_list(user_id, cursor)
+    )
+
+@bp.route('/groups/<int:group_id>')
+@login_required
+def dream_group(group_id):
+    group = DreamGroup.query.options(joinedload(DreamGroup.creator)).get_or_404(group_id)
+    role = membership_role(current_user.id, group_id)
+    try:
+        members = members_page(group_id, cursor=request.args.get('members_cursor'))
+        discussions = discussions_page(group_id, cursor=request.args.get('discussions_cursor'))
+    except InvalidCursor:
+        abort(400)
+    return render_template(
+        'group_detail.html',
+        group=group,
+        creator=group.creator,
+        members=members.items,
+        members_cursor=members.next_cursor,
+        discussions=discussions.items,
+        discussions_cursor=discussions.next_cursor,
+        is_member=role is not None,
+        is_admin=role == 'admin'
+    )
+
+@bp.route('/groups/<int:group_id>/join', methods=['POST'])
+@login_required
+def join_group(group_id):
+    group = DreamGroup.query.get_or_404(group_id)
+    try:
+        if add_member(current_user.id, group.id):
+            db.session.commit()
+            flash(f'You joined {group.name}')
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error joining group {group_id}: {str(e)}")
+        flash('An error occurred while joining the group')
+    return redirect(url_for('main.dream_group', group_id=group_id))
+
+@bp.route('/groups/<int:group_id>/leave', methods=['POST'])
+@login_required
+def leave_group(group_id):
+    group = DreamGroup.query.get_or_404(group_id)
+    if group.creator_id == current_user.id:
+        flash('The group creator cannot leave the group')
+        return redirect(url_for('main.dream_group', group_id=group_id))
+    try:
+        if remove_member(current_user.id, group.id):
+            db.session.commit()
+            flash(f'You left {group.name}')
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error leaving group {group_id}: {str(e)}")
+        flash('An error occurred while leaving the group')
+    return redirect(url_for('main.dream_groups'))
+
+def _group_discussion(group_id, discussion_id):
+    return ForumPost.query.options(joinedload(ForumPost.user)).filter_by(
+        id=discussion_id, group_id=group_id
+    ).first_or_404()
+
+@bp.route('/groups/<int:group_id>/discussions/new', methods=['GET', 'POST'])
+@login_required
+def create_discussion(group_id):
+    group = DreamGroup.query.get_or_404(group_id)
+    if membership_role(current_user.id, group_id) is None:
+        abort(403)
+
+    if request.method == 'POST':
+        title = request.form.get('title')
+        content = request.form.get('content')
+        if not title or not content:
+            flash('Title and content are required.')
+            return redirect(url_for('main.create_discussion', group_id=group_id))
+
+        post = ForumPost(title=title, content=content, user_id=current_user.id, group_id=group_id)
+        try:
+            db.session.add(post)
+            db.session.flush()
+            create_notifications(
+                member_ids(group_id, exclude=current_user.id),
+                f'New discussion in {group.name}: {title}',
+                notification_type='discussion',
+                related_id=post.id
+            )
+            return redirect(url_for('main.view_discussion', group_id=group_id, discussion_id=post.id))
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error creating discussion in group {group_id}: {str(e)}")
+            flash('An error occurred while creating the discussion.')
+
+    return render_template('create_forum_post.html', group=group)
+
+@bp.route('/groups/<int:group_id>/discussions/<int:discussion_id>')
+@login_required
+def view_discussion(group_id, discussion_id):
+    post = _group_discussion(group_id, discussion_id)
+    try:
+        replies = replies_page(post.id, cursor=request.args.get('cursor'))
+    except InvalidCursor:
+        abort(400)
+    return render_template(
+        'forum_post.html',
+        post=post,
+        replies=replies.items,
+        next_cursor=replies.next_cursor,
+        is_member=membership_role(current_user.id, group_id) is not None
+    )
+
+@bp.route('/groups/<int:group_id>/discussions/<int:discussion_id>/edit', methods=['GET', 'POST'])
+@login_required
+def edit_discussion(group_id, discussion_id):
+    post = _group_discussion(group_id, discussion_id)
+    if post.user_id != current_user.id and membership_role(current_user.id, group_id) != 'admin':
+        abort(403)
+
+    if request.method == 'POST':
+        title = request.form.get('title')
+        content = request.form.get('content')
+        if title and content:
+            post.title = title
+            post.content = content
+            try:
+                db.session.commit()
+                return redirect(url_for('main.view_discussion', group_id=group_id, discussion_id=post.id))
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error updating discussion {discussion_id}: {str(e)}")
+                flash('An error occurred while saving the discussion.')
+        else:
+            flash('Title and content are required.')
+
+    return render_template('create_forum_post.html', group=post.group, post=post)
+
+@bp.route('/groups/<int:group_id>/discussions/<int:discussion_id>/delete', methods=['POST'])
+@login_required
+def delete_discussion(group_id, discussion_id):
+    post = _group_discussion(group_id, discussion_id)
+    if post.user_id != current_user.id and membership_role(current_user.id, group_id) != 'admin':
+        abort(403)
+    try:
+        delete_discussion_thread(post)
+        db.session.commit()
+        flash('Discussion deleted.')
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error deleting discussion {discussion_id}: {str(e)}")
+        flash('An error occurred while deleting the discussion.')
+    return redirect(url_for('main.dream_group', group_id=group_id))
+
+@bp.route('/discussions/<int:post_id>/reply', methods=['POST'])
+@login_required
+def add_forum_reply(post_id):
+    post = ForumPost.query.get_or_404(post_id)
+    if membership_role(current_user.id, post.group_id) is None:
+        abort(403)
+    content = (request.form.get('content') or '').strip()
+    if not content:
+        flash('Reply cannot be empty.')
+        return redirect(url_for('main.view_discussion', group_id=post.group_id, discussion_id=post.id))
+
+    try:
+        db.session.add(ForumReply(content=content, user_id=current_user.id, post_id=post.id))
+        if post.user_id != current_user.id:
+            # Further replies refresh the author's unread notification instead of piling up
+            create_notifications(
+                [post.user_id],
+                f'New replies to your discussion "{post.title}"',
+                notification_type='forum_reply',
+                related_id=post.id,
+                coalesce=True
+            )
+        else:
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error replying to discussion {post_id}: {str(e)}")
+        flash('An error occurred while posting your reply.')
+    return redirect(url_for('main.view_discussion', group_id=post.group_id, discussion_id=post.id))
+
+@bp.route('/groups/<int:group_id>/edit', methods=['GET', 'POST'])
+@login_required
+def edit_group(group_id):
+    group = DreamGroup.query.get_or_404(group_id)
+    if membership_role(current_user.id, group_id) != 'admin':
+        abort(403)
+
+    if request.method == 'POST':
+        name = request.form.get('name')
+        if not name:
+            flash('Group name is required')
+            return redirect(url_for('main.edit_group', group_id=group_id))
+        group.name = name
+        group.description = request.form.get('description')
+        try:
+            db.session.commit()
+            flash('Group updated successfully!')
+            return redirect(url_for('main.dream_group', group_id=group_id))
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error updating group {group_id}: {str(e)}")
+            flash('An error occurred while updating the group')
+
+    return render_template('edit_group.html', group=group)
 
 @bp.route('/create_group', methods=['GET', 'POST'])
 @login_required
@@ -69,7 +417,7 @@ def create_group():
             db.session.add(new_group)
             db.session.commit()
             flash('Group created successfully!')
-            return redirect(url_for('main.groups'))
+            return redirect(url_for('main.dream_group', group_id=new_group.id))
         except Exception as e:
             db.session.rollback()
             flash('An error occurred while creating the group')
@@ -121,6 +469,13 @@ def login():
         user = Users.query.filter_by(email=email).first()
         
         if user and user.check_password(password):
+            if user in db.session.dirty:
+                # check_password upgraded the stored hash
+                try:
+                    db.session.commit()
+                except Exception as e:
+                    logger.error(f"Error saving upgraded password hash: {str(e)}")
+                    db.session.rollback()
             login_user(user)
             next_page = request.args.get('next')
             return redirect(next_page or url_for('main.index'))
@@ -139,39 +494,111 @@ def logout():
 @bp.route('/notifications')
 @login_required
 def notifications():
-    """Show user notifications."""
-    notifications = Notification.query.filter_by(
-        user_id=current_user.id,
-        read=False
-    ).order_by(Notification.created_at.desc()).all()
+    """Show user notifications, unread only unless ?show=all."""
+    show_all = request.args.get('show') == 'all'
+    try:
+        page = inbox_page(current_user.id, cursor=request.args.get('cursor'), unread_only=not show_all)
+    except InvalidCursor:
+        abort(400)
     
     return render_template(
         'notifications.html',
-        notifications=notifications
+        notifications=page.items,
+        next_cursor=page.next_cursor,
+        show_all=show_all
     )
 
+@bp.route('/notifications/stream')
+@login_required
+def notification_stream():
+    """Server-sent unread-count and new-notification events for the badge.
+
+    The count is read once on connect; after that the stream only relays
+    events published by committed transactions, so an idle tab issues no
+    queries. Streams are recycled after SSE_MAX_STREAM_SECONDS and the
+    browser reconnects on its own.
+    """
+    config = current_app.config
+    broker = get_broker()
+    if broker.subscriber_count() >= config['SSE_MAX_CONNECTIONS']:
+        response = Response('Too many open event streams', status=503)
+        response.retry_after = config['SSE_HEARTBEAT_SECONDS']
+        return response
+
+    app = current_app._get_current_object()
+    user_id = current_user.id
+    count = get_unread_count(user_id)
+    db.session.remove()
+
+    def events():
+        # Subscribing here rather than in the view means a HEAD request or a
+        # client gone before the body is read never holds a subscription
+        heartbeat = config['SSE_HEARTBEAT_SECONDS']
+        deadline = time.monotonic() + config['SSE_MAX_STREAM_SECONDS']
+        subscription = broker.subscribe(user_id, config['SSE_QUEUE_SIZE'])
+        try:
+            yield f'retry: {heartbeat * 1000}\n'
+            yield format_event('unread', {'count': count})
+            while time.monotonic() < deadline:
+                event = subscription.get(timeout=heartbeat)
+                if subscription.overflowed:
+                    # The client fell behind; skip the backlog and send the current count
+                    subscription.drain()
+                    with app.app_context():
+                        fresh = db.session.query(Users.unread_count).filter_by(id=user_id).scalar() or 0
+                        db.session.remove()
+                    yield format_event('unread', {'count': fresh})
+                elif event is None:
+                    yield ': heartbeat\n\n'
+                else:
+                    yield format_event(event['event'], event['data'])
+        finally:
+            broker.unsubscribe(subscription)
+
+    return _event_stream_response(events())
+
+def _event_stream_response(events):
+    response = Response(events, mimetype='text/event-stream')
+    response.cache_control.no_cache = True
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @bp.route('/notifications/mark_read/<int:notification_id>', methods=['POST'])
 @login_required
 def mark_notification_read(notification_id):
     """Mark a notification as read."""
+    # Only the request whose UPDATE flips the row decrements the counter
+    marked = db.session.execute(
+        update(Notification)
+        .where(
+            Notification.id == notification_id,
+            Notification.user_id == current_user.id,
+            Notification.read == False
+        )
+        .values(read=True)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if marked:
+        adjust_unread_count(current_user.id, -1)
+        db.session.commit()
+        return jsonify({'success': True})
+
     notification = Notification.query.get_or_404(notification_id)
-    
     if notification.user_id != current_user.id:
         return jsonify({'error': 'Unauthorized'}), 403
-        
-    notification.read = True
-    db.session.commit()
-    
     return jsonify({'success': True})
 
 @bp.route('/notifications/mark_all_read', methods=['POST'])
 @login_required
 def mark_all_notifications_read():
     """Mark all notifications as read."""
-    Notification.query.filter_by(
+    marked = Notification.query.filter_by(
         user_id=current_user.id,
         read=False
-    ).update({'read': True})
+    ).update({'read': True}, synchronize_session=False)
+    # Subtract what was marked rather than zeroing the counter, which would
+    # lose a notification inserted since the UPDATE
+    adjust_unread_count(current_user.id, -marked)
     
     db.session.commit()
     return jsonify({'success': True})
@@ -185,8 +612,310 @@ def create_notification(user_id, message, notification_type=None, related_id=Non
         related_id=related_id
     )
     db.session.add(notification)
+    adjust_unread_count(user_id, 1)
+    db.session.flush()
+    note_new_notification([user_id], _notification_event(notification))
     db.session.commit()
 
+def _notification_event(notification):
+    return {
+        'id': notification.id,
+        'message': notification.message,
+        'notification_type': notification.notification_type,
+        'related_id': notification.related_id,
+        'created_at': notification.created_at.isoformat()
+    }
+
+NOTIFICATION_CHUNK_SIZE = 1000
+
+def create_notifications(user_ids, message, notification_type=None, related_id=None,
+                         coalesce=False, chunk_size=NOTIFICATION_CHUNK_SIZE):
+    """Notify many users at once, e.g. every member of a group.
+
+    Rows are written with one multi-row INSERT per chunk of ``chunk_size``
+    users, all inside a single transaction. With ``coalesce=True`` a user who
+    still has an unread notification of the same type and related_id gets
+    that row refreshed instead of a second one.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    now = datetime.utcnow()
+
+    try:
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[start:start + chunk_size]
+
+            if coalesce:
+                refreshed = db.session.execute(
+                    update(Notification)
+                    .where(
+                        Notification.user_id.in_(chunk),
+                        Notification.notification_type == notification_type,
+                        Notification.related_id == related_id,
+                        Notification.read == False
+                    )
+                    .values(message=message, created_at=now)
+                    .returning(Notification.user_id)
+                ).scalars().all()
+                refreshed = set(refreshed)
+                chunk = [user_id for user_id in chunk if user_id not in refreshed]
+
+            if not chunk:
+                continue
+
+            db.session.execute(insert(Notification).values([{
+                'user_id': user_id,
+                'message': message,
+                'notification_type': notification_type,
+                'related_id': related_id,
+                'read': False,
+                'created_at': now
+            } for user_id in chunk]))
+            adjust_unread_count(chunk, 1)
+            note_new_notification(chunk, {
+                'id': None,
+                'message': message,
+                'notification_type': notification_type,
+                'related_id': related_id,
+                'created_at': now.isoformat()
+            })
+
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error creating notifications: {str(e)}")
+        raise
+
+def _viewable_dream(dream_id):
+    dream = Dream.query.get_or_404(dream_id)
+    if dream.is_private and dream.user_id != current_user.id:
+        abort(404)
+    return dream
+
+@bp.route('/dream/<int:dream_id>')
+@login_required
+def dream_view(dream_id):
+    dream = _viewable_dream(dream_id)
+    try:
+        threads = comment_threads(dream.id, cursor=request.args.get('comments_cursor'))
+    except InvalidCursor:
+        abort(400)
+    return render_template(
+        'dream_view.html',
+        dream=dream,
+        threaded_comments=threads.items,
+        comments_cursor=threads.next_cursor,
+        analysis_job=active_job(dream.id) if dream.user_id == current_user.id else None
+    )
+
+@bp.route('/dream/<int:dream_id>/reanalyze', methods=['POST'])
+@login_required
+def reanalyze_dream(dream_id):
+    """Queue a fresh AI analysis of one of the user's dreams."""
+    dream = Dream.query.get_or_404(dream_id)
+    if dream.user_id != current_user.id:
+        abort(403)
+    if not current_user.can_use_ai_analysis():
+        flash(QUOTA_USED_UP)
+        return redirect(url_for('main.dream_view', dream_id=dream.id))
+    try:
+        enqueue_analysis(dream, current_user.id, bypass_cache=True)
+        db.session.commit()
+        flash('Your dream is being analyzed. The analysis will appear here shortly.')
+    except Exception as e:
+        logger.error(f"Error queueing analysis for dream {dream_id}: {str(e)}")
+        db.session.rollback()
+        flash('An error occurred while queueing the analysis.')
+    return redirect(url_for('main.dream_view', dream_id=dream.id))
+
+def _analysis_refused(user, dream_id=None):
+    """Why ``user`` may not start an analysis now, or None if they may."""
+    if not user.can_use_ai_analysis():
+        return QUOTA_USED_UP
+    if dream_id is not None and active_job(dream_id) is not None:
+        return 'This dream is already being analyzed.'
+    return None
+
+@bp.route('/dream/<int:dream_id>/analysis/stream')
+@login_required
+def dream_analysis_stream(dream_id):
+    """Stream a fresh AI analysis of one of the user's dreams as server-sent events.
+
+    The model's output is relayed as ``token`` events while it is written.
+    The finished text is saved to the dream in one write, followed by a
+    ``done`` event with the rendered HTML. The analysis is charged to the
+    user's quota before the model runs and refunded if it fails or the
+    client disconnects early, in which case the dream is left untouched.
+    ``?refresh=1`` skips the analysis cache, like re-analyzing through the
+    job queue.
+    """
+    dream = Dream.query.get_or_404(dream_id)
+    if dream.user_id != current_user.id:
+        abort(403)
+    refused = _analysis_refused(current_user, dream.id)
+    if refused:
+        return _event_stream_response([format_event('failed', {'message': refused})])
+
+    user_id = current_user.id
+    dream_text = dream.content
+    bypass_cache = request.args.get('refresh') == '1'
+    db.session.remove()  # release the connection while the model writes
+
+    def events():
+        parts = []
+        try:
+            with analysis_quota(user_id):
+                for delta in stream_dream_analysis(dream_text, bypass_cache=bypass_cache):
+                    parts.append(delta)
+                    yield format_event('token', {'text': delta})
+                dream = db.session.get(Dream, dream_id)
+                if dream is None:
+                    raise AnalysisError("Dream no longer exists")
+                dream.ai_analysis = ''.join(parts)
+                db.session.commit()
+            yield format_event('done', {'html': dream.ai_analysis_html})
+        except QuotaExceeded:
+            yield format_event('failed', {'message': QUOTA_USED_UP})
+        except AnalysisError as e:
+            db.session.rollback()
+            logger.error(f"Error streaming analysis of dream {dream_id}: {str(e)}")
+            yield format_event('failed', {'message': 'The analysis could not be completed. Please try again later.'})
+
+    return _event_stream_response(stream_with_context(events()))
+
+@bp.route('/dream_patterns/stream')
+@login_required
+def dream_patterns_stream():
+    """Stream an AI pattern analysis across the user's journal as server-sent events.
+
+    Summarizing new dreams happens before the first token; the analysis
+    itself is relayed as it is written. The quota is charged up front and
+    refunded if the analysis does not finish.
+    """
+    refused = _analysis_refused(current_user)
+    if refused:
+        return _event_stream_response([format_event('failed', {'message': refused})])
+
+    user_id = current_user.id
+    db.session.remove()
+
+    def events():
+        parts = []
+        try:
+            # Plain rows, not ORM objects: nothing is reloaded once the read has ended
+            dreams = db.session.execute(
+                select(Dream.id, Dream.content)
+                .where(Dream.user_id == user_id)
+                .order_by(Dream.created_at, Dream.id)
+            ).all()
+            db.session.commit()  # end the read before the model runs
+            if not dreams:
+                yield format_event('failed', {'message': 'Log a few dreams to see patterns emerge.'})
+                return
+            with analysis_quota(user_id):
+                for delta in stream_pattern_analysis(dreams):
+                    parts.append(delta)
+                    yield format_event('token', {'text': delta})
+            yield format_event('done', {'html': render_markdown(''.join(parts))})
+        except QuotaExceeded:
+            yield format_event('failed', {'message': QUOTA_USED_UP})
+        except AnalysisError as e:
+            db.session.rollback()
+            logger.error(f"Error streaming pattern analysis for user {user_id}: {str(e)}")
+            yield format_event('failed', {'message': 'The analysis could not be completed. Please try again later.'})
+
+    return _event_stream_response(stream_with_context(events()))
+
+@bp.route('/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    """Poll the status of an analysis job."""
+    job = AnalysisJob.query.get_or_404(job_id)
+    if job.user_id != current_user.id:
+        abort(404)
+    return jsonify(serialize_job(job))
+
+@bp.route('/dream/<int:dream_id>/comments/<int:comment_id>/replies')
+@login_required
+def comment_replies(dream_id, comment_id):
+    dream = _viewable_dream(dream_id)
+    Comment.query.filter_by(id=comment_id, dream_id=dream.id).first_or_404()
+    try:
+        replies = reply_threads(comment_id, cursor=request.args.get('cursor'))
+    except InvalidCursor:
+        abort(400)
+    return jsonify({
+        'replies': [serialize_thread(node) for node in replies.items],
+        'next_cursor': replies.next_cursor
+    })
+
+@bp.route('/dream/<int:dream_id>/comment', methods=['POST'])
+@login_required
+def add_comment(dream_id):
+    dream = _viewable_dream(dream_id)
+    content = (request.form.get('content') or '').strip()
+    parent_id = request.form.get('parent_id', type=int)
+    if not content:
+        flash('Comment cannot be empty.')
+        return redirect(url_for('main.dream_view', dream_id=dream.id))
+    if parent_id is not None:
+        Comment.query.filter_by(id=parent_id, dream_id=dream.id).first_or_404()
+
+    comment = Comment(dream_id=dream.id, user_id=current_user.id, parent_id=parent_id, content=content)
+    try:
+        db.session.add(comment)
+        if dream.user_id != current_user.id:
+            create_notification(
+                dream.user_id,
+                f'{current_user.username} commented on your dream "{dream.title}"',
+                notification_type='comment',
+                related_id=dream.id
+            )
+        else:
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error adding comment to dream {dream_id}: {str(e)}")
+        flash('An error occurred while posting your comment.')
+        return redirect(url_for('main.dream_view', dream_id=dream.id))
+    return redirect(url_for('main.dream_view', dream_id=dream.id, _anchor=f'comment-{comment.id}'))
+
+@bp.route('/dream/<int:dream_id>/comments/<int:comment_id>/edit', methods=['POST'])
+@login_required
+def edit_comment(dream_id, comment_id):
+    comment = Comment.query.filter_by(id=comment_id, dream_id=dream_id).first_or_404()
+    if comment.user_id != current_user.id:
+        abort(403)
+    content = (request.form.get('content') or '').strip()
+    if content:
+        comment.content = content
+        comment.edited_at = datetime.utcnow()
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error editing comment {comment_id}: {str(e)}")
+            flash('An error occurred while saving your comment.')
+    return redirect(url_for('main.dream_view', dream_id=dream_id, _anchor=f'comment-{comment_id}'))
+
+@bp.route('/dream/<int:dream_id>/comments/<int:comment_id>/delete', methods=['POST'])
+@login_required
+def delete_comment(dream_id, comment_id):
+    comment = Comment.query.filter_by(id=comment_id, dream_id=dream_id).first_or_404()
+    owner_id = comment.dream.user_id
+    if comment.user_id != current_user.id and owner_id != current_user.id:
+        abort(403)
+    try:
+        delete_comment_thread(comment)
+        # The subtree is deleted in SQL, so the flush hooks never see it
+        mark_stale(f'dreams:{owner_id}')
+        db.session.commit()
+        flash('Comment deleted.')
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error deleting comment {comment_id}: {str(e)}")
+        flash('An error occurred while deleting the comment.')
+    return redirect(url_for('main.dream_view', dream_id=dream_id))
+
 @bp.route('/dream/new', methods=['GET', 'POST'])
 @login_required
 def dream_new():
@@ -195,6 +924,8 @@ def dream_new():
         title = request.form.get('title')
         content = request.form.get('content')
         is_private = request.form.get('is_private', False) == 'true'
+        mood = request.form.get('mood') or None
+        tags = request.form.get('tags') or None
         
         if not title or not content:
             flash('Title and content are required.')
@@ -204,11 +935,16 @@ def dream_new():
             title=title,
             content=content,
             user_id=current_user.id,
-            is_private=is_private
+            is_private=is_private,
+            mood=mood,
+            tags=tags
         )
         
         try:
             db.session.add(new_dream)
+            # Analysed in the background; the job commits with the dream
+            if current_user.can_use_ai_analysis():
+                enqueue_analysis(new_dream, current_user.id)
             db.session.commit()
             flash('Dream created successfully!')
             return redirect(url_for('main.dreams'))
@@ -0,0 +1,126 @@
+from sqlalchemy import text
+from .extensions import db
+from .search import POSTGRES_SEARCH_DDL, SQLITE_SEARCH_DDL
+import logging
+
+logger = logging.getLogger(__name__)
+
+# db.create_all() creates missing tables but never alters existing ones.
+# Columns and indexes added to models after a database was first created are
+# listed here as idempotent Postgres DDL, in the order they were introduced.
+UPGRADES = [
+    ('users.unread_count', [
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS unread_count INTEGER NOT NULL DEFAULT 0',
+    ]),
+    ('users.subscription', [
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS subscription_type VARCHAR(20) DEFAULT 'free'",
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS stripe_customer_id VARCHAR(100)',
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS subscription_start_date TIMESTAMP',
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS subscription_end_date TIMESTAMP',
+    ]),
+    ('hot path indexes', [
+        'CREATE INDEX IF NOT EXISTS ix_users_stripe_customer_id ON users (stripe_customer_id) '
+        'WHERE stripe_customer_id IS NOT NULL',
+        'CREATE INDEX IF NOT EXISTS ix_notification_user_read_created ON notification (user_id, read, created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_notification_unread ON notification (user_id, created_at) '
+        'WHERE read = false',
+        'CREATE INDEX IF NOT EXISTS ix_dream_user_created ON dream (user_id, created_at, id)',
+        'CREATE INDEX IF NOT EXISTS ix_dream_public_created ON dream (created_at, id) '
+        'WHERE is_private = false',
+        'CREATE INDEX IF NOT EXISTS ix_group_membership_user_group ON group_membership (user_id, group_id)',
+        'CREATE INDEX IF NOT EXISTS ix_group_membership_group_joined ON group_membership (group_id, joined_at)',
+    ]),
+    ('dream.dashboard_metrics', [
+        'ALTER TABLE dream ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP',
+        'ALTER TABLE dream ADD COLUMN IF NOT EXISTS mood VARCHAR(50)',
+        'ALTER TABLE dream ADD COLUMN IF NOT EXISTS sentiment_score FLOAT',
+        'ALTER TABLE dream ADD COLUMN IF NOT EXISTS sentiment_magnitude FLOAT',
+        'ALTER TABLE dream ADD COLUMN IF NOT EXISTS dominant_emotions VARCHAR(200)',
+        'ALTER TABLE dream ADD COLUMN IF NOT EXISTS lucidity_level FLOAT',
+        'ALTER TABLE dream ADD COLUMN IF NOT EXISTS sleep_position VARCHAR(50)',
+    ]),
+    ('dream.tags', [
+        'ALTER TABLE dream ADD COLUMN IF NOT EXISTS tags VARCHAR(200)',
+    ]),
+    ('dream full-text search', POSTGRES_SEARCH_DDL),
+    ('dream_group.member_count', [
+        'ALTER TABLE dream_group ADD COLUMN IF NOT EXISTS member_count INTEGER NOT NULL DEFAULT 0',
+        'UPDATE dream_group SET member_count = (SELECT count(*) FROM group_membership '
+        'WHERE group_membership.group_id = dream_group.id)',
+    ]),
+    ('comment threads', [
+        'ALTER TABLE comment ADD COLUMN IF NOT EXISTS reply_count INTEGER NOT NULL DEFAULT 0',
+        'CREATE INDEX IF NOT EXISTS ix_comment_dream_parent_created ON comment (dream_id, parent_id, created_at, id)',
+        'CREATE INDEX IF NOT EXISTS ix_comment_parent_created ON comment (parent_id, created_at, id)',
+        'UPDATE comment SET reply_count = (SELECT count(*) FROM comment c '
+        'WHERE c.parent_id = comment.id)',
+    ]),
+    ('forum counters', [
+        'ALTER TABLE forum_post ADD COLUMN IF NOT EXISTS reply_count INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE dream_group ADD COLUMN IF NOT EXISTS post_count INTEGER NOT NULL DEFAULT 0',
+        'CREATE INDEX IF NOT EXISTS ix_forum_post_group_created ON forum_post (group_id, created_at, id)',
+        'CREATE INDEX IF NOT EXISTS ix_forum_reply_post_created ON forum_reply (post_id, created_at, id)',
+        'UPDATE forum_post SET reply_count = (SELECT count(*) FROM forum_reply '
+        'WHERE forum_reply.post_id = forum_post.id)',
+        'UPDATE dream_group SET post_count = (SELECT count(*) FROM forum_post '
+        'WHERE forum_post.group_id = dream_group.id)',
+    ]),
+    ('dream.ai_analysis_html', [
+        'ALTER TABLE dream ADD COLUMN IF NOT EXISTS ai_analysis TEXT',
+        'ALTER TABLE dream ADD COLUMN IF NOT EXISTS ai_analysis_html TEXT',
+    ]),
+    ('notification retention indexes', [
+        'CREATE INDEX IF NOT EXISTS ix_notification_user_created ON notification (user_id, created_at, id)',
+        'CREATE INDEX IF NOT EXISTS ix_notification_read_created ON notification (created_at, id) '
+        'WHERE read = true',
+    ]),
+    ('users.ai_quota', [
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS monthly_ai_analysis_count INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS last_analysis_reset TIMESTAMP DEFAULT CURRENT_TIMESTAMP',
+    ]),
+    ('analysis_job.bypass_cache', [
+        'ALTER TABLE analysis_job ADD COLUMN IF NOT EXISTS bypass_cache BOOLEAN NOT NULL DEFAULT false',
+    ]),
+    ('group_membership unique user and group', [
+        'DELETE FROM group_membership WHERE id IN (SELECT id FROM (SELECT id, row_number() OVER '
+        '(PARTITION BY user_id, group_id ORDER BY id) AS n FROM group_membership) AS ranked WHERE n > 1)',
+        'UPDATE dream_group SET member_count = (SELECT count(*) FROM group_membership '
+        'WHERE group_membership.group_id = dream_group.id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_group_membership_user_group ON group_membership (user_id, group_id)',
+        'DROP INDEX IF EXISTS ix_group_membership_user_group',
+    ]),
+    # Keyset cursors carry the timestamp, and a NULL one is skipped by the
+    # seek condition; rows created before the default existed sort first
+    ('keyset timestamps not null', [
+        "UPDATE dream SET created_at = TIMESTAMP '1970-01-01' WHERE created_at IS NULL",
+        'ALTER TABLE dream ALTER COLUMN created_at SET NOT NULL',
+        "UPDATE notification SET created_at = TIMESTAMP '1970-01-01' WHERE created_at IS NULL",
+        'ALTER TABLE notification ALTER COLUMN created_at SET NOT NULL',
+        "UPDATE comment SET created_at = TIMESTAMP '1970-01-01' WHERE created_at IS NULL",
+        'ALTER TABLE comment ALTER COLUMN created_at SET NOT NULL',
+        "UPDATE forum_post SET created_at = TIMESTAMP '1970-01-01' WHERE created_at IS NULL",
+        'ALTER TABLE forum_post ALTER COLUMN created_at SET NOT NULL',
+        "UPDATE forum_reply SET created_at = TIMESTAMP '1970-01-01' WHERE created_at IS NULL",
+        'ALTER TABLE forum_reply ALTER COLUMN created_at SET NOT NULL',
+        "UPDATE group_membership SET joined_at = TIMESTAMP '1970-01-01' WHERE joined_at IS NULL",
+        'ALTER TABLE group_membership ALTER COLUMN joined_at SET NOT NULL',
+    ]),
+]
+
+# SQLite databases are only used for local and test runs and are always
+# created fresh by db.create_all(); they only need the pieces the models
+# cannot declare.
+SQLITE_UPGRADES = [
+    ('dream full-text search', SQLITE_SEARCH_DDL),
+]
+
+
+def upgrade_schema():
+    """Create missing tables, then apply every upgrade for the database in use."""
+    db.create_all()
+    upgrades = SQLITE_UPGRADES if db.engine.dialect.name == 'sqlite' else UPGRADES
+    for name, statements in upgrades:
+        logger.info(f"Applying schema upgrade {name}")
+        for statement in statements:
+            db.session.execute(text(statement))
+    db.session.commit()
@@ -0,0 +1,158 @@
+import random
+import statistics
+import time
+from datetime import datetime
+from sqlalchemy import insert, text
+from .models import Dream, Users
+from .extensions import db
+import logging
+
+logger = logging.getLogger(__name__)
+
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE = 50
+
+# Postgres keeps a generated tsvector column on dream, indexed with GIN.
+POSTGRES_SEARCH_DDL = [
+    "ALTER TABLE dream ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(content, '')), 'B')) STORED",
+    'CREATE INDEX IF NOT EXISTS ix_dream_search_vector ON dream USING GIN (search_vector)',
+]
+
+# SQLite (local and test runs) mirrors title/content into an FTS5 shadow table.
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS dream_fts USING fts5("
+    "title, content, content='dream', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS dream_fts_insert AFTER INSERT ON dream BEGIN "
+    "INSERT INTO dream_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS dream_fts_delete AFTER DELETE ON dream BEGIN "
+    "INSERT INTO dream_fts(dream_fts, rowid, title, content) "
+    "VALUES ('delete', old.id, old.title, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS dream_fts_update AFTER UPDATE OF title, content ON dream BEGIN "
+    "INSERT INTO dream_fts(dream_fts, rowid, title, content) "
+    "VALUES ('delete', old.id, old.title, old.content); "
+    "INSERT INTO dream_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+    "INSERT INTO dream_fts(dream_fts) VALUES ('rebuild')",
+]
+
+_POSTGRES_QUERY = text("""
+    SELECT dream.id
+    FROM dream, websearch_to_tsquery('english', :query) AS q
+    WHERE dream.search_vector @@ q
+      AND (dream.is_private = false OR dream.user_id = :viewer_id)
+    ORDER BY ts_rank_cd(dream.search_vector, q) DESC, dream.id DESC
+    LIMIT :limit OFFSET :offset
+""")
+
+_SQLITE_QUERY = text("""
+    SELECT dream.id
+    FROM dream_fts JOIN dream ON dream.id = dream_fts.rowid
+    WHERE dream_fts MATCH :query
+      AND (dream.is_private = 0 OR dream.user_id = :viewer_id)
+    ORDER BY bm25(dream_fts, 10.0, 1.0), dream.id DESC
+    LIMIT :limit OFFSET :offset
+""")
+
+
+def _sqlite_match_expression(query):
+    # Quote every term so user input can never be parsed as FTS5 syntax
+    return ' '.join('"{}"'.format(term.replace('"', '""')) for term in query.split())
+
+
+def search_dreams(query, viewer_id=None, page=1, page_size=SEARCH_PAGE_SIZE):
+    """Full-text search over dream titles and content, best matches first.
+
+    Private dreams are only returned to their author. Returns
+    ``(dreams, has_next)``; each dream has ``author_name`` set from one
+    batched lookup.
+    """
+    query = (query or '').strip()
+    page = max(1, min(page, MAX_SEARCH_PAGE))
+    if not query:
+        return [], False
+
+    if db.engine.dialect.name == 'postgresql':
+        stmt = _POSTGRES_QUERY
+    else:
+        stmt, query = _SQLITE_QUERY, _sqlite_match_expression(query)
+
+    ids = db.session.execute(stmt, {
+        'query': query,
+        'viewer_id': viewer_id or 0,
+        'limit': page_size + 1,
+        'offset': (page - 1) * page_size
+    }).scalars().all()
+
+    has_next = len(ids) > page_size and page < MAX_SEARCH_PAGE
+    ids = ids[:page_size]
+    if not ids:
+        return [], False
+
+    dreams = {dream.id: dream for dream in Dream.query.filter(Dream.id.in_(ids)).all()}
+    authors = dict(
+        db.session.query(Users.id, Users.username)
+        .filter(Users.id.in_({dream.user_id for dream in dreams.values()}))
+        .all()
+    )
+    results = []
+    for dream_id in ids:
+        dream = dreams[dream_id]
+        dream.author_name = authors.get(dream.user_id)
+        results.append(dream)
+    return results, has_next
+
+
+BENCHMARK_WORDS = (
+    'flying falling water ocean forest house school teeth chase door stairs '
+    'mirror mother father dog cat snake spider train car bridge city night '
+    'light dark storm fire garden mountain river exam wedding baby ghost '
+    'stranger friend lost late naked voice bell key window moon sun star'
+).split()
+
+
+def benchmark_search(rows=1_000_000, queries=200, batch_size=10_000):
+    """Time search_dreams against ``rows`` generated dreams.
+
+    Everything is inserted in one transaction and rolled back afterwards.
+    Returns latency percentiles in milliseconds.
+    """
+    try:
+        user_id = db.session.execute(insert(Users).returning(Users.id), [{
+            'email': 'search-benchmark@example.com',
+            'username': 'search-benchmark',
+            'password_hash': 'x',
+            'unread_count': 0
+        }]).scalar_one()
+
+        now = datetime.utcnow()
+        for start in range(0, rows, batch_size):
+            db.session.execute(insert(Dream), [{
+                'user_id': user_id,
+                'title': ' '.join(random.choices(BENCHMARK_WORDS, k=3)),
+                'content': ' '.join(random.choices(BENCHMARK_WORDS, k=60)),
+                'is_private': random.random() < 0.3,
+                'created_at': now
+            } for _ in range(min(batch_size, rows - start))])
+            logger.info(f"Inserted {min(start + batch_size, rows)} of {rows} benchmark dreams")
+
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(text('ANALYZE dream'))
+
+        timings = []
+        for _ in range(queries):
+            query = ' '.join(random.sample(BENCHMARK_WORDS, random.randint(1, 2)))
+            started = time.perf_counter()
+            search_dreams(query, viewer_id=user_id, page=random.randint(1, 5))
+            timings.append((time.perf_counter() - started) * 1000)
+    finally:
+        db.session.rollback()
+
+    timings.sort()
+    return {
+        'rows': rows,
+        'queries': queries,
+        'p50_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(timings[int(len(timings) * 0.95) - 1], 2),
+        'max_ms': round(timings[-1], 2)
+    }
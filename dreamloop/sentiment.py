@@ -0,0 +1,314 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import random
+import re
+import time
+import numpy as np
+from sqlalchemy import bindparam, event, inspect, select
+from .models import Dream
+from .extensions import db
+from .dream_patterns import bump_dashboard_version
+import logging
+
+logger = logging.getLogger(__name__)
+
+EMOTIONS = ('joy', 'love', 'calm', 'surprise', 'fear', 'sadness', 'anger', 'confusion')
+
+# Word lists per emotion; every word also carries the emotion's valence
+# unless VALENCE overrides it. Inflected forms are listed explicitly.
+EMOTION_WORDS = {
+    'joy': 'happy happiness happily joy joyful glad delighted delight excited excitement thrilled '
+           'laugh laughed laughing laughter fun smile smiled smiling cheerful elated euphoric '
+           'celebrate celebrated celebrating amazing wonderful beautiful bliss blissful',
+    'love': 'love loved loving lover hug hugged hugging kiss kissed kissing embrace embraced '
+            'affection tender warmth caring cared adore adored romantic',
+    'calm': 'calm calmly peace peaceful peacefully serene quiet gentle gently relaxed relaxing '
+            'safe safety comfort comfortable comforted floating floated soothing still tranquil',
+    'surprise': 'surprise surprised surprising sudden suddenly unexpected unexpectedly shocked '
+                'astonished amazed strange stranger weird bizarre',
+    'fear': 'afraid fear feared fearful scared scary terrified terror terrifying panic panicked '
+            'anxious anxiety dread nervous frightened frightening horror horrifying nightmare '
+            'chased chasing monster monsters threat danger dangerous trapped hiding hid',
+    'sadness': 'sad sadness cry cried crying tears grief grieving lonely alone lost loss '
+               'miss missed missing hurt mourning funeral died dead death empty regret '
+               'hopeless heartbroken',
+    'anger': 'angry anger mad furious rage raged yelled yelling shouted shouting screamed '
+             'fight fought fighting hate hated annoyed frustrated frustration argue argued '
+             'arguing betrayed',
+    'confusion': 'confused confusing confusion lost maze unsure uncertain disoriented puzzled '
+                 'unfamiliar wandering wandered stuck',
+}
+
+EMOTION_VALENCE = {
+    'joy': 2.0, 'love': 2.5, 'calm': 1.5, 'surprise': 0.5,
+    'fear': -2.0, 'sadness': -2.0, 'anger': -2.0, 'confusion': -1.0,
+}
+
+# Valence of words that carry no emotion of their own, and overrides
+VALENCE = {
+    'good': 1.5, 'great': 2.0, 'nice': 1.5, 'best': 2.0, 'better': 1.0, 'free': 1.5, 'freedom': 2.0,
+    'flying': 1.0, 'flew': 1.0, 'fly': 1.0, 'bright': 1.0, 'light': 0.5, 'friend': 1.5,
+    'friends': 1.5, 'welcome': 1.5, 'win': 2.0, 'won': 2.0, 'success': 2.0,
+    'bad': -1.5, 'worse': -1.5, 'worst': -2.0, 'terrible': -2.5, 'awful': -2.5, 'horrible': -2.5,
+    'dark': -1.0, 'darkness': -1.0, 'fall': -1.0, 'falling': -1.0, 'fell': -1.0,
+    'drowning': -2.0, 'drowned': -2.0, 'blood': -2.0, 'pain': -2.0, 'sick': -1.5, 'cold': -0.5,
+    'late': -1.0, 'fail': -2.0, 'failed': -2.0, 'naked': -1.0, 'teeth': -0.5,
+    'strange': -0.5, 'weird': -0.5, 'bizarre': -0.5, 'sudden': 0.0, 'suddenly': 0.0,
+    'alone': -1.5, 'lost': -1.5, 'still': 0.5, 'hiding': -1.5, 'hid': -1.0,
+}
+
+# Signs of lucid dreaming: knowing one is dreaming, and steering the dream
+LUCIDITY = {
+    'lucid': 1.2, 'lucidity': 1.2, 'realized': 0.5, 'realised': 0.5, 'realize': 0.5,
+    'realise': 0.5, 'aware': 0.5, 'awareness': 0.5, 'conscious': 0.4, 'consciously': 0.4,
+    'control': 0.4, 'controlled': 0.4, 'controlling': 0.4, 'dreaming': 0.3, 'reality': 0.3,
+    'decided': 0.2, 'chose': 0.2, 'summoned': 0.4, 'willed': 0.4,
+}
+
+NEGATORS = ('not', 'no', 'never', 'without', 'nothing', 'nobody', "didn't", "wasn't",
+            "don't", "couldn't", "wouldn't", "isn't", "weren't", 'neither', 'nor')
+INTENSIFIERS = ('very', 'really', 'so', 'extremely', 'incredibly', 'totally', 'completely',
+                'deeply', 'utterly', 'super')
+
+NEGATION_FACTOR = -0.74  # a negated word flips and weakens, as in VADER
+INTENSITY_FACTOR = 1.5
+SCORE_ALPHA = 15.0       # score = s / sqrt(s^2 + alpha) keeps it within (-1, 1)
+MAGNITUDE_HALF = 4.0     # summed |valence| at which magnitude reaches 0.5
+MAX_EMOTIONS = 3
+
+_TOKEN = re.compile(r"[a-z]+(?:'[a-z]+)?")
+
+
+class LexiconScorer:
+    """Scores dream texts in batches with a word lexicon.
+
+    Tokenizing is the only per-word Python work; the lookups' weights are
+    gathered, negated, intensified and summed per dream with NumPy over the
+    whole batch at once.
+    """
+
+    def __init__(self):
+        vocabulary = set(VALENCE) | set(LUCIDITY)
+        for words in EMOTION_WORDS.values():
+            vocabulary.update(words.split())
+        words = sorted(vocabulary)
+        self.index = {word: i for i, word in enumerate(words)}
+
+        self.valence = np.zeros(len(words))
+        self.emotions = np.zeros((len(words), len(EMOTIONS)))
+        self.lucidity = np.zeros(len(words))
+        for e, emotion in enumerate(EMOTIONS):
+            for word in EMOTION_WORDS[emotion].split():
+                self.emotions[self.index[word], e] = 1.0
+                self.valence[self.index[word]] = EMOTION_VALENCE[emotion]
+        for word, value in VALENCE.items():
+            self.valence[self.index[word]] = value
+        for word, value in LUCIDITY.items():
+            self.lucidity[self.index[word]] = value
+
+        # Modifiers get ids past the vocabulary so they never pick up weights
+        self.negator_id = len(words)
+        self.intensifier_id = len(words) + 1
+        self.index.update({word: self.negator_id for word in NEGATORS})
+        self.index.update({word: self.intensifier_id for word in INTENSIFIERS})
+
+    def _token_ids(self, texts):
+        """Word ids of every token in the batch, with the dream each belongs to."""
+        get = self.index.get
+        ids = []
+        lengths = np.empty(len(texts), dtype=np.int64)
+        for i, text in enumerate(texts):
+            tokens = _TOKEN.findall(text.lower().replace('\u2019', "'")) if text else []
+            lengths[i] = len(tokens)
+            ids.extend([get(token, -1) for token in tokens])
+        ids = np.array(ids, dtype=np.int64)
+        docs = np.repeat(np.arange(len(texts)), lengths)
+        return ids, docs
+
+    def score(self, texts):
+        """Score a batch of texts.
+
+        Returns (score, magnitude, lucidity, emotions): sentiment in (-1, 1),
+        emotional intensity and lucidity in [0, 1), and up to MAX_EMOTIONS
+        comma-separated dominant emotions per text (None when none is found).
+        """
+        n = len(texts)
+        ids, docs = self._token_ids(texts)
+
+        # Modifiers apply to the next two words of the same dream
+        def preceded_by(modifier_id):
+            mark = ids == modifier_id
+            hit = np.zeros(len(ids), dtype=bool)
+            for gap in (1, 2):
+                hit[gap:] |= mark[:-gap] & (docs[gap:] == docs[:-gap])
+            return hit
+
+        negated = preceded_by(self.negator_id)
+        intensified = preceded_by(self.intensifier_id)
+
+        matched = (ids >= 0) & (ids < self.negator_id)
+        word = ids[matched]
+        doc = docs[matched]
+        factor = np.where(negated[matched], NEGATION_FACTOR, 1.0)
+        factor *= np.where(intensified[matched], INTENSITY_FACTOR, 1.0)
+
+        valence = self.valence[word] * factor
+        total = np.bincount(doc, weights=valence, minlength=n)
+        strength = np.bincount(doc, weights=np.abs(valence), minlength=n)
+        score = total / np.sqrt(total * total + SCORE_ALPHA)
+        magnitude = strength / (strength + MAGNITUDE_HALF)
+
+        lucid = np.bincount(doc, weights=self.lucidity[word] * (factor > 0), minlength=n)
+        lucidity = 1.0 - np.exp(-lucid)
+
+        # A negated emotion word ("not afraid") does not count towards it
+        counted = factor > 0
+        emotion_counts = np.zeros((n, len(EMOTIONS)))
+        for e in range(len(EMOTIONS)):
+            emotion_counts[:, e] = np.bincount(
+                doc, weights=self.emotions[word, e] * counted, minlength=n
+            )
+        # Ties go to the emotion listed first in EMOTIONS
+        order = np.argsort(-emotion_counts, axis=1, kind='stable')[:, :MAX_EMOTIONS]
+        present = np.take_along_axis(emotion_counts, order, axis=1) > 0
+        emotions = [
+            ','.join(EMOTIONS[e] for e, keep in zip(row, keeps) if keep) or None
+            for row, keeps in zip(order.tolist(), present.tolist())
+        ]
+        return score, magnitude, lucidity, emotions
+
+
+scorer = LexiconScorer()
+
+
+def _apply_scores(dreams):
+    score, magnitude, lucidity, emotions = scorer.score([dream.content for dream in dreams])
+    for i, dream in enumerate(dreams):
+        dream.sentiment_score = round(float(score[i]), 4)
+        dream.sentiment_magnitude = round(float(magnitude[i]), 4)
+        dream.lucidity_level = round(float(lucidity[i]), 4)
+        dream.dominant_emotions = emotions[i]
+
+
+@event.listens_for(db.session, 'before_flush')
+def _score_changed_dreams(session, flush_context, instances):
+    """Score new and edited dreams together, in one batch per flush."""
+    changed = [
+        dream for dream in list(session.new) + list(session.dirty)
+        if isinstance(dream, Dream) and inspect(dream).attrs.content.history.has_changes()
+    ]
+    if changed:
+        _apply_scores(changed)
+
+
+def score_dreams(batch_size=2000, rescore=False):
+    """Score dreams that have no sentiment yet, or every dream with ``rescore``.
+
+    Walks the dream table in id order, committing each batch, so it can run
+    against a live database and be resumed. ``updated_at`` is left alone:
+    the scores are derived data, not an edit of the dream. The rows are
+    written outside the ORM, so each batch bumps its users' dashboard
+    version itself.
+    """
+    table = Dream.__table__
+    stmt = table.update().where(table.c.id == bindparam('dream_id')).values(
+        sentiment_score=bindparam('score'),
+        sentiment_magnitude=bindparam('magnitude'),
+        lucidity_level=bindparam('lucidity'),
+        dominant_emotions=bindparam('emotions'),
+        updated_at=table.c.updated_at
+    )
+    last_id = 0
+    total = 0
+    started = time.perf_counter()
+    while True:
+        query = select(Dream.id, Dream.content, Dream.user_id).where(Dream.id > last_id)
+        if not rescore:
+            query = query.where(Dream.sentiment_score.is_(None))
+        rows = db.session.execute(query.order_by(Dream.id).limit(batch_size)).all()
+        if not rows:
+            break
+
+        score, magnitude, lucidity, emotions = scorer.score([row.content for row in rows])
+        db.session.execute(stmt, [
+            {
+                'dream_id': row.id,
+                'score': round(float(score[i]), 4),
+                'magnitude': round(float(magnitude[i]), 4),
+                'lucidity': round(float(lucidity[i]), 4),
+                'emotions': emotions[i]
+            }
+            for i, row in enumerate(rows)
+        ])
+        bump_dashboard_version(db.session.connection(), [row.user_id for row in rows])
+        db.session.commit()
+
+        last_id = rows[-1].id
+        total += len(rows)
+        logger.info(f"Scored {total} dreams (last id {last_id}, "
+                    f"{total / (time.perf_counter() - started):.0f} dreams/s)")
+    return total
+
+
+def synthetic_dreams(count, words=120, seed=0):
+    """Dream-like texts mixing lexicon words, modifiers and filler, for benchmarks."""
+    rng = random.Random(seed)
+    lexicon = sorted(set(VALENCE) | set(LUCIDITY) | {
+        word for listed in EMOTION_WORDS.values() for word in listed.split()
+    })
+    filler = ('i was in a house with my mother and the door opened onto a long street '
+              'where people walked past the old school towards the sea and then').split()
+    modifiers = NEGATORS[:4] + INTENSIFIERS[:4]
+    texts = []
+    for _ in range(count):
+        tokens = []
+        for _ in range(words):
+            roll = rng.random()
+            if roll < 0.12:
+                tokens.append(rng.choice(lexicon))
+            elif roll < 0.16:
+                tokens.append(rng.choice(modifiers))
+            else:
+                tokens.append(rng.choice(filler))
+        texts.append(' '.join(tokens).capitalize() + '.')
+    return texts
+
+
+def _timed_score(texts, batch_size):
+    started = time.perf_counter()
+    for start in range(0, len(texts), batch_size):
+        scorer.score(texts[start:start + batch_size])
+    return time.perf_counter() - started
+
+
+def benchmark_sentiment(count=20000, batch_size=2000, words=120, processes=1):
+    """Measure scoring throughput on synthetic dreams of ``words`` words.
+
+    Runs in this process (the per-core rate) and, with ``processes`` > 1,
+    across that many worker processes scoring their own share at once.
+    Database access is not included.
+    """
+    texts = synthetic_dreams(count, words)
+    scorer.score(texts[:batch_size])  # warm up
+    elapsed = _timed_score(texts, batch_size)
+    result = {
+        'dreams': count,
+        'words_per_dream': words,
+        'batch_size': batch_size,
+        'numpy': np.__version__,
+        'single_core_per_sec': round(count / elapsed, 1),
+        'us_per_dream': round(elapsed / count * 1e6, 2)
+    }
+    if processes > 1:
+        share = [texts[i::processes] for i in range(processes)]
+        started = time.perf_counter()
+        with ProcessPoolExecutor(processes) as pool:
+            list(pool.map(_timed_score, share, [batch_size] * processes))
+        elapsed = time.perf_counter() - started
+        cores = min(processes, os.cpu_count() or 1)
+        result.update({
+            'processes': processes,
+            'pool_per_sec': round(count / elapsed, 1),
+            'per_core_per_sec': round(count / elapsed / cores, 1)
+        })
+    return result
@@ -4,6 +4,7 @@ from datetime import datetime
 import logging
 from .models import Users
 from .extensions import db
+from .fragment_cache import mark_stale
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -64,6 +65,7 @@ def handle_successful_payment(session):
         user.stripe_customer_id = session.customer
         user.subscription_start_date = datetime.utcnow()
         
+        mark_stale(f'quota:{user.id}')  # the home page's analyses card
         db.session.commit()
         logger.info(f"Successfully updated subscription for user {user.id}")
 
@@ -75,7 +77,7 @@ def handle_subscription_cancelled(subscription):
     """Handle subscription cancellation."""
     try:
         # Find user by Stripe customer ID
-        user = Users.query.filter_by(stripe_customer_id=subscription.customer).first()
+        user = Users.by_stripe_customer(subscription.customer).first()
         
         if not user:
             logger.error(f"User not found for Stripe customer: {subscription.customer}")
@@ -85,6 +87,7 @@ def handle_subscription_cancelled(subscription):
         user.subscription_type = 'free'
         user.subscription_end_date = datetime.utcnow()
         
+        mark_stale(f'quota:{user.id}')  # the home page's analyses card
         db.session.commit()
         logger.info(f"Successfully cancelled subscription for user {user.id}")
 
@@ -96,7 +99,7 @@ def handle_subscription_updated(subscription):
     """Handle subscription updates."""
     try:
         # Find user by Stripe customer ID
-        user = Users.query.filter_by(stripe_customer_id=subscription.customer).first()
+        user = Users.by_stripe_customer(subscription.customer).first()
         
         if not user:
             logger.error(f"User not found for Stripe customer: {subscription.customer}")
@@ -108,6 +111,7 @@ def handle_subscription_updated(subscription):
         else:
             user.subscription_type = 'free'
         
+        mark_stale(f'quota:{user.id}')  # the home page's analyses card
         db.session.commit()
         logger.info(f"Successfully updated subscription status for user {user.id}")
 
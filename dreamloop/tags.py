@@ -0,0 +1,132 @@
+from collections import defaultdict
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.dialects import postgresql, sqlite
+from .models import Dream, Tag, DreamTag
+from .extensions import db
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_TAG_LENGTH = 50
+
+
+def parse_tags(tags):
+    """Split a comma-separated tag string into normalized, de-duplicated tags."""
+    if not tags:
+        return []
+    return list(dict.fromkeys(
+        t.strip().lower()[:MAX_TAG_LENGTH] for t in tags.split(',') if t.strip()
+    ))
+
+
+def _dialect_insert(connection, table):
+    dialect = postgresql if connection.dialect.name == 'postgresql' else sqlite
+    return dialect.insert(table)
+
+
+def _tag_ids(connection, names):
+    """Return {name: id} for ``names``, creating the missing tags."""
+    if not names:
+        return {}
+    connection.execute(
+        _dialect_insert(connection, Tag.__table__).on_conflict_do_nothing(index_elements=['name']),
+        [{'name': name} for name in names]
+    )
+    return dict(connection.execute(
+        select(Tag.name, Tag.id).where(Tag.name.in_(names))
+    ).all())
+
+
+def _write_dream_tags(connection, tags_by_dream):
+    """Replace the DreamTag rows of every dream in ``tags_by_dream``."""
+    if not tags_by_dream:
+        return
+    connection.execute(
+        DreamTag.__table__.delete().where(DreamTag.dream_id.in_(list(tags_by_dream)))
+    )
+    ids = _tag_ids(connection, sorted({name for names in tags_by_dream.values() for name in names}))
+    rows = [
+        {'dream_id': dream_id, 'tag_id': ids[name]}
+        for dream_id, names in tags_by_dream.items()
+        for name in names
+    ]
+    if rows:
+        connection.execute(DreamTag.__table__.insert(), rows)
+
+
+@event.listens_for(db.session, 'before_flush')
+def _drop_deleted_dream_tags(session, flush_context, instances):
+    deleted = [dream.id for dream in session.deleted if isinstance(dream, Dream)]
+    if deleted:
+        session.connection().execute(
+            DreamTag.__table__.delete().where(DreamTag.dream_id.in_(deleted))
+        )
+
+
+@event.listens_for(db.session, 'after_flush')
+def _sync_dream_tags(session, flush_context):
+    """Keep dream_tag in step with Dream.tags within the same transaction."""
+    changed = {}
+    for dream in session.new:
+        if isinstance(dream, Dream):
+            changed[dream.id] = parse_tags(dream.tags)
+    for dream in session.dirty:
+        if isinstance(dream, Dream) and inspect(dream).attrs.tags.history.has_changes():
+            changed[dream.id] = parse_tags(dream.tags)
+    _write_dream_tags(session.connection(), changed)
+
+
+def tags_for_dreams(dream_ids):
+    """Return {dream_id: [tag names]} for a page of dreams in one query."""
+    tags = defaultdict(list)
+    if not dream_ids:
+        return tags
+    rows = db.session.query(DreamTag.dream_id, Tag.name).join(
+        Tag, Tag.id == DreamTag.tag_id
+    ).filter(DreamTag.dream_id.in_(list(dream_ids))).order_by(Tag.name).all()
+    for dream_id, name in rows:
+        tags[dream_id].append(name)
+    return tags
+
+
+def dreams_tagged(name):
+    """Query for all dreams carrying tag ``name``, via the tag -> dream index."""
+    return Dream.query.join(DreamTag, DreamTag.dream_id == Dream.id).join(
+        Tag, Tag.id == DreamTag.tag_id
+    ).filter(Tag.name == name.strip().lower())
+
+
+def tag_counts(limit=20):
+    """The most used tags with their dream counts."""
+    return db.session.query(Tag.name, func.count(DreamTag.dream_id).label('count')).join(
+        DreamTag, DreamTag.tag_id == Tag.id
+    ).group_by(Tag.id, Tag.name).order_by(func.count(DreamTag.dream_id).desc()).limit(limit).all()
+
+
+def backfill_dream_tags(batch_size=1000):
+    """Populate tag/dream_tag from the legacy comma-joined Dream.tags strings.
+
+    Works through the dream table in id order, one committed batch at a
+    time, so it can run against a live database and be resumed.
+    """
+    last_id = 0
+    total = 0
+    while True:
+        rows = db.session.execute(
+            select(Dream.id, Dream.tags)
+            .where(Dream.id > last_id)
+            .order_by(Dream.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        _write_dream_tags(db.session.connection(), {
+            dream_id: parse_tags(tags) for dream_id, tags in rows
+        })
+        db.session.commit()
+
+        last_id = rows[-1][0]
+        total += len(rows)
+        logger.info(f"Backfilled tags for {total} dreams (last id {last_id})")
+    return total
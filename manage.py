@@ -83,5 +83,244 @@ def apply_migrations():
         upgrade()
     click.echo("Applied all migrations")
 
+@cli.command("upgrade_schema")
+def upgrade_schema_command():
+    """Add tables, columns and indexes introduced since the database was created."""
+    from dreamloop.schema import upgrade_schema
+    with app.app_context():
+        upgrade_schema()
+    click.echo("Schema upgraded. Run reconcile_unread_counts if unread_count was just added.")
+
+@cli.command("reconcile_unread_counts")
+def reconcile_unread_counts_command():
+    """Repair drift in the denormalized unread notification counters."""
+    from dreamloop.notification_counter import reconcile_unread_counts
+    with app.app_context():
+        repaired = reconcile_unread_counts()
+    click.echo(f"Repaired unread counts for {repaired} users")
+
+@cli.command("reconcile_member_counts")
+def reconcile_member_counts_command():
+    """Repair drift in the denormalized group member counts."""
+    from dreamloop.memberships import reconcile_member_counts
+    with app.app_context():
+        repaired = reconcile_member_counts()
+    click.echo(f"Repaired member counts for {repaired} groups")
+
+@cli.command("reconcile_forum_counts")
+def reconcile_forum_counts_command():
+    """Repair drift in the denormalized discussion and reply counts."""
+    from dreamloop.forums import reconcile_forum_counts
+    with app.app_context():
+        repaired = reconcile_forum_counts()
+    click.echo(f"Repaired forum counts for {repaired} posts and groups")
+
+@cli.command("archive_notifications")
+@click.option('--older-than-days', type=int, default=None, help='Defaults to NOTIFICATION_RETENTION_DAYS')
+@click.option('--mode', type=click.Choice(['archive', 'delete']), default=None,
+              help='Defaults to NOTIFICATION_RETENTION_MODE')
+@click.option('--batch-size', type=int, default=None, help='Rows per committed batch')
+@click.option('--pause', type=float, default=None, help='Seconds to sleep between batches')
+@click.option('--max-batches', type=int, default=None, help='Stop after this many batches')
+def archive_notifications_command(older_than_days, mode, batch_size, pause, max_batches):
+    """Move old read notifications out of the live table and purge expired archive rows."""
+    from dreamloop.notifications import archive_notifications, purge_notification_archive
+    with app.app_context():
+        moved = archive_notifications(older_than_days, mode, batch_size, pause, max_batches)
+        purged = purge_notification_archive(batch_size=batch_size, pause=pause)
+    click.echo(f"Removed {moved} read notifications from the inbox; purged {purged} from the archive")
+
+@cli.command("partition_notification_archive")
+def partition_notification_archive_command():
+    """Convert notification_archive to monthly range partitions (Postgres)."""
+    from dreamloop.notifications import partition_notification_archive
+    with app.app_context():
+        changed = partition_notification_archive()
+    click.echo("Partitioned notification_archive by month" if changed
+               else "notification_archive is already partitioned")
+
+@cli.command("check_query_plans")
+@click.option('--users', default=200, help='Users in the generated dataset')
+@click.option('--dreams-per-user', default=50)
+@click.option('--notifications-per-user', default=100)
+def check_query_plans_command(users, dreams_per_user, notifications_per_user):
+    """Fail if any hot query plans a sequential scan on a generated dataset."""
+    from dreamloop.query_plans import check_query_plans
+    with app.app_context():
+        failures = check_query_plans(
+            num_users=users,
+            dreams_per_user=dreams_per_user,
+            notifications_per_user=notifications_per_user
+        )
+    for name, plan in failures.items():
+        click.echo(f"{name} uses a sequential scan: {' / '.join(plan)}", err=True)
+    if failures:
+        raise SystemExit(1)
+    click.echo("All hot queries use an index")
+
+@cli.command("rebuild_dream_patterns")
+@click.option('--user-id', type=int, default=None, help='Only rebuild this user')
+def rebuild_dream_patterns_command(user_id):
+    """Recompute the per-user dream pattern counters from the dream table."""
+    from dreamloop.dream_patterns import rebuild_dream_patterns
+    with app.app_context():
+        rebuilt = rebuild_dream_patterns(user_id)
+    click.echo(f"Rebuilt {rebuilt} dream pattern counters")
+
+@cli.command("benchmark_search")
+@click.option('--rows', default=1_000_000, help='Dreams to generate')
+@click.option('--queries', default=200, help='Searches to time')
+def benchmark_search_command(rows, queries):
+    """Measure search latency against a generated dataset (rolled back afterwards)."""
+    from dreamloop.search import benchmark_search
+    with app.app_context():
+        result = benchmark_search(rows=rows, queries=queries)
+    click.echo(f"{result['queries']} searches over {result['rows']} dreams: "
+               f"p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, max {result['max_ms']} ms")
+
+@cli.command("backfill_tags")
+@click.option('--batch-size', default=1000, help='Dreams per committed batch')
+def backfill_tags_command(batch_size):
+    """Build tag/dream_tag rows from the comma-joined Dream.tags column."""
+    from dreamloop.tags import backfill_dream_tags
+    with app.app_context():
+        total = backfill_dream_tags(batch_size)
+    click.echo(f"Backfilled tags for {total} dreams")
+
+@cli.command("backfill_analysis_html")
+@click.option('--batch-size', default=500, help='Dreams per committed batch')
+def backfill_analysis_html_command(batch_size):
+    """Render and store ai_analysis_html for dreams analysed before it existed."""
+    from dreamloop.markdown_cache import backfill_analysis_html, markdown_cache
+    with app.app_context():
+        total = backfill_analysis_html(batch_size)
+    stats = markdown_cache.stats()
+    click.echo(f"Rendered analysis HTML for {total} dreams "
+               f"(markdown cache hit rate {stats['hit_rate']}, {stats['weight']} bytes cached)")
+
+@cli.command("benchmark_password_hashing")
+@click.option('--method', default=None, help='Hash method to time (defaults to PASSWORD_HASH_METHOD)')
+@click.option('--seconds', default=5.0, help='Duration of each run')
+@click.option('--clients', default=None, type=int, help='Concurrent callers (defaults to twice the pool size)')
+def benchmark_password_hashing_command(method, seconds, clients):
+    """Measure logins per second per core with the configured hashing cost."""
+    from dreamloop.passwords import benchmark_password_hashing
+    with app.app_context():
+        result = benchmark_password_hashing(method, seconds, clients)
+    click.echo(f"{result['method']}: {result['hash_ms']} ms per hash, "
+               f"{result['single_thread_per_sec']} logins/s on one core")
+    click.echo(f"Pool of {result['workers']} with {result['clients']} clients: "
+               f"{result['pool_per_sec']} logins/s ({result['per_core_per_sec']} per core), "
+               f"{result['refused']} refused")
+
+@cli.command("run_analysis_worker")
+@click.option('--processes', default=2, help='Worker processes')
+@click.option('--threads', default=4, help='Concurrent jobs per process')
+@click.option('--burst', is_flag=True, help='Exit once the queue is empty')
+def run_analysis_worker_command(processes, threads, burst):
+    """Run queued AI dream analyses."""
+    from dreamloop.analysis_jobs import run_worker_pool
+    click.echo(f"Starting {processes} analysis worker processes with {threads} threads each")
+    run_worker_pool(processes, threads, burst=burst)
+
+@cli.command("run_llm_stub")
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8099)
+@click.option('--delay', default=0.5, help='Seconds before each answer')
+@click.option('--error-rate', default=0.0, help='Share of requests answered with a 503')
+@click.option('--hang-rate', default=0.0, help='Share of requests never answered')
+def run_llm_stub_command(host, port, delay, error_rate, hang_rate):
+    """Serve a fake OpenAI chat completions API for local runs (set OPENAI_BASE_URL to it)."""
+    from dreamloop.llm_stub import StubServer
+    server = StubServer((host, port), delay=delay, error_rate=error_rate, hang_rate=hang_rate)
+    click.echo(f"Stub model provider on http://{host}:{port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+@cli.command("benchmark_llm_client")
+@click.option('--requests', 'count', default=200, help='Model calls to make')
+@click.option('--concurrency', default=16, help='Concurrent callers')
+@click.option('--delay', default=0.05, help='Stub answer delay in seconds')
+@click.option('--error-rate', default=0.0, help='Share of stub answers that are 503s')
+@click.option('--hang-rate', default=0.0, help='Share of stub requests never answered')
+@click.option('--stream', is_flag=True, help='Use streamed completions')
+def benchmark_llm_client_command(count, concurrency, delay, error_rate, hang_rate, stream):
+    """Exercise the model client's retries, deadlines and breaker against a local stub."""
+    from dreamloop.llm_client import benchmark_llm_client
+    with app.app_context():
+        result = benchmark_llm_client(count, concurrency, delay, error_rate, hang_rate, stream)
+    client = result['client']
+    click.echo(f"{result['requests']} calls from {result['concurrency']} callers in {result['seconds']}s "
+               f"({result['per_sec']}/s) over {result['connections']} connections")
+    click.echo(f"Outcomes: {', '.join(f'{name} {n}' for name, n in sorted(result['outcomes'].items()))}")
+    click.echo(f"Latency p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, max {result['max_ms']} ms")
+    click.echo(f"Attempts {client['calls']}, retries {client['retries']}, failed fast {client['fast_failed']}, "
+               f"busy {client['busy']}, breaker {client['breaker']} after {client['breaker_trips']} trips")
+
+@cli.command("stress_ai_quota")
+@click.option('--threads', default=32, help='Concurrent callers')
+@click.option('--attempts', default=8, help='Reservations tried per caller')
+@click.option('--fail-rate', default=0.0, help='Share of granted analyses refunded as failures')
+def stress_ai_quota_command(threads, attempts, fail_rate):
+    """Check that concurrent reservations never overshoot the free analysis limit."""
+    from dreamloop.ai_quota import stress_ai_quota
+    with app.app_context():
+        result = stress_ai_quota(threads, attempts, fail_rate)
+    click.echo(f"{result['attempts']} reservations from {threads} threads in {result['seconds']}s: "
+               f"{result['kept']} kept, {result['refunded']} refunded, {result['refused']} refused, "
+               f"{result['errors']} errors")
+    click.echo(f"Stored count {result['stored_count']} (limit {result['limit']}): "
+               f"{'consistent' if result['consistent'] else 'INCONSISTENT'}")
+    if not result['consistent']:
+        raise SystemExit(1)
+
+@cli.command("score_dreams")
+@click.option('--batch-size', type=int, default=None, help='Defaults to SENTIMENT_BATCH_SIZE')
+@click.option('--rescore', is_flag=True, help='Score every dream again, e.g. after a lexicon change')
+def score_dreams_command(batch_size, rescore):
+    """Fill in sentiment, emotions and lucidity for dreams that have none."""
+    from dreamloop.sentiment import score_dreams
+    with app.app_context():
+        total = score_dreams(batch_size or app.config['SENTIMENT_BATCH_SIZE'], rescore)
+    click.echo(f"Scored {total} dreams")
+
+@cli.command("benchmark_sentiment")
+@click.option('--dreams', default=20000, help='Synthetic dreams to score')
+@click.option('--words', default=120, help='Words per dream')
+@click.option('--batch-size', type=int, default=None, help='Defaults to SENTIMENT_BATCH_SIZE')
+@click.option('--processes', default=1, help='Also score across this many processes')
+def benchmark_sentiment_command(dreams, words, batch_size, processes):
+    """Measure sentiment scoring throughput in dreams per second per core."""
+    from dreamloop.sentiment import benchmark_sentiment
+    result = benchmark_sentiment(dreams, batch_size or app.config['SENTIMENT_BATCH_SIZE'], words, processes)
+    click.echo(f"{result['dreams']} dreams of {result['words_per_dream']} words in batches of "
+               f"{result['batch_size']} (numpy {result['numpy']}): "
+               f"{result['single_core_per_sec']} dreams/s on one core, {result['us_per_dream']} us each")
+    if processes > 1:
+        click.echo(f"{result['processes']} processes: {result['pool_per_sec']} dreams/s "
+                   f"({result['per_core_per_sec']} per core)")
+
+@cli.command("prune_analysis_cache")
+@click.option('--max-rows', type=int, default=None, help='Defaults to ANALYSIS_CACHE_MAX_ROWS')
+@click.option('--ttl-days', type=int, default=None, help='Defaults to ANALYSIS_CACHE_TTL_DAYS')
+def prune_analysis_cache_command(max_rows, ttl_days):
+    """Drop expired and least recently used cached analyses."""
+    from dreamloop.analysis_cache import prune_analysis_cache
+    with app.app_context():
+        deleted = prune_analysis_cache(max_rows, ttl_days)
+    click.echo(f"Pruned {deleted} cached analyses")
+
+@cli.command("summarize_dreams")
+@click.option('--user-id', type=int, default=None, help='Only summarize this user\'s dreams')
+@click.option('--batch-size', default=200, help='Dreams loaded per batch')
+def summarize_dreams_command(user_id, batch_size):
+    """Precompute the per-dream summaries used by pattern analysis."""
+    from dreamloop.pattern_analysis import summarize_journal_backlog
+    with app.app_context():
+        total = summarize_journal_backlog(user_id, batch_size)
+    click.echo(f"Checked summaries of {total} dreams")
+
 if __name__ == "__main__":
     cli() 
\ No newline at end of file
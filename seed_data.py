@@ -3,7 +3,7 @@ from models import User, Dream, Comment, DreamGroup, GroupMembership
 from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash
 import random
-from ai_helper import analyze_dream
+from dreamloop.analysis_jobs import enqueue_analysis
 
 
 def create_users(num_users=5):
@@ -59,11 +59,14 @@ def create_dreams(users):
                           timedelta(days=random.randint(0, 30)),
                           mood=random.choice(moods),
                           tags="flying,adventure,nature",
-                          is_public=random.random() < 0.7,
-                          ai_analysis=analyze_dream(content))
+                          is_public=random.random() < 0.7)
             dreams.append(dream)
 
     db.session.add_all(dreams)
+    # Analyses are queued rather than run inline; `manage.py run_analysis_worker
+    # --burst` works through them.
+    for dream in dreams:
+        enqueue_analysis(dream, dream.user_id)
     db.session.commit()
     return dreams
 